@@ -0,0 +1,309 @@
+"""
+Локальные ответы чата на вопросы-агрегации без обращения к LLM.
+
+"Сколько я потратил на еду", "топ 3 магазина", "сколько ушло за последнюю
+неделю" - это просто суммы по транзакциям из /analyze. StatementIndex держит
+их в колоночном виде (numpy-массивы сумм, дней, категорий, мерчантов) с
+заранее посчитанными итогами по категориям, мерчантам и дням, а answer_question
+распознает такие вопросы регулярками на ru/kz/en. Все, что не распознано
+(советы, "почему", "как сэкономить"), по-прежнему уходит в DeepSeek.
+"""
+
+import re
+from datetime import date, datetime
+from typing import Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from categories import (
+    CATEGORY_KEYS,
+    LANG_NAMES,
+    category_key,
+    format_money,
+    match_category,
+    normalize_language,
+)
+
+TOP_MERCHANTS_DEFAULT = 3
+TOP_MERCHANTS_MAX = 10
+
+
+def _parse_date(value) -> int:
+    """Порядковый номер дня или 0, если дату не разобрать"""
+    for fmt in ("%d.%m.%Y", "%d.%m.%y"):
+        try:
+            return datetime.strptime(str(value), fmt).toordinal()
+        except ValueError:
+            continue
+    return 0
+
+
+def _day_label(day: int) -> str:
+    return date.fromordinal(day).strftime("%d.%m.%Y")
+
+
+class StatementIndex:
+    """Колоночное представление транзакций с индексами по категориям, мерчантам и дням"""
+
+    def __init__(self, transactions: Iterable[dict]):
+        amounts: List[float] = []
+        days: List[int] = []
+        categories: List[int] = []
+        merchants: List[str] = []
+        purchases: List[bool] = []
+        for txn in transactions:
+            if not isinstance(txn, dict):
+                continue
+            try:
+                amounts.append(float(txn.get("amount", 0)))
+            except (TypeError, ValueError):
+                continue
+            description = str(txn.get("description", "")).strip()
+            key = category_key(txn.get("category", "")) or match_category(description) or "other"
+            days.append(_parse_date(txn.get("date", "")))
+            categories.append(CATEGORY_KEYS.index(key))
+            merchants.append(description)
+            # Переводы людям и снятие наличных - не магазины (старые ответы без operation - покупки)
+            purchases.append((txn.get("operation") or "purchase") == "purchase")
+
+        self.amounts = np.array(amounts, dtype=np.float64)
+        self.days = np.array(days, dtype=np.int64)
+        self.categories = np.array(categories, dtype=np.int64)
+        self.purchases = np.array(purchases, dtype=bool)
+
+        # Мерчанты без учета регистра: "MAGNUM" и "Magnum" - один магазин
+        lowered = np.array([name.lower() for name in merchants], dtype=object)
+        names, first, self.merchants = np.unique(lowered, return_index=True, return_inverse=True)
+        self.merchant_keys = list(names)
+        self.merchant_names = [merchants[i] for i in first]
+        # Итоги мерчантов - только по покупкам
+        self.merchant_totals = np.bincount(
+            self.merchants[self.purchases], weights=self.amounts[self.purchases], minlength=len(names)
+        )
+        self.merchant_counts = np.bincount(self.merchants[self.purchases], minlength=len(names))
+        self.is_merchant = self.merchant_counts > 0
+
+        self.category_totals = np.bincount(self.categories, weights=self.amounts, minlength=len(CATEGORY_KEYS))
+        self.category_counts = np.bincount(self.categories, minlength=len(CATEGORY_KEYS))
+
+        # Итоги по дням в виде префиксных сумм: сумма за любой период - разность двух элементов
+        dated = self.days > 0
+        if dated.any():
+            self.first_day = int(self.days[dated].min())
+            self.last_day = int(self.days[dated].max())
+            offsets = self.days[dated] - self.first_day
+            span = self.last_day - self.first_day + 1
+            self.day_totals = np.r_[0.0, np.cumsum(np.bincount(offsets, weights=self.amounts[dated], minlength=span))]
+            self.day_counts = np.r_[0, np.cumsum(np.bincount(offsets, minlength=span))]
+        else:
+            self.first_day = self.last_day = 0
+            self.day_totals = np.zeros(1)
+            self.day_counts = np.zeros(1, dtype=np.int64)
+
+    def __len__(self) -> int:
+        return len(self.amounts)
+
+    def total(
+        self,
+        category: Optional[str] = None,
+        merchant: Optional[int] = None,
+        period: Optional[Tuple[int, int]] = None,
+    ) -> Tuple[float, int]:
+        """Сумма и число операций с фильтрами по категории, мерчанту и периоду (дни включительно)"""
+        if period is None:
+            if category is not None and merchant is None:
+                idx = CATEGORY_KEYS.index(category)
+                return float(self.category_totals[idx]), int(self.category_counts[idx])
+            if merchant is not None and category is None:
+                return float(self.merchant_totals[merchant]), int(self.merchant_counts[merchant])
+            if category is None and merchant is None:
+                return float(self.amounts.sum()), len(self)
+        elif category is None and merchant is None:
+            start = max(period[0], self.first_day) - self.first_day
+            stop = min(period[1], self.last_day) - self.first_day + 1
+            if not self.first_day or stop <= start:
+                return 0.0, 0
+            return (
+                float(self.day_totals[stop] - self.day_totals[start]),
+                int(self.day_counts[stop] - self.day_counts[start]),
+            )
+
+        mask = np.ones(len(self), dtype=bool)
+        if category is not None:
+            mask &= self.categories == CATEGORY_KEYS.index(category)
+        if merchant is not None:
+            mask &= (self.merchants == merchant) & self.purchases
+        if period is not None:
+            mask &= (self.days >= period[0]) & (self.days <= period[1])
+        return float(self.amounts[mask].sum()), int(mask.sum())
+
+    def top_merchants(self, n: int) -> List[Tuple[str, float, int]]:
+        order = np.flatnonzero(self.is_merchant)
+        order = order[np.argsort(-self.merchant_totals[order], kind="stable")][:n]
+        return [(self.merchant_names[i], float(self.merchant_totals[i]), int(self.merchant_counts[i])) for i in order]
+
+    def largest(self) -> Optional[int]:
+        return int(self.amounts.argmax()) if len(self) else None
+
+    def find_merchant(self, text: str, purchases_only: bool = True) -> Optional[int]:
+        """
+        Самый длинный мерчант, название которого целиком встречается в вопросе;
+        purchases_only=False - еще и получатели переводов и снятий.
+        """
+        best = None
+        for i, name in enumerate(self.merchant_keys):
+            if purchases_only and not self.is_merchant[i]:
+                continue
+            if len(name) >= 3 and name in text and (best is None or len(name) > len(self.merchant_keys[best])):
+                best = i
+        return best
+
+
+# --- Распознавание вопросов ---
+
+# Вопросы за советом и объяснением не считаем локально, даже если в них есть суммы
+ADVICE_RE = re.compile(
+    r"совет|посовет|почему|зачем|как (мне )?(сэконом|эконом|сократ|уменьш|накоп)|стоит ли|нормально ли"
+    r"|advice|advise|\bwhy\b|\bshould\b|how (can|do) i|\bsave\b|\breduce\b"
+    r"|кеңес|неге|қалай"
+)
+# Будущее, прогноз и накопления: прошлые суммы на них не отвечают, это вопросы к LLM
+FUTURE_RE = re.compile(
+    r"следующ|будущ|потрачу|прогноз|накоп|отклад"
+    r"|\bwill\b|\bnext\b|forecast|\bsav(e|es|ing)\b"
+    r"|келесі|болашақ|болжам|жинақ"
+)
+AMOUNT_RE = re.compile(r"сколько|сумм|потрат|ушло|how much|\bspent?\b|\btotal\b|қанша|жұмса")
+TOTAL_RE = re.compile(r"всего|в целом|итого|за весь|\btotal\b|overall|in total|барлығы|жалпы|барлық")
+TOP_RE = re.compile(r"\bтоп\b|\btop\b|самы[ехй] (частые|дорогие|популярные)|ең көп")
+MERCHANT_WORD_RE = re.compile(r"\b(?:магазин|мерчант|продав|мест|merchant|store|shop|place|дүкен|жер)")
+LARGEST_RE = re.compile(r"сам(ая|ую|ой) (больш|крупн|дорог)|крупнейш|biggest|largest|most expensive|ең (үлкен|ірі|қымбат)")
+# N для топа - только число рядом с "топ"/"top": "топ 3", "top-5", "5 top"; "last 30 days" - это период
+TOP_N_RE = re.compile(r"\b(?:топ|top)[\s-]*(\d{1,2})\b|\b(\d{1,2})[\s-]*(?:топ|top)\b")
+
+PERIOD_PATTERNS = (
+    (re.compile(r"(?:последн\w*|last|соңғы)\s+(\d{1,3})\s*(?:дн|день|days?|күн)"), None),
+    (re.compile(r"сегодня|today|бүгін"), 1),
+    (re.compile(r"недел|week|апта"), 7),
+    (re.compile(r"месяц|month|\bай(да|ы)?\b"), 30),
+)
+YESTERDAY_RE = re.compile(r"вчера|yesterday|кеше")
+
+# Слова, по которым узнаем категорию; порядок важен - фастфуд раньше продуктов ("жылдам тағам")
+CATEGORY_WORDS = (
+    ("credit", r"кредит|рассроч|credit|loan|installment|бөліп|несие"),
+    ("fastfood", r"фастфуд|fast ?food|кафе|ресторан|бургер|жылдам тағам|cafe|restaurant"),
+    ("products", r"продукт|\bед[аыуе]\b|food|grocer|азық|тағам|тауар"),
+    ("taxi", r"такси|taxi|\bcabs?\b"),
+    ("entertainment", r"развлеч|entertainment|\bfun\b|кино|игр|games?|ойын"),
+    ("other", r"прочее|прочие|\bother\b|басқа"),
+)
+_CATEGORY_RES = tuple((key, re.compile(words)) for key, words in CATEGORY_WORDS)
+
+ANSWERS = {
+    "ru": {
+        "category": "На «{name}» вы потратили {amount}{period} (операций: {count}).",
+        "merchant": "В {name} вы потратили {amount}{period} (операций: {count}).",
+        "total": "Всего вы потратили {amount}{period} (операций: {count}).",
+        "top": "Топ-{n} по тратам:\n{rows}",
+        "top_row": "{i}. {name} — {amount} (операций: {count})",
+        "largest": "Самая крупная трата: {name}, {amount} ({date}).",
+        "days": " за последние {days} дн. выписки (по {end})",
+        "day": " за {day}",
+    },
+    "kz": {
+        "category": "«{name}» санатына {amount} жұмсадыңыз{period} ({count} операция).",
+        "merchant": "{name} үшін {amount} жұмсадыңыз{period} ({count} операция).",
+        "total": "Барлығы {amount} жұмсадыңыз{period} ({count} операция).",
+        "top": "Шығын бойынша топ-{n}:\n{rows}",
+        "top_row": "{i}. {name} — {amount} ({count} операция)",
+        "largest": "Ең ірі шығын: {name}, {amount} ({date}).",
+        "days": " үзіндінің соңғы {days} күнінде ({end} дейін)",
+        "day": " {day} күні",
+    },
+    "en": {
+        "category": "You spent {amount} on {name}{period} ({count} transactions).",
+        "merchant": "You spent {amount} at {name}{period} ({count} transactions).",
+        "total": "You spent {amount} in total{period} ({count} transactions).",
+        "top": "Top {n} places by spending:\n{rows}",
+        "top_row": "{i}. {name} — {amount} ({count} transactions)",
+        "largest": "Your largest expense: {name}, {amount} ({date}).",
+        "days": " over the last {days} days of the statement (to {end})",
+        "day": " on {day}",
+    },
+}
+
+
+def _period(text: str, index: StatementIndex, texts: dict) -> Tuple[Optional[Tuple[int, int]], str]:
+    """Период относительно последней даты выписки и его описание для ответа"""
+    if not index.last_day:
+        return None, ""
+    if YESTERDAY_RE.search(text):
+        day = index.last_day - 1
+        return (day, day), texts["day"].format(day=_day_label(day))
+    for pattern, days in PERIOD_PATTERNS:
+        match = pattern.search(text)
+        if match:
+            days = days or max(int(match.group(1)), 1)
+            period = (index.last_day - days + 1, index.last_day)
+            return period, texts["days"].format(days=days, end=_day_label(index.last_day))
+    return None, ""
+
+
+def _category(text: str) -> Optional[str]:
+    for key, pattern in _CATEGORY_RES:
+        if pattern.search(text):
+            return key
+    return None
+
+
+def answer_question(question: str, index: StatementIndex, language: str = "ru") -> Optional[str]:
+    """Готовый ответ на вопрос-агрегацию или None, если вопрос нужно отдать LLM"""
+    text = question.lower()
+    if not len(index) or ADVICE_RE.search(text) or FUTURE_RE.search(text):
+        return None
+    lang = normalize_language(language)
+    texts = ANSWERS[lang]
+
+    if TOP_RE.search(text) and MERCHANT_WORD_RE.search(text):
+        number = TOP_N_RE.search(text)
+        n = min(int(number.group(1) or number.group(2)) if number else TOP_MERCHANTS_DEFAULT, TOP_MERCHANTS_MAX)
+        rows = [
+            texts["top_row"].format(i=i, name=name, amount=format_money(amount), count=count)
+            for i, (name, amount, count) in enumerate(index.top_merchants(max(n, 1)), start=1)
+        ]
+        return texts["top"].format(n=len(rows), rows="\n".join(rows))
+
+    if LARGEST_RE.search(text):
+        i = index.largest()
+        return texts["largest"].format(
+            name=index.merchant_names[index.merchants[i]],
+            amount=format_money(index.amounts[i]),
+            date=_day_label(int(index.days[i])) if index.days[i] else "-",
+        )
+
+    if not AMOUNT_RE.search(text):
+        return None
+    period, period_text = _period(text, index, texts)
+
+    merchant = index.find_merchant(text)
+    if merchant is None and index.find_merchant(text, purchases_only=False) is not None:
+        # Вопрос про перевод конкретному человеку - не сумма по магазину, отдаем LLM
+        return None
+    if merchant is not None:
+        amount, count = index.total(merchant=merchant, period=period)
+        return texts["merchant"].format(
+            name=index.merchant_names[merchant], amount=format_money(amount), period=period_text, count=count
+        )
+
+    category = _category(text)
+    if category is not None:
+        amount, count = index.total(category=category, period=period)
+        return texts["category"].format(
+            name=LANG_NAMES[lang][category], amount=format_money(amount), period=period_text, count=count
+        )
+
+    if period is not None or TOTAL_RE.search(text):
+        amount, count = index.total(period=period)
+        return texts["total"].format(amount=format_money(amount), period=period_text, count=count)
+    return None
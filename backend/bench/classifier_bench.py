@@ -0,0 +1,49 @@
+"""
+Throughput of the in-process expense classifier for growing batch sizes.
+
+    python bench/classifier_bench.py --sizes 1 10 100 1000 10000 100000
+"""
+
+import argparse
+import csv
+import random
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from classifier import load_classifier  # noqa: E402
+from train_model import DATA_PATH  # noqa: E402
+
+NOISE = ["Almaty", "KZ", "TOO", "ИП", "оплата", "покупка", "Kaspi", "QR"]
+
+
+def sample_descriptions(count: int, seed: int = 0) -> list:
+    with DATA_PATH.open("r", encoding="utf-8") as f:
+        base = [row["description"] for row in csv.DictReader(f)]
+    rng = random.Random(seed)
+    return [f"{rng.choice(base)} {rng.choice(NOISE)}" for _ in range(count)]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Скорость пакетной классификации")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1, 10, 100, 1000, 10000, 100000])
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    model = load_classifier()
+    if model is None:
+        sys.exit(1)
+    for size in args.sizes:
+        batch = sample_descriptions(size)
+        best = float("inf")
+        for _ in range(args.repeat):
+            started = time.perf_counter()
+            model.predict(batch)
+            best = min(best, time.perf_counter() - started)
+        print(f"batch={size:<7} {size / best:12,.0f} rows/s  ({best * 1000:8.2f} ms)")
+
+
+if __name__ == "__main__":
+    main()
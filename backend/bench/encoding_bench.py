@@ -0,0 +1,74 @@
+"""
+Payload size and encode time of the /analyze response in every encoding the
+backend can negotiate (encoding.py): plain JSON via the stdlib and via the
+fast encoder, columnar JSON, MessagePack (if installed), each raw and
+compressed with gzip / brotli (if installed).
+
+Results are built locally from synthetic statements, no server needed:
+
+    python bench/encoding_bench.py --pages 1 10 50
+"""
+
+import argparse
+import gzip
+import json
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import encoding  # noqa: E402
+from kaspi_parser import build_result, parse_statement  # noqa: E402
+from synthetic_statement import ROWS_PER_PAGE, generate_rows  # noqa: E402
+
+
+def make_result(pages: int, seed: int = 0) -> dict:
+    statement = parse_statement("\n".join(generate_rows(pages * ROWS_PER_PAGE, seed=seed)))
+    return build_result(statement.transactions, "ru", advice="Совет")
+
+
+def timed(func, repeat: int):
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        value = func()
+        best = min(best, time.perf_counter() - started)
+    return value, best
+
+
+def encoders():
+    yield "json (stdlib)", lambda r: json.dumps(r, ensure_ascii=False).encode("utf-8")
+    if encoding.orjson is not None:
+        yield "json (orjson)", lambda r: encoding.orjson.dumps(r)
+    yield "columnar json", lambda r: encoding.dumps(encoding.to_columnar(r))
+    if encoding.msgpack is not None:
+        yield "columnar msgpack", lambda r: encoding.msgpack.packb(encoding.to_columnar(r), use_bin_type=True)
+
+
+def compressors():
+    yield "raw", lambda body: body
+    yield "gzip", lambda body: gzip.compress(body, compresslevel=encoding.GZIP_LEVEL, mtime=0)
+    if encoding.brotli is not None:
+        yield "br", lambda body: encoding.brotli.compress(body, quality=encoding.BROTLI_QUALITY)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Размер и скорость кодирования ответа /analyze")
+    parser.add_argument("--pages", type=int, nargs="+", default=[1, 10, 50])
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    for pages in args.pages:
+        result = make_result(pages)
+        print(f"\npages={pages} transactions={len(result['transactions'])}")
+        for name, encode in encoders():
+            body, encode_seconds = timed(lambda: encode(result), args.repeat)
+            for compression, compress in compressors():
+                packed, compress_seconds = timed(lambda: compress(body), args.repeat)
+                total_ms = (encode_seconds + compress_seconds) * 1000
+                print(f"  {name:<18} {compression:<5} {len(packed):>9,} B  {total_ms:8.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+"""
+LLM gateway against a misbehaving stub: injected 429s, 503s and slow tails.
+
+Spawns bench/stub_llm.py with the given fault ratios, sends concurrent
+requests through llm_gateway.LLMGateway and reports how many succeeded,
+how many retries and hedges it took, latency percentiles and the breaker state:
+
+    python bench/gateway_bench.py --requests 200 --rate-limit-ratio 0.2 --tail-ratio 0.05 --hedge-after 1.5
+    python bench/gateway_bench.py --error-ratio 1.0   # провайдер лежит: breaker открывается
+"""
+
+import argparse
+import asyncio
+import statistics
+import sys
+import time
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(BACKEND_DIR))
+
+from llm_gateway import LLMError, LLMGateway  # noqa: E402
+from load_test import spawn, wait_ready  # noqa: E402
+
+STUB_PORT = 9102
+
+
+async def run(args) -> None:
+    gateway = LLMGateway(
+        "stub",
+        f"http://127.0.0.1:{STUB_PORT}/v1",
+        rate_per_second=args.rate,
+        burst=args.concurrency,
+        hedge_after=args.hedge_after,
+        breaker_failures=args.breaker_failures,
+    )
+    semaphore = asyncio.Semaphore(args.concurrency)
+    latencies, failures = [], {}
+
+    async def one() -> None:
+        async with semaphore:
+            started = time.perf_counter()
+            try:
+                await gateway.complete(
+                    deadline=time.monotonic() + args.deadline,
+                    model="deepseek-chat",
+                    messages=[{"role": "user", "content": "Сколько я потратил?"}],
+                    max_tokens=50,
+                )
+            except LLMError as e:
+                failures[type(e).__name__] = failures.get(type(e).__name__, 0) + 1
+            else:
+                latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(args.requests)))
+    wall = time.perf_counter() - started
+    await gateway.close()
+
+    print(f"requests     {args.requests}, ok {len(latencies)}, failed {failures or 0}")
+    print(f"wall         {wall:.2f} s")
+    if latencies:
+        latencies.sort()
+        p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+        print(f"latency      p50 {statistics.median(latencies):.2f} s  p99 {p99:.2f} s  max {latencies[-1]:.2f} s")
+    print(f"gateway      {gateway.snapshot()}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="LLM-шлюз против стаба с отказами")
+    parser.add_argument("--requests", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--latency", type=float, default=0.2, help="обычная задержка стаба, сек")
+    parser.add_argument("--rate-limit-ratio", type=float, default=0.2)
+    parser.add_argument("--error-ratio", type=float, default=0.0)
+    parser.add_argument("--tail-ratio", type=float, default=0.05)
+    parser.add_argument("--tail-latency", type=float, default=5.0)
+    parser.add_argument("--hedge-after", type=float, default=0.0, help="0 - без hedging")
+    parser.add_argument("--rate", type=float, default=0.0, help="token bucket, запросов/с (0 - без ограничения)")
+    parser.add_argument("--deadline", type=float, default=30.0)
+    parser.add_argument("--breaker-failures", type=int, default=5)
+    args = parser.parse_args()
+
+    stub = spawn([
+        "bench/stub_llm.py", "--port", str(STUB_PORT),
+        "--latency", str(args.latency),
+        "--rate-limit-ratio", str(args.rate_limit_ratio),
+        "--error-ratio", str(args.error_ratio),
+        "--tail-ratio", str(args.tail_ratio),
+        "--tail-latency", str(args.tail_latency),
+    ])
+    try:
+        asyncio.run(wait_ready(f"http://127.0.0.1:{STUB_PORT}/docs"))
+        asyncio.run(run(args))
+    finally:
+        stub.terminate()
+
+
+if __name__ == "__main__":
+    main()
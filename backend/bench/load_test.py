@@ -0,0 +1,360 @@
+"""
+Load benchmark for /analyze and /chat against a local LLM stub.
+
+By default spawns the stub (bench/stub_llm.py) and the backend (main:app)
+as subprocesses, then for every endpoint and concurrency level fires
+requests and reports latency percentiles, throughput and the CPU and RSS
+of the server process tree (read from /proc, so Linux only). Every
+/analyze request uploads a different synthetic statement and every /chat
+request asks a different question, so the result cache and single-flight
+do not hide the real cost; --same-request measures exactly those paths.
+
+--output saves the run as JSON together with the commit it was measured
+on, --baseline prints the change against such a file:
+
+    python bench/load_test.py --endpoint chat,analyze --concurrency 1,8,32 --output runs/$(git rev-parse --short HEAD).json
+    python bench/load_test.py --endpoint analyze --pages 50 --tokens-per-second 60 --baseline runs/abc1234.json
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import httpx
+
+from synthetic_statement import make_statement_pdf
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+
+
+def spawn(args, env=None):
+    return subprocess.Popen(
+        [sys.executable, *args],
+        cwd=BACKEND_DIR,
+        env={**os.environ, **(env or {})},
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+
+
+async def wait_ready(url: str, timeout: float = 20.0) -> None:
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient() as http:
+        while time.monotonic() < deadline:
+            try:
+                await http.get(url)
+                return
+            except httpx.TransportError:
+                await asyncio.sleep(0.1)
+    raise RuntimeError(f"{url} не поднялся за {timeout} с")
+
+
+def percentile(sorted_values: List[float], q: float) -> float:
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * q))]
+
+
+class ProcessSampler:
+    """
+    CPU time and RSS of a process and its children (PDF workers) from /proc.
+    Without /proc (macOS, --base-url without --server-pid) reports nothing.
+    """
+
+    def __init__(self, pid: Optional[int], interval: float = 0.2):
+        self.pid = pid
+        self.interval = interval
+        self.enabled = pid is not None and Path(f"/proc/{pid}/stat").exists()
+        self._ticks = os.sysconf("SC_CLK_TCK") if self.enabled else 1
+        self._page_kb = os.sysconf("SC_PAGE_SIZE") // 1024 if self.enabled else 1
+
+    @staticmethod
+    def _stat(pid: int) -> Optional[List[str]]:
+        try:
+            raw = Path(f"/proc/{pid}/stat").read_text()
+        except OSError:
+            return None
+        # Имя процесса в скобках может содержать пробелы
+        return raw[raw.rindex(")") + 2:].split()
+
+    def _family(self) -> List[List[str]]:
+        stats = []
+        root = self._stat(self.pid)
+        if root is not None:
+            stats.append(root)
+        for entry in Path("/proc").iterdir():
+            if entry.name.isdigit() and int(entry.name) != self.pid:
+                fields = self._stat(int(entry.name))
+                if fields is not None and int(fields[1]) == self.pid:
+                    stats.append(fields)
+        return stats
+
+    def sample(self) -> Dict[str, float]:
+        """cpu_seconds (utime + stime) and rss_mb summed over the process tree"""
+        family = self._family()
+        cpu = sum(int(f[11]) + int(f[12]) for f in family) / self._ticks
+        rss = sum(int(f[21]) for f in family) * self._page_kb / 1024
+        return {"cpu_seconds": cpu, "rss_mb": rss}
+
+    async def watch(self, stop: asyncio.Event) -> Dict[str, float]:
+        if not self.enabled:
+            return {}
+        first = self.sample()
+        started = time.perf_counter()
+        peak = first["rss_mb"]
+        while not stop.is_set():
+            await asyncio.sleep(self.interval)
+            peak = max(peak, self.sample()["rss_mb"])
+        last = self.sample()
+        wall = time.perf_counter() - started
+        cpu = last["cpu_seconds"] - first["cpu_seconds"]
+        return {
+            "cpu_seconds": round(cpu, 3),
+            "cpu_percent": round(cpu / wall * 100, 1) if wall else 0.0,
+            "rss_start_mb": round(first["rss_mb"], 1),
+            "rss_peak_mb": round(max(peak, last["rss_mb"]), 1),
+        }
+
+
+class RequestFactory:
+    """Bodies for successive requests; unique by default so caches stay cold"""
+
+    def __init__(self, pages: int, noise: float, question: str, same_request: bool):
+        self.pages = pages
+        self.noise = noise
+        self.question = question
+        self.same_request = same_request
+        self.context_id = ""
+        self._counter = 0
+        self._pdf_cache: Dict[int, bytes] = {}
+
+    def next_seed(self) -> int:
+        self._counter += 1
+        return 0 if self.same_request else self._counter
+
+    def pdf(self, seed: int) -> bytes:
+        if seed not in self._pdf_cache:
+            self._pdf_cache[seed] = make_statement_pdf(self.pages, seed=seed, noise=self.noise)
+        return self._pdf_cache[seed]
+
+    def prepare(self, endpoint: str, total: int) -> List[int]:
+        """Seeds for the next total requests; PDFs are generated before the clock starts"""
+        seeds = [self.next_seed() for _ in range(total)]
+        if endpoint == "analyze":
+            for seed in seeds:
+                self.pdf(seed)
+        return seeds
+
+    async def send(self, http: httpx.AsyncClient, endpoint: str, seed: int) -> httpx.Response:
+        if endpoint == "chat":
+            question = self.question if self.same_request else f"{self.question} (#{seed})"
+            return await http.post("/chat", json={
+                "question": question,
+                "context_id": self.context_id,
+                "language": "ru",
+            })
+        return await http.post(
+            "/analyze",
+            params={"language": "ru"},
+            files={"file": ("statement.pdf", self.pdf(seed), "application/pdf")},
+        )
+
+
+async def probe_health(http: httpx.AsyncClient, stop: asyncio.Event, samples: list) -> None:
+    """Пингует /health во время нагрузки: если event loop заблокирован, задержка растет"""
+    while not stop.is_set():
+        started = time.perf_counter()
+        await http.get("/health")
+        samples.append(time.perf_counter() - started)
+        await asyncio.sleep(0.05)
+
+
+async def run_load(
+    http: httpx.AsyncClient,
+    factory: RequestFactory,
+    sampler: ProcessSampler,
+    endpoint: str,
+    total: int,
+    concurrency: int,
+) -> dict:
+    seeds = factory.prepare(endpoint, total)
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies: List[float] = []
+    errors: Dict[str, int] = {}
+
+    async def bounded(seed: int) -> None:
+        async with semaphore:
+            started = time.perf_counter()
+            try:
+                response = await factory.send(http, endpoint, seed)
+                response.raise_for_status()
+            except httpx.HTTPError as e:
+                key = str(e.response.status_code) if isinstance(e, httpx.HTTPStatusError) else type(e).__name__
+                errors[key] = errors.get(key, 0) + 1
+            else:
+                latencies.append(time.perf_counter() - started)
+
+    stop = asyncio.Event()
+    health_samples: list = []
+    prober = asyncio.create_task(probe_health(http, stop, health_samples))
+    watcher = asyncio.create_task(sampler.watch(stop))
+    started = time.perf_counter()
+    await asyncio.gather(*(bounded(seed) for seed in seeds))
+    wall = time.perf_counter() - started
+    stop.set()
+    await prober
+    resources = await watcher
+
+    latencies.sort()
+    return {
+        "endpoint": endpoint,
+        "requests": total,
+        "concurrency": concurrency,
+        "ok": len(latencies),
+        "errors": errors,
+        "wall_seconds": round(wall, 3),
+        "rps": round(len(latencies) / wall, 2) if wall else 0.0,
+        "latency_p50": round(percentile(latencies, 0.50), 4),
+        "latency_p95": round(percentile(latencies, 0.95), 4),
+        "latency_p99": round(percentile(latencies, 0.99), 4),
+        "latency_max": round(latencies[-1], 4) if latencies else 0.0,
+        "health_max": round(max(health_samples), 4) if health_samples else 0.0,
+        **resources,
+    }
+
+
+async def run_suite(args, base_url: str, sampler: ProcessSampler) -> List[dict]:
+    factory = RequestFactory(args.pages, args.noise, args.question, args.same_request)
+    max_concurrency = max(args.concurrency)
+    limits = httpx.Limits(max_connections=max_concurrency + 2)
+    results = []
+    async with httpx.AsyncClient(base_url=base_url, timeout=600, limits=limits) as http:
+        if "chat" in args.endpoint:
+            # Чат работает по context_id уже разобранной выписки, как мобильный клиент
+            response = await factory.send(http, "analyze", factory.next_seed())
+            response.raise_for_status()
+            factory.context_id = response.json().get("context_id", "")
+        for endpoint in args.endpoint:
+            for concurrency in args.concurrency:
+                total = args.requests or concurrency * 4
+                report = await run_load(http, factory, sampler, endpoint, total, concurrency)
+                print_report(report)
+                results.append(report)
+    return results
+
+
+def print_report(report: dict) -> None:
+    print(f"{report['endpoint']}: {report['requests']} запросов, concurrency={report['concurrency']}")
+    print(f"  wall:        {report['wall_seconds']:.2f} s  ({report['rps']:.1f} req/s), ok {report['ok']}, errors {report['errors'] or 0}")
+    print(
+        f"  latency:     p50={report['latency_p50']:.3f} s  p95={report['latency_p95']:.3f} s  "
+        f"p99={report['latency_p99']:.3f} s  max={report['latency_max']:.3f} s"
+    )
+    print(f"  /health max: {report['health_max'] * 1000:.1f} ms")
+    if "cpu_percent" in report:
+        print(f"  server:      CPU {report['cpu_percent']:.0f}% ({report['cpu_seconds']:.2f} s), RSS peak {report['rss_peak_mb']:.0f} MB")
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND_DIR, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+
+
+def compare(results: List[dict], baseline_path: Path) -> None:
+    """Изменение p50/p99/rps/RSS относительно прошлого прогона с теми же endpoint и concurrency"""
+    baseline = json.loads(baseline_path.read_text())
+    previous = {(r["endpoint"], r["concurrency"]): r for r in baseline["results"]}
+    print(f"\nСравнение с {baseline_path} (commit {baseline.get('commit') or '?'}):")
+    for report in results:
+        old = previous.get((report["endpoint"], report["concurrency"]))
+        if old is None:
+            continue
+        changes = []
+        for key in ("latency_p50", "latency_p99", "rps", "rss_peak_mb"):
+            if old.get(key) and key in report:
+                changes.append(f"{key} {(report[key] - old[key]) / old[key] * 100:+.1f}%")
+        print(f"  {report['endpoint']} c={report['concurrency']}: " + ", ".join(changes))
+
+
+def parse_list(value: str, cast=str) -> list:
+    return [cast(item) for item in value.split(",") if item]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Нагрузочный тест /analyze и /chat")
+    parser.add_argument("--endpoint", type=parse_list, default=["chat"], help="chat, analyze или chat,analyze")
+    parser.add_argument("--concurrency", type=lambda v: parse_list(v, int), default=[32], help="например 1,8,32")
+    parser.add_argument("--requests", type=int, default=0, help="запросов на уровень (0 - 4 x concurrency)")
+    parser.add_argument("--pages", type=int, default=2, help="страниц в синтетической выписке (1-100)")
+    parser.add_argument("--noise", type=float, default=0.0, help="доля строк выписки, которые уйдут в LLM")
+    parser.add_argument("--question", default="Как мне сократить расходы в следующем месяце?")
+    parser.add_argument("--same-request", action="store_true", help="одинаковые запросы: кэш и single-flight")
+    parser.add_argument("--latency", type=float, default=1.0, help="задержка заглушки LLM, сек")
+    parser.add_argument("--tokens-per-second", type=float, default=0.0, help="скорость генерации заглушки")
+    parser.add_argument("--base-url", default=None, help="уже запущенный бэкенд (без spawn)")
+    parser.add_argument("--server-pid", type=int, default=None, help="PID бэкенда из --base-url для CPU/RSS")
+    parser.add_argument("--output", type=Path, default=None, help="сохранить результаты в JSON")
+    parser.add_argument("--baseline", type=Path, default=None, help="JSON прошлого прогона для сравнения")
+    args = parser.parse_args()
+    for endpoint in args.endpoint:
+        if endpoint not in ("chat", "analyze"):
+            parser.error(f"неизвестный endpoint: {endpoint}")
+
+    procs = []
+    base_url = args.base_url
+    server_pid = args.server_pid
+    try:
+        if base_url is None:
+            procs.append(spawn([
+                "bench/stub_llm.py", "--port", "9100",
+                "--latency", str(args.latency),
+                "--tokens-per-second", str(args.tokens_per_second),
+            ]))
+            server = spawn(
+                ["-m", "uvicorn", "main:app", "--port", "8100", "--log-level", "warning"],
+                env={"DEEPSEEK_API_KEY": "stub", "DEEPSEEK_BASE_URL": "http://127.0.0.1:9100/v1"},
+            )
+            procs.append(server)
+            server_pid = server.pid
+            base_url = "http://127.0.0.1:8100"
+            asyncio.run(wait_ready("http://127.0.0.1:9100/docs"))
+            asyncio.run(wait_ready(f"{base_url}/health"))
+
+        results = asyncio.run(run_suite(args, base_url, ProcessSampler(server_pid)))
+    finally:
+        for proc in procs:
+            proc.terminate()
+            proc.wait()
+
+    if args.output is not None:
+        args.output.parent.mkdir(parents=True, exist_ok=True)
+        args.output.write_text(json.dumps({
+            "commit": git_commit(),
+            "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "host": {"python": platform.python_version(), "cpus": os.cpu_count(), "machine": platform.machine()},
+            "params": {
+                key: value for key, value in vars(args).items()
+                if key not in ("output", "baseline", "base_url", "server_pid")
+            },
+            "results": results,
+        }, ensure_ascii=False, indent=2))
+        print(f"\nРезультаты сохранены в {args.output}")
+    if args.baseline is not None:
+        compare(results, args.baseline)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+"""
+Peak server memory under concurrent large uploads, with and without the
+in-flight upload budget (uploads.UploadBudget).
+
+For every budget the backend is started fresh, then for every concurrency
+level that many different padded statements (--size-mb each) are posted
+to /analyze at once. The report shows the peak RSS of the server process
+tree, the upload bytes the budget let in at once (/health) and how many
+requests got 503 instead of pushing memory further:
+
+    python bench/memory_bench.py --size-mb 20 --concurrency 1,4,8 --budget-mb 0,48
+    python bench/memory_bench.py --budget-mb 48 --queue-seconds 60   # ждать, а не отказывать
+"""
+
+import argparse
+import asyncio
+import json
+from pathlib import Path
+
+import httpx
+
+from load_test import ProcessSampler, parse_list, spawn, wait_ready
+from synthetic_statement import make_statement_pdf
+
+STUB_PORT = 9103
+SERVER_PORT = 8103
+UNLIMITED_BYTES = 1 << 50
+
+
+async def burst(base_url: str, sampler: ProcessSampler, pdfs) -> dict:
+    async with httpx.AsyncClient(base_url=base_url, timeout=600) as http:
+        stop = asyncio.Event()
+        watcher = asyncio.create_task(sampler.watch(stop))
+        responses = await asyncio.gather(*(
+            http.post("/analyze", files={"file": ("statement.pdf", pdf, "application/pdf")})
+            for pdf in pdfs
+        ))
+        stop.set()
+        resources = await watcher
+        uploads = (await http.get("/health")).json()["uploads"]
+    statuses = {}
+    for response in responses:
+        statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+    return {
+        "statuses": statuses,
+        "budget_peak_mb": round(uploads["peak_bytes"] / 1024 / 1024, 1),
+        "rss_start_mb": resources.get("rss_start_mb"),
+        "rss_peak_mb": resources.get("rss_peak_mb"),
+    }
+
+
+def run_budget(args, budget_mb: float, seed: int) -> list:
+    budget = int(budget_mb * 1024 * 1024) if budget_mb > 0 else UNLIMITED_BYTES
+    server = spawn(
+        ["-m", "uvicorn", "main:app", "--port", str(SERVER_PORT), "--log-level", "warning"],
+        env={
+            "DEEPSEEK_API_KEY": "stub",
+            "DEEPSEEK_BASE_URL": f"http://127.0.0.1:{STUB_PORT}/v1",
+            "UPLOAD_INFLIGHT_BYTES": str(budget),
+            "UPLOAD_QUEUE_SECONDS": str(args.queue_seconds),
+            "UPLOAD_MAX_BYTES": str(int((args.size_mb + 5) * 1024 * 1024)),
+        },
+    )
+    base_url = f"http://127.0.0.1:{SERVER_PORT}"
+    results = []
+    try:
+        asyncio.run(wait_ready(f"{base_url}/health"))
+        sampler = ProcessSampler(server.pid)
+        for concurrency in args.concurrency:
+            pdfs = [make_statement_pdf(args.pages, seed=seed + i, padding=int(args.size_mb * 1024 * 1024)) for i in range(concurrency)]
+            seed += concurrency
+            report = {"budget_mb": budget_mb or None, "concurrency": concurrency, **asyncio.run(burst(base_url, sampler, pdfs))}
+            label = f"{budget_mb:g} MB" if budget_mb > 0 else "off"
+            print(
+                f"budget {label:>7}  c={concurrency:<3} RSS {report['rss_start_mb']} -> {report['rss_peak_mb']} MB  "
+                f"budget peak {report['budget_peak_mb']} MB  statuses {report['statuses']}"
+            )
+            results.append(report)
+    finally:
+        server.terminate()
+        server.wait()
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Пиковая память при параллельных больших загрузках")
+    parser.add_argument("--size-mb", type=float, default=20.0, help="размер каждой выписки")
+    parser.add_argument("--pages", type=int, default=5)
+    parser.add_argument("--concurrency", type=lambda v: parse_list(v, int), default=[1, 4, 8])
+    parser.add_argument("--budget-mb", type=lambda v: parse_list(v, float), default=[0.0, 48.0], help="0 - без бюджета")
+    parser.add_argument("--queue-seconds", type=float, default=0.0, help="UPLOAD_QUEUE_SECONDS сервера")
+    parser.add_argument("--output", type=Path, default=None, help="сохранить результаты в JSON")
+    args = parser.parse_args()
+
+    stub = spawn(["bench/stub_llm.py", "--port", str(STUB_PORT), "--latency", "0.1"])
+    results = []
+    try:
+        asyncio.run(wait_ready(f"http://127.0.0.1:{STUB_PORT}/docs"))
+        for i, budget_mb in enumerate(args.budget_mb):
+            # Разные выписки в каждом прогоне: кэш результатов не должен срабатывать
+            results.extend(run_budget(args, budget_mb, seed=1000 * (i + 1)))
+    finally:
+        stub.terminate()
+        stub.wait()
+
+    if args.output is not None:
+        args.output.write_text(json.dumps({"params": vars(args) | {"output": None}, "results": results}, indent=2))
+        print(f"Результаты сохранены в {args.output}")
+
+
+if __name__ == "__main__":
+    main()
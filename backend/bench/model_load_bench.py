@@ -0,0 +1,91 @@
+"""
+Startup time and RSS of the classifier: JSON model vs memory-mapped binary.
+
+Builds a synthetic model with a large vocabulary, then loads each format
+in a fresh subprocess so the numbers reflect a cold uvicorn worker:
+
+    python bench/model_load_bench.py --tokens 300000
+"""
+
+import argparse
+import json
+import random
+import string
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(BACKEND_DIR))
+
+from classifier import convert_json_to_binary  # noqa: E402
+
+CATEGORIES = ["Еда", "Такси", "Развлечения", "Подписки", "Переводы", "Прочее", "Путешествия"]
+
+PROBE = """
+import json, sys, time
+from pathlib import Path
+sys.path.insert(0, {backend!r})
+import numpy  # импорт библиотек не входит в замер
+import classifier
+
+def rss_kb():
+    for line in open("/proc/self/status"):
+        if line.startswith("VmRSS:"):
+            return int(line.split()[1])
+
+before = rss_kb()
+started = time.perf_counter()
+if {binary!r}:
+    model = classifier.ExpenseClassifier.from_binary(Path({path!r}))
+else:
+    with open({path!r}, encoding="utf-8") as f:
+        model = classifier.ExpenseClassifier.from_json(json.load(f))
+load = time.perf_counter() - started
+model.predict(["magnum покупка", "яндекс такси"])
+print(json.dumps({{"load_ms": load * 1000, "rss_mb": (rss_kb() - before) / 1024}}))
+"""
+
+
+def make_model(tokens: int, seed: int = 0) -> dict:
+    rng = random.Random(seed)
+    vocab = sorted({"".join(rng.choices(string.ascii_lowercase, k=rng.randint(4, 12))) for _ in range(tokens)})
+    likelihoods = {
+        category: {token: rng.random() / len(vocab) for token in rng.sample(vocab, len(vocab) // 3)}
+        for category in CATEGORIES
+    }
+    return {
+        "category_priors": {category: 1 / len(CATEGORIES) for category in CATEGORIES},
+        "token_likelihoods": likelihoods,
+        "default_likelihood": {category: 0.1 / len(vocab) for category in CATEGORIES},
+        "vocabulary": vocab,
+    }
+
+
+def probe(path: Path, binary: bool) -> dict:
+    code = PROBE.format(backend=str(BACKEND_DIR), path=str(path), binary=binary)
+    output = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True)
+    return json.loads(output.stdout.strip().splitlines()[-1])
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Загрузка модели: JSON против mmap")
+    parser.add_argument("--tokens", type=int, default=300_000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        json_path = Path(tmp) / "model.json"
+        bin_path = Path(tmp) / "model.bin"
+        with json_path.open("w", encoding="utf-8") as f:
+            json.dump(make_model(args.tokens), f, ensure_ascii=False, indent=2)
+        convert_json_to_binary(json_path, bin_path)
+
+        for label, path, binary in (("json", json_path, False), ("binary", bin_path, True)):
+            result = probe(path, binary)
+            size_mb = path.stat().st_size / 2**20
+            print(f"{label:<7} file {size_mb:7.1f} MB  load {result['load_ms']:9.1f} ms  RSS +{result['rss_mb']:7.1f} MB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,49 @@
+"""
+Throughput of the PDF extraction pool for different worker counts.
+
+    python bench/pdf_extract_bench.py --pages 40 --workers 1 2 4 8
+"""
+
+import argparse
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from pdf_extract import PdfExtractor  # noqa: E402
+from synthetic_statement import make_statement_pdf  # noqa: E402
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Подбор размера пула PDF_WORKERS")
+    parser.add_argument("--pages", type=int, default=40)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--pages-per-task", type=int, default=4)
+    args = parser.parse_args()
+
+    with tempfile.NamedTemporaryFile(suffix=".pdf") as tmp:
+        tmp.write(make_statement_pdf(args.pages))
+        tmp.flush()
+        for workers in args.workers:
+            extractor = PdfExtractor(workers=workers, pages_per_task=args.pages_per_task)
+            list(extractor.iter_pages(tmp.name))  # прогрев воркеров
+            extractor.stats = type(extractor.stats)()
+            started = time.perf_counter()
+            first_page = None
+            for _ in extractor.iter_pages(tmp.name):
+                if first_page is None:
+                    first_page = time.perf_counter() - started
+            total = time.perf_counter() - started
+            stats = extractor.stats.snapshot()
+            extractor.shutdown()
+            print(
+                f"workers={workers:<2} {args.pages / total:7.1f} pages/s  "
+                f"first page {first_page * 1000:6.1f} ms  "
+                f"page p50 {stats['page_latency_p50_ms']:.1f} ms  p95 {stats['page_latency_p95_ms']:.1f} ms"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+"""
+Speed and accuracy of the recurring-charge detector (recurring.find_recurring)
+on synthetic multi-year histories of many users.
+
+Every user gets random purchases at 500 merchants plus one monthly
+subscription with +-1 day jitter; the report shows the detection rate on
+the subscriptions and the false-positive rate on the random purchases.
+
+    python bench/recurring_bench.py --users 100 1000 10000 --years 3
+"""
+
+import argparse
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from recurring import find_recurring  # noqa: E402
+
+MERCHANTS = 500
+PURCHASES_PER_MONTH = 40
+
+
+def make_history(users: int, years: int, seed: int = 0):
+    rng = np.random.default_rng(seed)
+    months = 12 * years
+    count = users * months * PURCHASES_PER_MONTH
+    owner = np.repeat(np.arange(users), months * PURCHASES_PER_MONTH)
+    keys = owner * (MERCHANTS + 1) + rng.integers(0, MERCHANTS, count)
+    days = rng.integers(0, 365 * years, count)
+    amounts = np.round(rng.lognormal(8, 1, count))
+
+    sub_keys = np.repeat(np.arange(users), months) * (MERCHANTS + 1) + MERCHANTS
+    sub_days = np.tile(np.arange(months) * 30 + 3, users) + rng.integers(-1, 2, users * months)
+    sub_amounts = np.full(users * months, 2490.0)
+    truth = np.r_[np.zeros(count, dtype=bool), np.ones(users * months, dtype=bool)]
+    return np.r_[keys, sub_keys], np.r_[days, sub_days], np.r_[amounts, sub_amounts], truth
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Скорость поиска регулярных списаний")
+    parser.add_argument("--users", type=int, nargs="+", default=[100, 1000, 10000])
+    parser.add_argument("--years", type=int, default=3)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    for users in args.users:
+        keys, days, amounts, truth = make_history(users, args.years)
+        best = float("inf")
+        for _ in range(args.repeat):
+            started = time.perf_counter()
+            found = find_recurring(keys, days, amounts)
+            best = min(best, time.perf_counter() - started)
+        print(
+            f"users={users:<6} rows={len(keys):<10,} {best * 1000:9.1f} ms  "
+            f"({best / users * 1000:.3f} ms/user)  "
+            f"detected {found[truth].mean():.1%}  false positives {found[~truth].mean():.2%}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,176 @@
+"""
+OpenAI-compatible stub of the DeepSeek API for local benchmarks.
+
+Responds to POST /v1/chat/completions after a configurable delay, so the
+backend can be load-tested without spending tokens. Failures and slow
+responses can be injected to exercise the LLM gateway:
+
+    python bench/stub_llm.py --port 9000 --latency 2.0 --tokens-per-second 60
+    python bench/stub_llm.py --rate-limit-ratio 0.2 --tail-ratio 0.05 --tail-latency 10
+    DEEPSEEK_API_KEY=stub DEEPSEEK_BASE_URL=http://127.0.0.1:9000/v1 uvicorn main:app
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import time
+import uuid
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+app = FastAPI()
+
+LATENCY_SECONDS = 1.0
+TOKEN_DELAY_SECONDS = 0.02
+TOKENS_PER_SECOND = 0.0  # скорость генерации; 0 - ответ целиком сразу после LATENCY_SECONDS
+RATE_LIMIT_RATIO = 0.0  # доля ответов 429
+ERROR_RATIO = 0.0  # доля ответов 503
+TAIL_RATIO = 0.0  # доля медленных ответов
+TAIL_LATENCY_SECONDS = 10.0
+
+# Грубая имитация кэша префиксов DeepSeek: уже виденный системный промпт считается попаданием
+SEEN_PREFIXES = set()
+
+ANALYSIS_REPLY = {
+    "total_spent": 7700.0,
+    "forecast_next_month": 8000.0,
+    "categories": [
+        {"name": "Продукты (Magnum)", "name_ru": "Продукты (Magnum)", "name_kz": "Тауарлар (Magnum)", "name_en": "Products (Magnum)", "amount": 6000.0, "percent": 77.9, "color": "4CAF50"},
+        {"name": "Такси (Yandex)", "name_ru": "Такси (Yandex)", "name_kz": "Такси (Yandex)", "name_en": "Taxi (Yandex)", "amount": 1700.0, "percent": 22.1, "color": "FFC107"},
+    ],
+    "subscriptions": [],
+    "advice": "Stub advice",
+    "transactions": [
+        {"date": "01.03.2024", "amount": 1500.0, "description": "Magnum", "category": "Продукты (Magnum)"},
+        {"date": "02.03.2024", "amount": 850.0, "description": "Yandex Go", "category": "Такси (Yandex)"},
+        {"date": "10.03.2024", "amount": 4500.0, "description": "Magnum", "category": "Продукты (Magnum)"},
+        {"date": "12.03.2024", "amount": 850.0, "description": "Yandex Go", "category": "Такси (Yandex)"},
+    ],
+}
+
+
+def build_reply(messages):
+    system = next((m["content"] for m in messages if m["role"] == "system"), "")
+    if '"transactions"' in system:
+        return json.dumps(ANALYSIS_REPLY, ensure_ascii=False)
+    if '"advice"' in system:
+        summary = json.loads(messages[-1]["content"])
+        return json.dumps({
+            "categories": {name: "other" for name in summary.get("unknown", [])},
+            "advice": ANALYSIS_REPLY["advice"],
+        }, ensure_ascii=False)
+    return "Stub reply: траты в норме."
+
+
+def generation_seconds(text: str) -> float:
+    """Время генерации text при TOKENS_PER_SECOND (~4 символа на токен)"""
+    return (len(text) // 4 + 1) / TOKENS_PER_SECOND if TOKENS_PER_SECOND > 0 else 0.0
+
+
+def build_usage(messages, content):
+    """usage в формате DeepSeek, ~4 символа на токен"""
+    prompt_tokens = sum(len(m.get("content") or "") for m in messages) // 4 + 1
+    system = messages[0].get("content", "") if messages and messages[0]["role"] == "system" else ""
+    hit = len(system) // 4 if system and system in SEEN_PREFIXES else 0
+    if system:
+        SEEN_PREFIXES.add(system)
+    completion_tokens = len(content) // 4 + 1
+    return {
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "total_tokens": prompt_tokens + completion_tokens,
+        "prompt_cache_hit_tokens": hit,
+        "prompt_cache_miss_tokens": prompt_tokens - hit,
+    }
+
+
+@app.post("/v1/chat/completions")
+async def chat_completions(request: Request):
+    body = await request.json()
+    if random.random() < RATE_LIMIT_RATIO:
+        return JSONResponse(
+            {"error": {"message": "Rate limit reached", "type": "rate_limit_error"}},
+            status_code=429,
+            headers={"Retry-After": "0.2"},
+        )
+    if random.random() < ERROR_RATIO:
+        return JSONResponse({"error": {"message": "Service unavailable", "type": "server_error"}}, status_code=503)
+    content = build_reply(body.get("messages", []))
+    latency = TAIL_LATENCY_SECONDS if random.random() < TAIL_RATIO else LATENCY_SECONDS
+    if body.get("stream"):
+        return StreamingResponse(stream_reply(body, content, latency), media_type="text/event-stream")
+    await asyncio.sleep(latency + generation_seconds(content))
+    return {
+        "id": f"chatcmpl-{uuid.uuid4().hex}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": body.get("model", "deepseek-chat"),
+        "choices": [{
+            "index": 0,
+            "message": {"role": "assistant", "content": content},
+            "finish_reason": "stop",
+        }],
+        "usage": build_usage(body.get("messages", []), content),
+    }
+
+
+async def stream_reply(body, content, latency):
+    """Первый токен через latency, далее по слову с TOKENS_PER_SECOND (или каждые TOKEN_DELAY_SECONDS)"""
+    chunk_id = f"chatcmpl-{uuid.uuid4().hex}"
+    await asyncio.sleep(latency)
+    words = content.split(" ")
+    for i, word in enumerate(words):
+        delta = word if i == len(words) - 1 else word + " "
+        chunk = {
+            "id": chunk_id,
+            "object": "chat.completion.chunk",
+            "created": int(time.time()),
+            "model": body.get("model", "deepseek-chat"),
+            "choices": [{"index": 0, "delta": {"content": delta}, "finish_reason": None}],
+        }
+        yield f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n"
+        await asyncio.sleep(generation_seconds(delta) if TOKENS_PER_SECOND > 0 else TOKEN_DELAY_SECONDS)
+    done = {
+        "id": chunk_id,
+        "object": "chat.completion.chunk",
+        "created": int(time.time()),
+        "model": body.get("model", "deepseek-chat"),
+        "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}],
+    }
+    yield f"data: {json.dumps(done)}\n\n"
+    if (body.get("stream_options") or {}).get("include_usage"):
+        usage = {**done, "choices": [], "usage": build_usage(body.get("messages", []), content)}
+        yield f"data: {json.dumps(usage)}\n\n"
+    yield "data: [DONE]\n\n"
+
+
+def main() -> None:
+    global LATENCY_SECONDS, TOKEN_DELAY_SECONDS, TOKENS_PER_SECOND, RATE_LIMIT_RATIO, ERROR_RATIO, TAIL_RATIO, TAIL_LATENCY_SECONDS
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9000)
+    parser.add_argument("--latency", type=float, default=1.0, help="задержка ответа, сек")
+    parser.add_argument("--token-delay", type=float, default=0.02, help="пауза между токенами в stream, сек")
+    parser.add_argument("--tokens-per-second", type=float, default=0.0, help="скорость генерации (0 - без учета длины ответа)")
+    parser.add_argument("--rate-limit-ratio", type=float, default=0.0, help="доля ответов 429")
+    parser.add_argument("--error-ratio", type=float, default=0.0, help="доля ответов 503")
+    parser.add_argument("--tail-ratio", type=float, default=0.0, help="доля медленных ответов")
+    parser.add_argument("--tail-latency", type=float, default=10.0, help="задержка медленного ответа, сек")
+    args = parser.parse_args()
+
+    LATENCY_SECONDS = args.latency
+    TOKEN_DELAY_SECONDS = args.token_delay
+    TOKENS_PER_SECOND = args.tokens_per_second
+    RATE_LIMIT_RATIO = args.rate_limit_ratio
+    ERROR_RATIO = args.error_ratio
+    TAIL_RATIO = args.tail_ratio
+    TAIL_LATENCY_SECONDS = args.tail_latency
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,172 @@
+"""
+Generator of synthetic Kaspi Gold statements in PDF form.
+
+Writes a minimal PDF by hand (no reportlab), with one text line per
+transaction in the same shape pdfplumber yields for real statements:
+purchases at the merchants from MOCK_AMIR_DATA and a few more, monthly
+subscriptions on a fixed day, transfers, cash withdrawals and top-ups,
+with the amount formats Kaspi uses. `noise` mixes in rows the local
+parser cannot read, so the LLM fallback path can be benchmarked too.
+`padding` inflates the page content streams with PDF comments to get
+the multi-megabyte files scanned statements produce (see memory_bench.py).
+"""
+
+import random
+from datetime import date, timedelta
+from typing import List, Optional
+
+# (мерчант, мин. сумма, макс. сумма, относительная частота)
+MERCHANTS = [
+    ("Magnum", 800, 25000, 10),
+    ("Small", 300, 6000, 8),
+    ("Galmart", 1500, 30000, 4),
+    ("Yandex Go", 600, 4500, 8),
+    ("Steam", 1200, 15000, 2),
+    ("Kino.kz", 2500, 6000, 2),
+    ("Bahandi", 1800, 5500, 4),
+    ("Tandyr", 1500, 4000, 4),
+    ("Kaspi Magazin", 5490, 5490, 1),
+    ("Glovo", 2000, 9000, 3),
+    ("Wolt", 2500, 11000, 3),
+    ("Arbuz.kz", 4000, 35000, 2),
+    ("Sulpak", 15000, 250000, 0.3),
+    ("Technodom", 9000, 180000, 0.3),
+    ("Starbucks", 1600, 3800, 3),
+    ("Europharma", 700, 12000, 2),
+]
+
+# (название, сумма, день месяца) - списываются раз в месяц одной суммой
+SUBSCRIPTIONS = [
+    ("Spotify Premium", 4282, 3),
+    ("Yandex Plus", 1990, 11),
+    ("Beeline", 3500, 20),
+]
+
+OTHER_ROWS = [
+    ("Transfers", ["Aigerim K.", "Daniyar S.", "Mama"], 2000, 60000),
+    ("Withdrawals", ["ATM Kaspi Bank"], 5000, 50000),
+]
+
+MAX_PAGES = 100
+
+ROW_HEIGHT = 14
+TOP_MARGIN = 800
+ROWS_PER_PAGE = 50
+
+
+def format_amount(amount: float, rng: random.Random) -> str:
+    """Kaspi пишет суммы по-разному: '1 500.00 - T', '- 1 500 T', '-1 500,00 T'."""
+    whole = f"{int(amount):,}".replace(",", " ")
+    cents = f"{amount:.2f}".split(".")[1]
+    style = rng.randrange(3)
+    if style == 0:
+        return f"{whole}.{cents} - T"
+    if style == 1:
+        return f"- {whole} T"
+    return f"-{whole},{cents} T"
+
+
+def generate_rows(count: int, seed: int = 0, start: Optional[date] = None, noise: float = 0.0) -> List[str]:
+    rng = random.Random(seed)
+    day = start or date(2024, 3, 1)
+    rows = []
+    charged = set()
+    while len(rows) < count:
+        due = [(name, cost) for name, cost, dom in SUBSCRIPTIONS if dom == day.day and (name, day) not in charged]
+        if due:
+            name, cost = due[0]
+            charged.add((name, day))
+            rows.append(f"{day:%d.%m.%y} {format_amount(cost, rng)} Purchases {name}")
+            continue
+        roll = rng.random()
+        if roll < 0.12:
+            amount = rng.randrange(10000, 200000, 1000)
+            rows.append(f"{day:%d.%m.%y} + {amount:,} T Replenishment Kaspi Deposit".replace(",", " "))
+        elif roll < 0.22:
+            operation, names, low, high = rng.choice(OTHER_ROWS)
+            amount = float(rng.randrange(low, high, 500))
+            rows.append(f"{day:%d.%m.%y} {format_amount(amount, rng)} {operation} {rng.choice(names)}")
+        else:
+            name, low, high, _ = rng.choices(MERCHANTS, weights=[m[3] for m in MERCHANTS])[0]
+            amount = float(low if low == high else rng.randrange(low, high))
+            if rng.random() < noise:
+                # Без валюты и знака: парсер не узнает строку, она уйдет в LLM
+                rows.append(f"{day:%d.%m.%y} {name} {int(amount)}")
+            else:
+                rows.append(f"{day:%d.%m.%y} {format_amount(amount, rng)} Purchases {name}")
+        if rng.random() < 0.4:
+            day += timedelta(days=1)
+    return rows
+
+
+def _escape(text: str) -> str:
+    return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+
+def _page_stream(lines: List[str], padding: int = 0) -> bytes:
+    ops = ["BT", "/F1 10 Tf", f"40 {TOP_MARGIN} Td", f"{ROW_HEIGHT} TL"]
+    for line in lines:
+        ops.append(f"({_escape(line)}) '")
+    ops.append("ET")
+    # Комментарии pdfplumber читает вместе с потоком, но в текст они не попадают
+    comment = "%" + "x" * 1023
+    ops.extend(comment for _ in range(padding // 1024))
+    return "\n".join(ops).encode("latin-1")
+
+
+def make_statement_pdf(pages: int = 1, seed: int = 0, noise: float = 0.0, padding: int = 0) -> bytes:
+    if not 1 <= pages <= MAX_PAGES:
+        raise ValueError(f"pages must be between 1 and {MAX_PAGES}")
+    header = ["Kaspi Gold statement", "Date Amount Transaction Details"]
+    rows = generate_rows(pages * (ROWS_PER_PAGE - len(header)), seed=seed, noise=noise)
+    per_page = ROWS_PER_PAGE - len(header)
+    chunks = [header + rows[i:i + per_page] for i in range(0, len(rows), per_page)]
+
+    objects: List[bytes] = []
+    font_id = 3
+    page_ids = []
+    for lines in chunks:
+        stream = _page_stream(lines, padding // len(chunks))
+        content_id = len(objects) + 4 + 1
+        page_ids.append(len(objects) + 4)
+        objects.append(
+            f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] "
+            f"/Resources << /Font << /F1 {font_id} 0 R >> >> /Contents {content_id} 0 R >>".encode()
+        )
+        objects.append(b"<< /Length %d >>\nstream\n" % len(stream) + stream + b"\nendstream")
+
+    kids = " ".join(f"{pid} 0 R" for pid in page_ids)
+    head = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        f"<< /Type /Pages /Kids [{kids}] /Count {len(page_ids)} >>".encode(),
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+    ]
+    all_objects = head + objects
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for num, body in enumerate(all_objects, start=1):
+        offsets.append(len(out))
+        out += f"{num} 0 obj\n".encode() + body + b"\nendobj\n"
+    xref = len(out)
+    out += f"xref\n0 {len(all_objects) + 1}\n0000000000 65535 f \n".encode()
+    for off in offsets:
+        out += f"{off:010d} 00000 n \n".encode()
+    out += f"trailer\n<< /Size {len(all_objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode()
+    return bytes(out)
+
+
+if __name__ == "__main__":
+    import argparse
+    from pathlib import Path
+
+    parser = argparse.ArgumentParser(description="Сгенерировать синтетическую выписку Kaspi Gold")
+    parser.add_argument("output", type=Path)
+    parser.add_argument("--pages", type=int, default=1)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--noise", type=float, default=0.0, help="доля строк, которые парсер не разберет")
+    parser.add_argument("--padding-mb", type=float, default=0.0, help="раздуть файл до ~N МБ")
+    args = parser.parse_args()
+    padding = int(args.padding_mb * 1024 * 1024)
+    args.output.write_bytes(make_statement_pdf(args.pages, args.seed, args.noise, padding))
+    print(f"Saved {args.pages} pages to {args.output}")
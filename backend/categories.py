@@ -0,0 +1,159 @@
+"""
+Справочник категорий расходов и правила сопоставления мерчантов.
+
+Те же "железные правила", что описаны в системном промпте analyze_kaspi_statement,
+только в виде данных: их можно применить локально, без обращения к LLM.
+"""
+
+import re
+from typing import Dict, List, Optional, Tuple
+
+LANGUAGES = ("ru", "kz", "en")
+
+LANG_NAMES = {
+    "ru": {
+        "products": "Продукты",
+        "taxi": "Такси",
+        "entertainment": "Развлечения",
+        "fastfood": "Фастфуд",
+        "credit": "Рассрочка",
+        "other": "Прочее"
+    },
+    "kz": {
+        "products": "Тауарлар",
+        "taxi": "Такси",
+        "entertainment": "Ойын-сауық",
+        "fastfood": "Жылдам тағам",
+        "credit": "Бөліп төлеу",
+        "other": "Басқа"
+    },
+    "en": {
+        "products": "Products",
+        "taxi": "Taxi",
+        "entertainment": "Entertainment",
+        "fastfood": "Fast Food",
+        "credit": "Credit",
+        "other": "Other"
+    }
+}
+
+# Суффиксы, которые промпт добавляет к названиям категорий
+CATEGORY_SUFFIX = {
+    "products": " (Magnum)",
+    "taxi": " (Yandex)",
+    "entertainment": " (Steam/Kino)",
+    "fastfood": " (Тандыр/Bahandi)",
+    "credit": "",
+    "other": "",
+}
+
+CATEGORY_COLORS = {
+    "products": "4CAF50",
+    "taxi": "FFC107",
+    "entertainment": "9C27B0",
+    "fastfood": "FF9800",
+    "credit": "FF5722",
+    "other": "9E9E9E",
+}
+
+CATEGORY_KEYS = tuple(CATEGORY_COLORS)
+
+# Цифровые подписки: идут в subscriptions, а сама трата - в "Прочее"
+SUBSCRIPTION_KEYWORDS = (
+    "yandex plus", "spotify", "netflix", "apple", "ivi", "kinopoisk",
+    "google storage", "youtube premium",
+)
+
+# Порядок важен: рассрочки раньше всего, фастфуд раньше продуктов
+# (Bahandi/Burger в промпте упомянуты в обеих группах)
+CATEGORY_KEYWORDS: Tuple[Tuple[str, Tuple[str, ...]], ...] = (
+    ("credit", ("kaspi red", "kaspi magazin", "погашение кредита", "credit", "рассрочка")),
+    ("taxi", ("yandex go", "yandex.go", "uber", "onay", "indrive")),
+    ("fastfood", ("bahandi", "tandyr", "тандыр", "burger", "pizza")),
+    ("products", ("magnum", "small", "galmart", "glovo", "wolt")),
+    ("entertainment", ("steam", "kino", "kinopark", "cinema", "games")),
+)
+
+# Названия, которые никогда не считаются подписками
+NOT_SUBSCRIPTIONS = ("kaspi magazin", "kaspi red", "рассрочка", "credit", "погашение кредита")
+
+
+def _compile(words) -> "re.Pattern[str]":
+    # Только целые слова: иначе "ivi" находится в "Olivia", а "apple" - в "pineapple"
+    return re.compile(r"\b(?:" + "|".join(re.escape(word) for word in words) + r")\b")
+
+
+_SUBSCRIPTION_RE = _compile(SUBSCRIPTION_KEYWORDS)
+_NOT_SUBSCRIPTION_RE = _compile(NOT_SUBSCRIPTIONS)
+_CATEGORY_RES = tuple((key, _compile(words)) for key, words in CATEGORY_KEYWORDS)
+
+
+def normalize_language(language: Optional[str]) -> str:
+    lang = (language or "ru").lower()
+    return lang if lang in LANG_NAMES else "ru"
+
+
+def category_name(key: str, language: str = "ru") -> str:
+    return LANG_NAMES[normalize_language(language)][key] + CATEGORY_SUFFIX[key]
+
+
+def category_names(key: str) -> Dict[str, str]:
+    return {f"name_{lang}": category_name(key, lang) for lang in LANGUAGES}
+
+
+# Название категории на любом языке (с суффиксом или без) -> ключ
+_KEYS_BY_NAME = {
+    name.lower(): key
+    for lang in LANGUAGES
+    for key in CATEGORY_KEYS
+    for name in (LANG_NAMES[lang][key], category_name(key, lang))
+}
+
+
+def category_key(name: str) -> Optional[str]:
+    """Ключ категории по названию из ответа /analyze или None"""
+    return _KEYS_BY_NAME.get(str(name).strip().lower())
+
+
+def format_money(value) -> str:
+    try:
+        return f"{float(value):,.0f}".replace(",", " ") + " ₸"
+    except (TypeError, ValueError):
+        return str(value)
+
+
+def is_subscription(description: str) -> bool:
+    text = description.lower()
+    if _NOT_SUBSCRIPTION_RE.search(text):
+        return False
+    return _SUBSCRIPTION_RE.search(text) is not None
+
+
+def match_category(description: str) -> Optional[str]:
+    """Ключ категории по правилам или None, если правила не сработали"""
+    # Подписки проверяются первыми, иначе Kinopoisk попадет в "kino"
+    if is_subscription(description):
+        return "other"
+    text = description.lower()
+    for key, pattern in _CATEGORY_RES:
+        if pattern.search(text):
+            return key
+    return None
+
+
+def build_categories(totals: Dict[str, float], language: str = "ru") -> List[dict]:
+    """Список categories в формате ответа /analyze, по убыванию суммы"""
+    total = sum(totals.values())
+    categories = []
+    for key, amount in sorted(totals.items(), key=lambda item: -item[1]):
+        if amount <= 0:
+            continue
+        categories.append({
+            "name": category_name(key, language),
+            **category_names(key),
+            "amount": round(amount, 2),
+            "percent": round(amount / total * 100, 1) if total else 0.0,
+            "color": CATEGORY_COLORS[key],
+        })
+    return categories
+
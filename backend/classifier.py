@@ -0,0 +1,227 @@
+"""
+Наивный байесовский классификатор расходов, обученный train_model.py.
+
+Модель загружается один раз в компактные структуры: отсортированная таблица
+токенов, матрица log-правдоподобий (словарь x категории) и вектор log-априорных
+вероятностей. Пакет описаний оценивается одной векторной операцией.
+
+Бинарный формат (expense_classifier.bin, little-endian):
+    заголовок      magic "FSNB", version u16, категорий u32, токенов u32, ширина токена u32
+    категории      C x 64 байта UTF-8
+    log-априорные  float32[C], выравнивание до 64 байт
+    токены         отсортированные, V x ширина байт UTF-8, выравнивание до 64 байт
+    матрица        float32[V x C]
+Файл открывается через mmap, поэтому воркеры uvicorn делят одни страницы.
+"""
+
+import json
+import os
+import struct
+from pathlib import Path
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from train_model import BINARY_MODEL_PATH, MODEL_PATH, tokenize
+
+# Ниже этой уверенности строка уходит в LLM
+CLASSIFIER_MIN_CONFIDENCE = float(os.getenv("CLASSIFIER_MIN_CONFIDENCE", "0.5"))
+
+BINARY_MAGIC = b"FSNB"
+BINARY_VERSION = 1
+HEADER = struct.Struct("<4sHIII")
+ALIGNMENT = 64
+
+
+def _align(offset: int) -> int:
+    return (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+# Категории обучающей выборки -> ключи categories.CATEGORY_KEYS
+MODEL_CATEGORY_KEYS = {
+    "Еда": "products",
+    "Такси": "taxi",
+    "Развлечения": "entertainment",
+    "Подписки": "other",
+    "Переводы": "other",
+    "Прочее": "other",
+    "Путешествия": "other",
+}
+
+
+class ExpenseClassifier:
+    def __init__(
+        self,
+        categories: List[str],
+        tokens: np.ndarray,
+        token_scores: np.ndarray,
+        log_priors: np.ndarray,
+    ):
+        """
+        tokens - отсортированный массив токенов в UTF-8 (dtype S<width>),
+        token_scores - (V x C) log-правдоподобия, строка на токен, чтобы выборка
+        по индексам токенов была непрерывной. Оба массива могут быть np.memmap.
+        """
+        self.categories = categories
+        self.tokens = tokens
+        self.token_width = tokens.dtype.itemsize
+        self.token_scores = token_scores
+        self.log_priors = np.asarray(log_priors, dtype=np.float32)
+        # Несколько категорий модели сливаются в один ключ: (C x K) матрица для суммирования вероятностей
+        self.keys = sorted({MODEL_CATEGORY_KEYS.get(name, "other") for name in categories})
+        self.key_matrix = np.zeros((len(categories), len(self.keys)), dtype=np.float32)
+        for row, name in enumerate(categories):
+            self.key_matrix[row, self.keys.index(MODEL_CATEGORY_KEYS.get(name, "other"))] = 1.0
+
+    @classmethod
+    def from_json(cls, model: dict) -> "ExpenseClassifier":
+        categories = list(model["category_priors"])
+        encoded = [token.encode("utf-8") for token in model["vocabulary"]]
+        width = max((len(token) for token in encoded), default=1)
+        order = np.argsort(np.array(encoded, dtype=f"S{width}"), kind="stable")
+        tokens = np.array(encoded, dtype=f"S{width}")[order]
+        position = {model["vocabulary"][i]: row for row, i in enumerate(order)}
+        defaults = model["default_likelihood"]
+
+        # Токены, не встречавшиеся в категории, получают сглаженное значение по умолчанию
+        matrix = np.empty((len(tokens), len(categories)), dtype=np.float32)
+        for col, category in enumerate(categories):
+            matrix[:, col] = np.log(defaults[category])
+            likelihoods = model["token_likelihoods"].get(category, {})
+            if likelihoods:
+                rows = [position[token] for token in likelihoods]
+                matrix[rows, col] = np.log(np.fromiter(likelihoods.values(), dtype=np.float64))
+
+        priors = np.log(np.array([model["category_priors"][c] for c in categories]))
+        return cls(categories, tokens, matrix, priors)
+
+    @classmethod
+    def from_binary(cls, path: Path) -> "ExpenseClassifier":
+        """Отображает файл в память: страницы общие для всех воркеров через кэш ОС"""
+        with path.open("rb") as f:
+            magic, version, n_categories, n_tokens, width = HEADER.unpack(f.read(HEADER.size))
+        if magic != BINARY_MAGIC or version != BINARY_VERSION:
+            raise ValueError(f"{path}: неизвестный формат модели")
+
+        offset = HEADER.size
+        names = np.memmap(path, dtype="S64", mode="r", offset=offset, shape=(n_categories,))
+        offset += names.nbytes
+        priors = np.memmap(path, dtype="<f4", mode="r", offset=offset, shape=(n_categories,))
+        offset = _align(offset + priors.nbytes)
+        tokens = np.memmap(path, dtype=f"S{width}", mode="r", offset=offset, shape=(n_tokens,))
+        offset = _align(offset + tokens.nbytes)
+        scores = np.memmap(path, dtype="<f4", mode="r", offset=offset, shape=(n_tokens, n_categories))
+
+        categories = [name.decode("utf-8") for name in names]
+        return cls(categories, tokens, scores, priors)
+
+    def save_binary(self, path: Path) -> None:
+        categories = np.array([name.encode("utf-8") for name in self.categories], dtype="S64")
+        with path.open("wb") as f:
+            f.write(HEADER.pack(BINARY_MAGIC, BINARY_VERSION, len(categories), len(self.tokens), self.token_width))
+            f.write(categories.tobytes())
+            f.write(self.log_priors.astype("<f4").tobytes())
+            f.write(b"\0" * (_align(f.tell()) - f.tell()))
+            f.write(np.ascontiguousarray(self.tokens).tobytes())
+            f.write(b"\0" * (_align(f.tell()) - f.tell()))
+            f.write(np.ascontiguousarray(self.token_scores, dtype="<f4").tobytes())
+
+    def _token_ids(self, descriptions: Sequence[str]) -> Tuple[np.ndarray, np.ndarray]:
+        """Плоский список индексов токенов и номер документа для каждого из них"""
+        words: List[bytes] = []
+        doc_ids: List[int] = []
+        for doc, text in enumerate(descriptions):
+            for token in tokenize(text):
+                words.append(token.encode("utf-8"))
+                doc_ids.append(doc)
+        if not words or not len(self.tokens):
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+
+        # Бинарный поиск сразу по всем токенам пакета в отсортированной таблице
+        fits = np.fromiter((len(word) <= self.token_width for word in words), dtype=bool, count=len(words))
+        queries = np.array(words, dtype=f"S{self.token_width}")
+        idx = np.searchsorted(self.tokens, queries)
+        idx[idx == len(self.tokens)] = 0
+        found = fits & (self.tokens[idx] == queries)
+        return idx[found].astype(np.int64), np.array(doc_ids, dtype=np.int64)[found]
+
+    def predict_proba(self, descriptions: Sequence[str]) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        (N x C) апостериорные вероятности категорий и маска документов,
+        в которых нашелся хотя бы один известный токен.
+        """
+        token_ids, doc_ids = self._token_ids(descriptions)
+        known = np.zeros(len(descriptions), dtype=bool)
+        known[doc_ids] = True
+        scores = np.tile(self.log_priors, (len(descriptions), 1))
+        if len(token_ids):
+            # doc_ids отсортированы: суммируем вклады токенов каждого документа одним reduceat
+            starts = np.flatnonzero(np.r_[True, doc_ids[1:] != doc_ids[:-1]])
+            scores[doc_ids[starts]] += np.add.reduceat(self.token_scores[token_ids], starts, axis=0)
+        scores -= scores.max(axis=1, keepdims=True)
+        np.exp(scores, out=scores)
+        scores /= scores.sum(axis=1, keepdims=True)
+        return scores, known
+
+    def predict(self, descriptions: Sequence[str]) -> Tuple[List[str], np.ndarray]:
+        """
+        Ключи категорий и уверенность для каждого описания.
+        Без единого известного токена уверенность нулевая (это просто априорное распределение).
+        """
+        if not descriptions:
+            return [], np.empty(0, dtype=np.float32)
+        proba, known = self.predict_proba(descriptions)
+        key_proba = proba @ self.key_matrix
+        best = key_proba.argmax(axis=1)
+        confidence = key_proba[np.arange(len(best)), best]
+        confidence[~known] = 0.0
+        return [self.keys[i] for i in best], confidence
+
+    def categorize(self, transactions, min_confidence: float = CLASSIFIER_MIN_CONFIDENCE, observe=None) -> int:
+        """
+        Проставляет категорию транзакциям без нее, если модель достаточно уверена.
+        observe(транзакция, уверенность) вызывается для каждой классифицированной.
+        Возвращает число классифицированных транзакций.
+        """
+        pending = [txn for txn in transactions if txn.category is None]
+        keys, confidence = self.predict([txn.description for txn in pending])
+        classified = 0
+        for txn, key, score in zip(pending, keys, confidence):
+            if score >= min_confidence:
+                txn.category = key
+                classified += 1
+                if observe is not None:
+                    observe(txn, float(score))
+        return classified
+
+
+def convert_json_to_binary(json_path: Path = MODEL_PATH, binary_path: Path = BINARY_MODEL_PATH) -> None:
+    with json_path.open("r", encoding="utf-8") as f:
+        ExpenseClassifier.from_json(json.load(f)).save_binary(binary_path)
+
+
+def load_classifier(
+    binary_path: Path = BINARY_MODEL_PATH, json_path: Path = MODEL_PATH
+) -> Optional[ExpenseClassifier]:
+    """
+    Предпочитает бинарную модель (mmap, загрузка за константное время),
+    JSON - запасной вариант. Модель не обязательна: без нее классификация уходит в LLM.
+    """
+    if binary_path.exists():
+        return ExpenseClassifier.from_binary(binary_path)
+    if json_path.exists():
+        with json_path.open("r", encoding="utf-8") as f:
+            return ExpenseClassifier.from_json(json.load(f))
+    print(f"⚠️ Модель классификатора не найдена: {binary_path}")
+    return None
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Конвертация JSON-модели в бинарный формат")
+    parser.add_argument("json_path", type=Path, nargs="?", default=MODEL_PATH)
+    parser.add_argument("binary_path", type=Path, nargs="?", default=BINARY_MODEL_PATH)
+    args = parser.parse_args()
+    convert_json_to_binary(args.json_path, args.binary_path)
+    print(f"Model converted to {args.binary_path}")
@@ -0,0 +1,175 @@
+"""
+Серверное хранилище контекста для /chat.
+
+/analyze кладет результат сюда и отдает context_id; /chat присылает только
+этот id, а не весь JSON с транзакциями. Для промпта контекст один раз на язык
+превращается в компактную сводку: итоги по категориям, крупнейшие мерчанты
+и top-N транзакций таблицей вместо JSON с отступами.
+"""
+
+import os
+import threading
+import time
+from collections import OrderedDict, defaultdict
+from typing import Dict, Optional
+
+from analytics import StatementIndex
+from categories import format_money, normalize_language
+from result_cache import ResultCache
+
+CONTEXT_STORE_SIZE = int(os.getenv("CONTEXT_STORE_SIZE", "1024"))
+CONTEXT_TTL_SECONDS = float(os.getenv("CONTEXT_TTL_SECONDS", str(30 * 24 * 3600)))
+CONTEXT_STORE_DB = os.getenv("CONTEXT_STORE_DB", "")
+CONTEXT_TOP_TRANSACTIONS = int(os.getenv("CONTEXT_TOP_TRANSACTIONS", "30"))
+CONTEXT_TOP_MERCHANTS = 15
+# Колоночные индексы для локальных ответов чата держим только для недавних контекстов
+CONTEXT_INDEX_SIZE = int(os.getenv("CONTEXT_INDEX_SIZE", "128"))
+
+LABELS = {
+    "ru": {
+        "total": "Всего потрачено",
+        "forecast": "Прогноз на следующий месяц",
+        "period": "Период",
+        "categories": "Категории",
+        "subscriptions": "Подписки",
+        "merchants": "Крупнейшие мерчанты (сумма, число операций)",
+        "transactions": "Крупнейшие транзакции (дата | сумма | описание | категория)",
+        "of": "из",
+    },
+    "kz": {
+        "total": "Барлық шығын",
+        "forecast": "Келесі айға болжам",
+        "period": "Кезең",
+        "categories": "Санаттар",
+        "subscriptions": "Жазылымдар",
+        "merchants": "Ірі мерчанттар (сома, операция саны)",
+        "transactions": "Ірі транзакциялар (күні | сома | сипаттама | санат)",
+        "of": "/",
+    },
+    "en": {
+        "total": "Total spent",
+        "forecast": "Forecast for next month",
+        "period": "Period",
+        "categories": "Categories",
+        "subscriptions": "Subscriptions",
+        "merchants": "Top merchants (total, operations)",
+        "transactions": "Largest transactions (date | amount | description | category)",
+        "of": "of",
+    },
+}
+
+
+def _date_key(date: str) -> str:
+    parts = str(date).split(".")
+    return "".join(reversed(parts)) if len(parts) == 3 else str(date)
+
+
+def render_context(context: dict, language: str = "ru", top_n: int = CONTEXT_TOP_TRANSACTIONS) -> str:
+    """Компактная текстовая сводка результата /analyze для системного промпта"""
+    labels = LABELS[normalize_language(language)]
+    lang = normalize_language(language)
+    lines = [
+        f"{labels['total']}: {format_money(context.get('total_spent', 0))}",
+        f"{labels['forecast']}: {format_money(context.get('forecast_next_month', 0))}",
+    ]
+
+    transactions = [t for t in context.get("transactions") or [] if isinstance(t, dict)]
+    dates = sorted((t.get("date", "") for t in transactions), key=_date_key)
+    if dates:
+        lines.append(f"{labels['period']}: {dates[0]} - {dates[-1]}")
+
+    categories = [c for c in context.get("categories") or [] if isinstance(c, dict)]
+    if categories:
+        lines.append(f"{labels['categories']}:")
+        for cat in categories:
+            name = cat.get(f"name_{lang}") or cat.get("name", "")
+            lines.append(f"- {name}: {format_money(cat.get('amount', 0))} ({cat.get('percent', 0)}%)")
+
+    subscriptions = [s for s in context.get("subscriptions") or [] if isinstance(s, dict)]
+    if subscriptions:
+        lines.append(f"{labels['subscriptions']}: " + ", ".join(
+            f"{s.get('name', '')} {format_money(s.get('cost', 0))}" for s in subscriptions
+        ))
+
+    merchants: Dict[str, list] = defaultdict(lambda: [0.0, 0])
+    for txn in transactions:
+        try:
+            merchants[str(txn.get("description", ""))][0] += float(txn.get("amount", 0))
+        except (TypeError, ValueError):
+            continue
+        merchants[str(txn.get("description", ""))][1] += 1
+    if merchants:
+        lines.append(f"{labels['merchants']}:")
+        top_merchants = sorted(merchants.items(), key=lambda item: -item[1][0])[:CONTEXT_TOP_MERCHANTS]
+        for name, (amount, count) in top_merchants:
+            lines.append(f"- {name}: {format_money(amount)}, {count}")
+
+    def amount_of(txn) -> float:
+        try:
+            return float(txn.get("amount", 0))
+        except (TypeError, ValueError):
+            return 0.0
+
+    if transactions:
+        top = sorted(transactions, key=amount_of, reverse=True)[:top_n]
+        lines.append(f"{labels['transactions']}, {len(top)} {labels['of']} {len(transactions)}:")
+        for txn in top:
+            lines.append(
+                f"{txn.get('date', '')} | {format_money(txn.get('amount', 0))} | "
+                f"{txn.get('description', '')} | {txn.get('category', '')}"
+            )
+    return "\n".join(lines)
+
+
+class ContextStore:
+    def __init__(self):
+        self._contexts = ResultCache(CONTEXT_STORE_SIZE, CONTEXT_TTL_SECONDS, CONTEXT_STORE_DB)
+        self._rendered = ResultCache(CONTEXT_STORE_SIZE * 3, CONTEXT_TTL_SECONDS)
+        self._indexes: "OrderedDict[str, tuple]" = OrderedDict()
+        # Эндпоинты зовут хранилище из потоков (asyncio.to_thread), а OrderedDict не потокобезопасен
+        self._indexes_lock = threading.Lock()
+
+    def put(self, context_id: str, context: dict) -> str:
+        self._contexts.set(context_id, context)
+        return context_id
+
+    def get(self, context_id: str) -> Optional[dict]:
+        return self._contexts.get(context_id)
+
+    def prompt(self, context_id: str, language: str = "ru") -> Optional[str]:
+        """Сводка для промпта; рендерится один раз на язык и переиспользуется"""
+        key = f"{context_id}:{normalize_language(language)}"
+        rendered = self._rendered.get(key)
+        if rendered is not None:
+            return rendered["prompt"]
+        context = self._contexts.get(context_id)
+        if context is None:
+            return None
+        prompt = render_context(context, language)
+        self._rendered.set(key, {"prompt": prompt})
+        return prompt
+
+    def index(self, context_id: str) -> Optional[StatementIndex]:
+        """Колоночный индекс транзакций контекста для analytics.answer_question"""
+        with self._indexes_lock:
+            entry = self._indexes.get(context_id)
+            if entry is not None and time.time() - entry[0] < CONTEXT_TTL_SECONDS:
+                self._indexes.move_to_end(context_id)
+                return entry[1]
+        context = self._contexts.get(context_id)
+        if context is None:
+            with self._indexes_lock:
+                self._indexes.pop(context_id, None)
+            return None
+        index = StatementIndex(context.get("transactions") or [])
+        with self._indexes_lock:
+            self._indexes[context_id] = (time.time(), index)
+            while len(self._indexes) > CONTEXT_INDEX_SIZE:
+                self._indexes.popitem(last=False)
+        return index
+
+    def stats(self) -> dict:
+        return {**self._contexts.stats(), "indexes": len(self._indexes)}
+
+    def close(self) -> None:
+        self._contexts.close()
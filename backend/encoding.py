@@ -0,0 +1,234 @@
+"""
+Компактные представления ответа /analyze и сжатие ответов.
+
+В обычном JSON каждая транзакция повторяет ключи date/amount/description/
+category и полное название категории, а мерчанты повторяются десятки раз.
+Клиент может попросить другой формат заголовком Accept:
+
+    application/json                          как раньше (по умолчанию)
+    application/vnd.finsight.columnar+json    колонки: transactions - массивы
+                                              date/amount/description/category,
+                                              описания и категории - индексы
+                                              в словарях dictionaries
+    application/msgpack                       тот же колоночный вид в MessagePack
+                                              (если установлен msgpack)
+
+JSON сериализуется orjson, если он установлен. CompressionMiddleware сжимает
+ответы больше COMPRESSION_MIN_BYTES в brotli (если установлен brotli) или
+gzip по Accept-Encoding; SSE не трогает, чтобы события не застревали в буфере.
+"""
+
+import gzip
+import json
+import os
+from typing import List, Optional, Tuple
+
+from fastapi import Response
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESSION_MIN_BYTES = int(os.getenv("COMPRESSION_MIN_BYTES", "1024"))
+GZIP_LEVEL = int(os.getenv("GZIP_LEVEL", "6"))
+BROTLI_QUALITY = int(os.getenv("BROTLI_QUALITY", "5"))
+
+JSON_MEDIA_TYPE = "application/json"
+COLUMNAR_MEDIA_TYPE = "application/vnd.finsight.columnar+json"
+MSGPACK_MEDIA_TYPE = "application/msgpack"
+COLUMNAR_FORMAT = "columnar-v1"
+
+TRANSACTION_FIELDS = ("date", "amount", "description", "category", "operation")
+# Поля со словарями: значение в колонке - индекс в dictionaries[поле]
+DICTIONARY_FIELDS = ("description", "category", "operation")
+
+
+def dumps(data) -> bytes:
+    """JSON в UTF-8 без пробелов; orjson в несколько раз быстрее json.dumps"""
+    if orjson is not None:
+        return orjson.dumps(data, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(data, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def dumps_str(data) -> str:
+    return dumps(data).decode("utf-8")
+
+
+def to_columnar(result: dict) -> dict:
+    """Ответ /analyze с транзакциями по колонкам и словарями описаний и категорий"""
+    transactions = result.get("transactions") or []
+    columns = {name: [] for name in TRANSACTION_FIELDS}
+    dictionaries = {name: [] for name in DICTIONARY_FIELDS}
+    positions = {name: {} for name in DICTIONARY_FIELDS}
+    for txn in transactions:
+        for name in TRANSACTION_FIELDS:
+            value = txn.get(name)
+            if name in positions:
+                index = positions[name].get(value)
+                if index is None:
+                    index = positions[name][value] = len(dictionaries[name])
+                    dictionaries[name].append(value)
+                value = index
+            columns[name].append(value)
+    return {
+        **result,
+        "format": COLUMNAR_FORMAT,
+        "transactions": {"count": len(transactions), **columns},
+        "dictionaries": dictionaries,
+    }
+
+
+def from_columnar(data: dict) -> dict:
+    """Обратное преобразование (для клиентов и проверки)"""
+    result = {key: value for key, value in data.items() if key not in ("format", "dictionaries")}
+    columns = data["transactions"]
+    dictionaries = data["dictionaries"]
+    result["transactions"] = [
+        {
+            name: dictionaries[name][columns[name][i]] if name in dictionaries else columns[name][i]
+            for name in TRANSACTION_FIELDS
+        }
+        for i in range(columns["count"])
+    ]
+    return result
+
+
+def available_media_types() -> List[str]:
+    types = [JSON_MEDIA_TYPE, COLUMNAR_MEDIA_TYPE]
+    if msgpack is not None:
+        types.append(MSGPACK_MEDIA_TYPE)
+    return types
+
+
+def _parse_q(params: str) -> float:
+    """q из параметров элемента Accept/Accept-Encoding ("q=0.5;..."); без q - 1, мусор - 0"""
+    for param in params.split(";"):
+        name, _, value = param.strip().partition("=")
+        if name.strip().lower() == "q":
+            try:
+                return float(value)
+            except ValueError:
+                return 0.0
+    return 1.0
+
+
+def negotiate(accept: Optional[str]) -> str:
+    """Формат ответа по Accept с учетом q; неизвестное и */* - обычный JSON"""
+    best, best_q = JSON_MEDIA_TYPE, 0.0
+    supported = available_media_types()
+    for part in (accept or "").split(","):
+        media_type, _, params = part.strip().partition(";")
+        q = _parse_q(params)
+        if media_type.strip().lower() in supported and q > best_q:
+            best, best_q = media_type.strip().lower(), q
+    return best
+
+
+def encode_result(data: dict, accept: Optional[str], field: Optional[str] = None) -> Response:
+    """
+    Ответ с результатом /analyze в формате, который попросил клиент.
+    field - если результат вложен (задача из /jobs: data["result"]).
+    """
+    media_type = negotiate(accept)
+    if media_type != JSON_MEDIA_TYPE:
+        if field is None:
+            data = to_columnar(data)
+        elif isinstance(data.get(field), dict):
+            data = {**data, field: to_columnar(data[field])}
+    if media_type == MSGPACK_MEDIA_TYPE:
+        body = msgpack.packb(data, use_bin_type=True)
+    else:
+        body = dumps(data)
+    return Response(body, media_type=media_type, headers={"Vary": "Accept, Accept-Encoding"})
+
+
+def choose_encoding(accept_encoding: str) -> Optional[str]:
+    # q=0 в любой записи (0, 0.0, 0.000) - отказ от кодировки (RFC 9110, 12.5.3)
+    accepted = set()
+    for part in accept_encoding.split(","):
+        coding, _, params = part.strip().partition(";")
+        if _parse_q(params) > 0:
+            accepted.add(coding.strip().lower())
+    if brotli is not None and "br" in accepted:
+        return "br"
+    if "gzip" in accepted:
+        return "gzip"
+    return None
+
+
+def compress(body: bytes, encoding: str) -> bytes:
+    if encoding == "br":
+        return brotli.compress(body, quality=BROTLI_QUALITY)
+    return gzip.compress(body, compresslevel=GZIP_LEVEL, mtime=0)
+
+
+class CompressionMiddleware:
+    """
+    ASGI-middleware: сжимает тело ответа целиком, если клиент принимает br/gzip
+    и тело не меньше minimum_size. Потоковые ответы (text/event-stream) и уже
+    сжатые проходят как есть.
+    """
+
+    def __init__(self, app, minimum_size: int = COMPRESSION_MIN_BYTES):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        headers = dict(scope.get("headers") or [])
+        encoding = choose_encoding(headers.get(b"accept-encoding", b"").decode("latin-1"))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        start = None
+        chunks: List[bytes] = []
+        passthrough = False
+
+        async def wrapped_send(message):
+            nonlocal start, passthrough
+            if message["type"] == "http.response.start":
+                response_headers = dict(message.get("headers") or [])
+                content_type = response_headers.get(b"content-type", b"")
+                if content_type.startswith(b"text/event-stream") or b"content-encoding" in response_headers:
+                    passthrough = True
+                    await send(message)
+                else:
+                    start = message
+                return
+            if passthrough or message["type"] != "http.response.body":
+                await send(message)
+                return
+            chunks.append(message.get("body", b""))
+            if message.get("more_body", False):
+                return
+            start_message, body = _maybe_compress(start, b"".join(chunks), encoding, self.minimum_size)
+            await send(start_message)
+            await send({"type": "http.response.body", "body": body})
+
+        await self.app(scope, receive, wrapped_send)
+
+
+def _maybe_compress(start: dict, body: bytes, encoding: str, minimum_size: int) -> Tuple[dict, bytes]:
+    headers = [(k, v) for k, v in start.get("headers", []) if k.lower() != b"content-length"]
+    if len(body) >= minimum_size:
+        body = compress(body, encoding)
+        headers.append((b"content-encoding", encoding.encode()))
+        vary = [v for k, v in headers if k.lower() == b"vary"]
+        if not vary:
+            headers.append((b"vary", b"Accept-Encoding"))
+    headers.append((b"content-length", str(len(body)).encode()))
+    return {**start, "headers": headers}, body
@@ -0,0 +1,217 @@
+"""
+Прогноз расходов на следующий месяц по категориям - локально и детерминированно.
+
+Раньше forecast_next_month было числом, которое придумывал LLM. Теперь
+прогноз - сумма двух частей:
+  * регулярные списания (подписки и рассрочки, recurring.py) проецируются
+    точно: каждая живая серия дает свою последнюю сумму столько раз,
+    сколько ее сроков попадает в следующий календарный месяц;
+  * остальные траты - дневной темп по месяцам (неполные месяцы выписки
+    нормируются на покрытые дни), сглаженный экспоненциально
+    (FORECAST_SMOOTHING), с сезонным коэффициентом того же месяца прошлого
+    года, если история покрывает год.
+
+forecast_batch считает сразу много пользователей: транзакции раскладываются
+в тензор пользователь x месяц x категория, цикл идет только по месяцам.
+Ночной пересчет по истории (history.py):
+
+    python forecast.py --history-db history.db --output forecasts.json
+"""
+
+import os
+from typing import Dict, Optional, Sequence, Tuple
+
+import numpy as np
+
+from categories import CATEGORY_KEYS
+from merchant_memo import merchant_key
+from recurring import PERIOD_TOLERANCE, PERIODS, recurring_series, to_days
+
+FORECAST_SMOOTHING = float(os.getenv("FORECAST_SMOOTHING", "0.5"))
+# Насколько доверять сезонности (1 - полностью, 0 - игнорировать)
+FORECAST_SEASONAL_WEIGHT = 0.5
+FORECAST_SEASONAL_LIMITS = (0.5, 2.0)
+
+
+def _month(days: np.ndarray) -> np.ndarray:
+    """Номер месяца (с 1970-01) для номера дня"""
+    return days.astype("datetime64[D]").astype("datetime64[M]").astype(np.int64)
+
+
+def _month_start(months: np.ndarray) -> np.ndarray:
+    return months.astype("datetime64[M]").astype("datetime64[D]").astype(np.int64)
+
+
+def forecast_batch(
+    users: np.ndarray,
+    days: np.ndarray,
+    amounts: np.ndarray,
+    categories: np.ndarray,
+    merchants: np.ndarray,
+    n_users: Optional[int] = None,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    users, merchants, categories - целочисленные id (категория - индекс в
+    CATEGORY_KEYS), days - номер дня (-1 - без даты), amounts - сумма.
+    Возвращает (U x C) прогноз на следующий месяц и номер этого месяца
+    для каждого пользователя (-1, если у пользователя нет датированных трат).
+    """
+    users = np.asarray(users, dtype=np.int64)
+    days = np.asarray(days, dtype=np.int64)
+    amounts = np.asarray(amounts, dtype=np.float64)
+    categories = np.asarray(categories, dtype=np.int64)
+    merchants = np.asarray(merchants, dtype=np.int64)
+    n_users = int(users.max()) + 1 if n_users is None and len(users) else int(n_users or 0)
+    n_categories = len(CATEGORY_KEYS)
+    forecast = np.zeros((n_users, n_categories))
+    target = np.full(n_users, -1, dtype=np.int64)
+
+    valid = (days >= 0) & (amounts > 0)
+    users, days, amounts, categories, merchants = (
+        users[valid], days[valid], amounts[valid], categories[valid], merchants[valid]
+    )
+    if not len(days):
+        return forecast, target
+
+    # Период выписки каждого пользователя и следующий за ним месяц
+    first = np.full(n_users, np.iinfo(np.int64).max)
+    last = np.full(n_users, -1, dtype=np.int64)
+    np.minimum.at(first, users, days)
+    np.maximum.at(last, users, days)
+    active = last >= 0
+    target[active] = _month(last[active]) + 1
+    target_start = _month_start(np.maximum(target, 0))
+    target_days = _month_start(np.maximum(target, 0) + 1) - target_start
+
+    # --- Регулярные списания: последняя сумма серии x число ее сроков в целевом месяце ---
+    series, periods = recurring_series(users * (int(merchants.max()) + 1) + merchants, days, amounts)
+    recurring = series >= 0
+    if recurring.any():
+        idx = np.flatnonzero(recurring)
+        order = idx[np.lexsort((days[idx], series[idx]))]
+        latest = order[np.r_[series[order][1:] != series[order][:-1], True]]
+        u, step, seen = users[latest], periods[latest], days[latest]
+        tolerance = PERIOD_TOLERANCE[np.searchsorted(PERIODS, step)]
+        # Серия, пропустившая очередной срок к концу выписки, закончилась (рассрочка выплачена, подписка отменена)
+        alive = seen + step + tolerance >= last[u]
+        due = (target_start[u] + target_days[u] - 1 - seen) // step - (target_start[u] - 1 - seen) // step
+        projected = np.where(alive, np.maximum(due, 0) * amounts[latest], 0.0)
+        np.add.at(forecast, (u, categories[latest]), projected)
+
+    # --- Остальные траты: дневной темп по месяцам, экспоненциальное сглаживание, сезонность ---
+    rest = ~recurring
+    month = _month(days)
+    first_month = int(month.min())
+    n_months = int(month.max()) - first_month + 1
+    totals = np.bincount(
+        (users[rest] * n_months + month[rest] - first_month) * n_categories + categories[rest],
+        weights=amounts[rest],
+        minlength=n_users * n_months * n_categories,
+    ).reshape(n_users, n_months, n_categories)
+
+    months = np.arange(first_month, first_month + n_months)
+    starts = _month_start(months)
+    ends = _month_start(months + 1) - 1
+    covered = np.clip(
+        np.minimum(last[:, None], ends[None, :]) - np.maximum(first[:, None], starts[None, :]) + 1,
+        0, None,
+    ).astype(np.float64)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        rates = totals / covered[:, :, None]
+
+    level = np.full((n_users, n_categories), np.nan)
+    for m in range(n_months):
+        seen_month = covered[:, m] > 0
+        # Неполный месяц весит меньше полного
+        alpha = (FORECAST_SMOOTHING * covered[:, m] / (ends[m] - starts[m] + 1))[:, None]
+        rate = rates[:, m, :]
+        start = seen_month[:, None] & np.isnan(level)
+        update = seen_month[:, None] & ~np.isnan(level)
+        level = np.where(start, rate, np.where(update, level + alpha * (rate - level), level))
+    level = np.nan_to_num(level)
+
+    # Сезонность: темп того же месяца год назад к среднему темпу за предшествовавшие целевому 12 месяцев
+    seasonal = np.ones((n_users, n_categories))
+    year_ago = target - 12 - first_month
+    has_year = active & (year_ago >= 0)
+    if has_year.any():
+        cum_totals = np.concatenate([np.zeros((n_users, 1, n_categories)), np.cumsum(totals, axis=1)], axis=1)
+        cum_covered = np.concatenate([np.zeros((n_users, 1)), np.cumsum(covered, axis=1)], axis=1)
+        who = np.flatnonzero(has_year)
+        j = year_ago[who]
+        year_covered = cum_covered[who, j + 12] - cum_covered[who, j]
+        # Нужны почти полный тот же месяц и почти полный год за ним
+        enough = (covered[who, j] >= 0.8 * (ends[j] - starts[j] + 1)) & (year_covered >= 330)
+        who, j, year_covered = who[enough], j[enough], year_covered[enough]
+        if len(who):
+            year_rate = (cum_totals[who, j + 12] - cum_totals[who, j]) / year_covered[:, None]
+            with np.errstate(invalid="ignore", divide="ignore"):
+                ratio = np.where(year_rate > 0, rates[who, j] / year_rate, 1.0)
+            seasonal[who] = np.clip(1 + FORECAST_SEASONAL_WEIGHT * (ratio - 1), *FORECAST_SEASONAL_LIMITS)
+
+    forecast += np.where(active[:, None], level * seasonal * target_days[:, None], 0.0)
+    return forecast, target
+
+
+def forecast_transactions(transactions, history: Sequence[tuple] = ()) -> Optional[Dict[str, float]]:
+    """
+    Прогноз по транзакциям одного пользователя: {ключ категории: сумма} или
+    None, если нет ни одной даты. history - прошлые транзакции (день, сумма,
+    описание, категория) из history.HistoryStore.past.
+    """
+    rows = [(txn.date, txn.amount, txn.description, txn.category) for txn in transactions] + list(history)
+    if not rows:
+        return None
+    days = to_days([row[0] for row in rows])
+    if not (days >= 0).any():
+        return None
+    _, merchants = np.unique([merchant_key(row[2]) or row[2].lower() for row in rows], return_inverse=True)
+    key_index = {key: i for i, key in enumerate(CATEGORY_KEYS)}
+    forecast, _ = forecast_batch(
+        np.zeros(len(rows), dtype=np.int64),
+        days,
+        np.array([row[1] for row in rows], dtype=np.float64),
+        np.array([key_index.get(row[3] or "other", key_index["other"]) for row in rows], dtype=np.int64),
+        merchants,
+        n_users=1,
+    )
+    return {key: round(float(value), 2) for key, value in zip(CATEGORY_KEYS, forecast[0]) if value > 0}
+
+
+if __name__ == "__main__":
+    import argparse
+    import json
+    import sqlite3
+    import time
+
+    parser = argparse.ArgumentParser(description="Пакетный прогноз на следующий месяц по истории пользователей")
+    parser.add_argument("--history-db", required=True)
+    parser.add_argument("--output", required=True)
+    args = parser.parse_args()
+
+    db = sqlite3.connect(args.history_db)
+    rows = db.execute("SELECT history_id, day, amount, description, category FROM history_transactions").fetchall()
+    db.close()
+    started = time.perf_counter()
+    ids, users = np.unique([row[0] for row in rows], return_inverse=True)
+    _, merchants = np.unique([merchant_key(row[3]) or row[3].lower() for row in rows], return_inverse=True)
+    key_index = {key: i for i, key in enumerate(CATEGORY_KEYS)}
+    result, months = forecast_batch(
+        users,
+        to_days([row[1] for row in rows]),
+        np.array([row[2] for row in rows], dtype=np.float64),
+        np.array([key_index.get(row[4], key_index["other"]) for row in rows], dtype=np.int64),
+        merchants,
+        n_users=len(ids),
+    )
+    forecasts = {
+        history_id: {
+            "month": str(np.datetime64(int(months[i]), "M")) if months[i] >= 0 else None,
+            "total": round(float(result[i].sum()), 2),
+            "categories": {key: round(float(v), 2) for key, v in zip(CATEGORY_KEYS, result[i]) if v > 0},
+        }
+        for i, history_id in enumerate(ids)
+    }
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(forecasts, f, ensure_ascii=False, indent=2)
+    print(f"Forecasts for {len(ids)} users ({len(rows)} transactions) in {time.perf_counter() - started:.2f} s")
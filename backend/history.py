@@ -0,0 +1,276 @@
+"""
+История транзакций пользователя между выписками - только по желанию.
+
+По умолчанию сервер транзакции не хранит (см. README). Если задан HISTORY_DB
+и клиент присылает history_id, нормализованные транзакции сохраняются в
+SQLite под отпечатком: дата, сумма в тиынах, описание и номер повтора
+(две одинаковые покупки в один день - две разные транзакции). Выписка за
+новый месяц или за пересекающийся период сначала сверяется с историей:
+известные транзакции берут категорию оттуда, новые - по описаниям, которые
+у этого пользователя уже встречались, и в LLM уходят только оставшиеся.
+
+Итоги по месяцам и категориям (history_rollups) обновляются только на
+добавленные строки, поэтому стоимость новой выписки растет с дельтой,
+а не со всей историей.
+"""
+
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+from collections import Counter, defaultdict
+from datetime import date, timedelta
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from categories import CATEGORY_KEYS, build_categories, category_key
+from kaspi_parser import Transaction
+
+HISTORY_DB = os.getenv("HISTORY_DB", "")
+# history_id - случайный токен клиента (например, UUID); короткий id легко подобрать
+HISTORY_ID_MIN_LENGTH = 16
+HISTORY_ID_MAX_LENGTH = 128
+HISTORY_ID_RE = re.compile(rf"[A-Za-z0-9_-]{{{HISTORY_ID_MIN_LENGTH},{HISTORY_ID_MAX_LENGTH}}}")
+# Насколько назад смотреть в истории при поиске регулярных списаний (recurring.py)
+HISTORY_RECURRING_DAYS = int(os.getenv("HISTORY_RECURRING_DAYS", "400"))
+
+# Лимит SQLite на число параметров в запросе
+_BATCH = 500
+_SPACES_RE = re.compile(r"\s+")
+
+
+def normalize_description(description: str) -> str:
+    return _SPACES_RE.sub(" ", description).strip().lower()
+
+
+def _day(date: str) -> str:
+    """01.03.2024 -> 2024-03-01; даты от LLM в другом формате остаются как есть"""
+    parts = date.split(".")
+    if len(parts) != 3:
+        return date
+    day, month, year = parts
+    if len(year) == 2:
+        year = "20" + year
+    return f"{year}-{month}-{day}"
+
+
+def fingerprints(transactions: Iterable[Transaction]) -> List[str]:
+    """Стабильные отпечатки транзакций в порядке выписки"""
+    seen: Counter = Counter()
+    result = []
+    for txn in transactions:
+        base = f"{_day(txn.date)}|{round(txn.amount * 100)}|{normalize_description(txn.description)}"
+        result.append(hashlib.sha1(f"{base}|{seen[base]}".encode("utf-8")).hexdigest())
+        seen[base] += 1
+    return result
+
+
+def transactions_from_result(result: dict) -> List[Transaction]:
+    """Транзакции из готового ответа /analyze (категории в нем - локализованные названия)"""
+    return [
+        Transaction(
+            date=item["date"],
+            amount=float(item["amount"]),
+            description=item.get("description", ""),
+            category=category_key(item.get("category") or "") or "other",
+            operation=item.get("operation") or "purchase",
+        )
+        for item in result.get("transactions", [])
+    ]
+
+
+class HistoryStore:
+    def __init__(self, db_path: str = HISTORY_DB):
+        self._lock = threading.Lock()
+        self._db = self._open_db(db_path) if db_path else None
+        self.known = 0  # транзакции, уже бывшие в истории
+        self.added = 0
+        self.memo_hits = 0  # категория взята по описанию из истории
+
+    @property
+    def enabled(self) -> bool:
+        return self._db is not None
+
+    @staticmethod
+    def _open_db(path: str) -> sqlite3.Connection:
+        db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute(
+            "CREATE TABLE IF NOT EXISTS history_transactions ("
+            "history_id TEXT NOT NULL, fingerprint TEXT NOT NULL, day TEXT NOT NULL, "
+            "amount REAL NOT NULL, description TEXT NOT NULL, category TEXT NOT NULL, "
+            "PRIMARY KEY (history_id, fingerprint)) WITHOUT ROWID"
+        )
+        db.execute(
+            "CREATE TABLE IF NOT EXISTS history_categories ("
+            "history_id TEXT NOT NULL, description TEXT NOT NULL, category TEXT NOT NULL, "
+            "PRIMARY KEY (history_id, description)) WITHOUT ROWID"
+        )
+        db.execute(
+            "CREATE TABLE IF NOT EXISTS history_rollups ("
+            "history_id TEXT NOT NULL, period TEXT NOT NULL, category TEXT NOT NULL, "
+            "amount REAL NOT NULL, count INTEGER NOT NULL, "
+            "PRIMARY KEY (history_id, period, category)) WITHOUT ROWID"
+        )
+        return db
+
+    def _select(self, sql: str, history_id: str, keys: List[str]) -> Dict[str, str]:
+        found = {}
+        for start in range(0, len(keys), _BATCH):
+            batch = keys[start:start + _BATCH]
+            placeholders = ",".join("?" * len(batch))
+            found.update(self._db.execute(sql.format(placeholders), (history_id, *batch)).fetchall())
+        return found
+
+    def _known(self, history_id: str, fps: List[str]) -> Dict[str, str]:
+        return self._select(
+            "SELECT fingerprint, category FROM history_transactions WHERE history_id = ? AND fingerprint IN ({})",
+            history_id, fps,
+        )
+
+    def apply_known(self, history_id: str, transactions: List[Transaction]) -> dict:
+        """
+        Проставляет категории транзакциям без категории: уже бывшим в истории -
+        сохраненную, новым - по описанию, если у пользователя такое уже встречалось.
+        """
+        if not self.enabled or not transactions:
+            return {"known": 0, "new": len(transactions), "memo": 0}
+        fps = fingerprints(transactions)
+        with self._lock:
+            known = self._known(history_id, fps)
+            pending = [txn for fp, txn in zip(fps, transactions) if fp not in known and txn.category is None]
+            memo = self._select(
+                "SELECT description, category FROM history_categories WHERE history_id = ? AND description IN ({})",
+                history_id, sorted({normalize_description(txn.description) for txn in pending}),
+            ) if pending else {}
+        for fp, txn in zip(fps, transactions):
+            if txn.category is None and fp in known:
+                txn.category = known[fp]
+        memo_hits = 0
+        for txn in pending:
+            category = memo.get(normalize_description(txn.description))
+            if category is not None:
+                txn.category = category
+                memo_hits += 1
+        self.known += len(known)
+        self.memo_hits += memo_hits
+        return {"known": len(known), "new": len(transactions) - len(known), "memo": memo_hits}
+
+    def add(self, history_id: str, transactions: List[Transaction]) -> int:
+        """Сохраняет новые транзакции и обновляет итоги только на них; возвращает число добавленных"""
+        if not self.enabled or not transactions:
+            return 0
+        fps = fingerprints(transactions)
+        with self._lock:
+            known = self._known(history_id, fps)
+            new = [
+                (fp, txn, txn.category if txn.category in CATEGORY_KEYS else "other")
+                for fp, txn in zip(fps, transactions) if fp not in known
+            ]
+            if not new:
+                return 0
+            rollups: Dict[tuple, list] = defaultdict(lambda: [0.0, 0])
+            for _, txn, category in new:
+                row = rollups[(_day(txn.date)[:7], category)]
+                row[0] += txn.amount
+                row[1] += 1
+            self._db.execute("BEGIN")
+            try:
+                self._db.executemany(
+                    "INSERT OR IGNORE INTO history_transactions "
+                    "(history_id, fingerprint, day, amount, description, category) VALUES (?, ?, ?, ?, ?, ?)",
+                    [
+                        (history_id, fp, _day(txn.date), txn.amount, txn.description, category)
+                        for fp, txn, category in new
+                    ],
+                )
+                self._db.executemany(
+                    "INSERT OR REPLACE INTO history_categories (history_id, description, category) VALUES (?, ?, ?)",
+                    {
+                        (history_id, normalize_description(txn.description), category)
+                        for _, txn, category in new
+                    },
+                )
+                self._db.executemany(
+                    "INSERT INTO history_rollups (history_id, period, category, amount, count) VALUES (?, ?, ?, ?, ?) "
+                    "ON CONFLICT (history_id, period, category) DO UPDATE SET "
+                    "amount = amount + excluded.amount, count = count + excluded.count",
+                    [(history_id, period, category, amount, count) for (period, category), (amount, count) in rollups.items()],
+                )
+                self._db.execute("COMMIT")
+            except Exception:
+                self._db.execute("ROLLBACK")
+                raise
+        self.added += len(new)
+        return len(new)
+
+    def past(
+        self, history_id: str, transactions: List[Transaction], days: int = HISTORY_RECURRING_DAYS
+    ) -> List[Tuple[str, float, str, str]]:
+        """
+        Сохраненные транзакции (день ISO, сумма, описание, категория) за days дней до
+        последней даты выписки, кроме тех, что есть в самой выписке.
+        """
+        if not self.enabled or not transactions:
+            return []
+        dates = [day for day in (_day(txn.date) for txn in transactions) if len(day) == 10]
+        if not dates:
+            return []
+        since = (date.fromisoformat(max(dates)) - timedelta(days=days)).isoformat()
+        current = set(fingerprints(transactions))
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT fingerprint, day, amount, description, category FROM history_transactions "
+                "WHERE history_id = ? AND day >= ?",
+                (history_id, since),
+            ).fetchall()
+        return [row[1:] for row in rows if row[0] not in current]
+
+    def summary(self, history_id: str, language: str = "ru") -> Optional[dict]:
+        """Итоги по всей истории и по месяцам - только из history_rollups, без прохода по транзакциям"""
+        if not self.enabled:
+            return None
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT period, category, amount, count FROM history_rollups WHERE history_id = ? ORDER BY period",
+                (history_id,),
+            ).fetchall()
+        if not rows:
+            return None
+        totals: Dict[str, float] = defaultdict(float)
+        periods: Dict[str, Dict[str, float]] = defaultdict(dict)
+        count = 0
+        for period, category, amount, n in rows:
+            totals[category] += amount
+            periods[period][category] = amount
+            count += n
+        return {
+            "total_spent": round(sum(totals.values()), 2),
+            "transactions": count,
+            "categories": build_categories(totals, language),
+            "periods": [
+                {
+                    "period": period,
+                    "total_spent": round(sum(amounts.values()), 2),
+                    "categories": build_categories(amounts, language),
+                }
+                for period, amounts in periods.items()
+            ],
+        }
+
+    def delete(self, history_id: str) -> bool:
+        if not self.enabled:
+            return False
+        with self._lock:
+            deleted = 0
+            for table in ("history_transactions", "history_categories", "history_rollups"):
+                deleted += self._db.execute(f"DELETE FROM {table} WHERE history_id = ?", (history_id,)).rowcount
+        return deleted > 0
+
+    def stats(self) -> dict:
+        return {"enabled": self.enabled, "known": self.known, "added": self.added, "memo_hits": self.memo_hits}
+
+    def close(self) -> None:
+        if self._db is not None:
+            self._db.close()
+            self._db = None
@@ -0,0 +1,206 @@
+"""
+Очередь фоновых задач анализа для /analyze/batch.
+
+Задачи и загруженные PDF сохраняются на диск (SQLite + каталог со
+спулом), поэтому рестарт сервера не теряет работу: незавершенные задачи
+снова ставятся в очередь при старте. Воркеров ограниченное число
+(JOB_WORKERS), очередь приоритетная, а при переполнении (JOB_QUEUE_LIMIT)
+новые задачи отклоняются - клиент повторит позже.
+"""
+
+import asyncio
+import json
+import os
+import shutil
+import sqlite3
+import threading
+import time
+import uuid
+from pathlib import Path
+from typing import Awaitable, Callable, List, Optional
+
+ROOT = Path(__file__).parent
+JOBS_DIR = Path(os.getenv("JOBS_DIR", str(ROOT / "jobs")))
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+JOB_QUEUE_LIMIT = int(os.getenv("JOB_QUEUE_LIMIT", "100"))
+JOB_TTL_SECONDS = float(os.getenv("JOB_TTL_SECONDS", str(24 * 3600)))
+# Как часто воркеры удаляют задачи старше JOB_TTL_SECONDS (после очередной завершенной)
+JOB_PURGE_INTERVAL_SECONDS = float(os.getenv("JOB_PURGE_INTERVAL_SECONDS", "600"))
+
+QUEUED, RUNNING, DONE, FAILED = "queued", "running", "done", "failed"
+
+
+class QueueFullError(Exception):
+    pass
+
+
+class JobManager:
+    def __init__(
+        self,
+        handler: Callable[[dict], Awaitable[dict]],
+        jobs_dir: Path = JOBS_DIR,
+        workers: int = JOB_WORKERS,
+        queue_limit: int = JOB_QUEUE_LIMIT,
+        ttl_seconds: float = JOB_TTL_SECONDS,
+    ):
+        self.handler = handler
+        self.jobs_dir = jobs_dir
+        self.workers = workers
+        self.queue_limit = queue_limit
+        self.ttl_seconds = ttl_seconds
+        self._db: Optional[sqlite3.Connection] = None
+        # В SQLite ходят из потоков (asyncio.to_thread): воркеры, эндпоинты и /health
+        self._lock = threading.Lock()
+        self._purged_at = 0.0
+        self._submitting = 0
+        self._queue: Optional[asyncio.PriorityQueue] = None
+        self._tasks: List[asyncio.Task] = []
+
+    # --- жизненный цикл ---
+
+    async def start(self) -> None:
+        self.jobs_dir.mkdir(parents=True, exist_ok=True)
+        self._db = sqlite3.connect(self.jobs_dir / "jobs.db", check_same_thread=False, isolation_level=None)
+        self._db.row_factory = sqlite3.Row
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            "id TEXT PRIMARY KEY, batch_id TEXT, status TEXT NOT NULL, priority INTEGER NOT NULL, "
+            "created_at REAL NOT NULL, finished_at REAL, filename TEXT, params TEXT NOT NULL, "
+            "result TEXT, error TEXT)"
+        )
+        self._queue = asyncio.PriorityQueue()
+        await self._purge()
+
+        # Что не успели доделать до рестарта - снова в очередь
+        pending = self._db.execute(
+            "SELECT id, priority, created_at FROM jobs WHERE status IN (?, ?)", (QUEUED, RUNNING)
+        ).fetchall()
+        for row in pending:
+            self._db.execute("UPDATE jobs SET status = ? WHERE id = ?", (QUEUED, row["id"]))
+            self._queue.put_nowait((-row["priority"], row["created_at"], row["id"]))
+        if pending:
+            print(f"♻️ Восстановлено {len(pending)} незавершенных задач")
+
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        if self._db is not None:
+            with self._lock:
+                self._db.close()
+            self._db = None
+
+    # --- API ---
+
+    async def submit(self, upload_path: str, filename: str, params: dict, priority: int = 0, batch_id: str = "") -> dict:
+        """upload_path - уже сохраненный PDF (uploads.spool_upload); файл переносится в спул очереди"""
+        # Пока задача пишется на диск, ее место в очереди уже занято - параллельные submit не превысят лимит
+        if self._queue.qsize() + self._submitting >= self.queue_limit:
+            raise QueueFullError(f"В очереди уже {self._queue.qsize()} задач")
+        job_id = uuid.uuid4().hex
+        created_at = time.time()
+        self._submitting += 1
+        try:
+            await asyncio.to_thread(self._insert, job_id, upload_path, filename, params, priority, batch_id, created_at)
+        finally:
+            self._submitting -= 1
+        # asyncio.Queue не потокобезопасна - в очередь кладем уже из цикла событий
+        self._queue.put_nowait((-priority, created_at, job_id))
+        return {"id": job_id, "filename": filename, "status": QUEUED}
+
+    async def get(self, job_id: str) -> Optional[dict]:
+        job = await asyncio.to_thread(self._load, job_id)
+        if job is not None and job["status"] == QUEUED:
+            job["queue_size"] = self._queue.qsize()
+        return job
+
+    async def stats(self) -> dict:
+        counts = await asyncio.to_thread(self._count)
+        return {"workers": self.workers, "queue_size": self._queue.qsize(), "queue_limit": self.queue_limit, **counts}
+
+    def purge_finished(self) -> int:
+        with self._lock:
+            return self._db.execute(
+                "DELETE FROM jobs WHERE status IN (?, ?) AND finished_at < ?",
+                (DONE, FAILED, time.time() - self.ttl_seconds),
+            ).rowcount
+
+    async def _purge(self) -> None:
+        self._purged_at = time.monotonic()
+        purged = await asyncio.to_thread(self.purge_finished)
+        if purged:
+            print(f"🧹 Удалено {purged} завершенных задач старше JOB_TTL_SECONDS")
+
+    # --- воркеры ---
+
+    async def _worker(self) -> None:
+        while True:
+            _, _, job_id = await self._queue.get()
+            try:
+                await self._run(job_id)
+                # На долго живущем сервере завершенные задачи иначе копились бы до рестарта
+                if time.monotonic() - self._purged_at >= JOB_PURGE_INTERVAL_SECONDS:
+                    await self._purge()
+            finally:
+                self._queue.task_done()
+
+    async def _run(self, job_id: str) -> None:
+        params = await asyncio.to_thread(self._claim, job_id)
+        if params is None:
+            return
+        try:
+            result = await self.handler(params)
+        except Exception as e:
+            print(f"⚠️ Задача {job_id} упала: {e}")
+            await asyncio.to_thread(self._finish, job_id, FAILED, error=str(e))
+        else:
+            await asyncio.to_thread(self._finish, job_id, DONE, result=json.dumps(result, ensure_ascii=False))
+        Path(params["pdf_path"]).unlink(missing_ok=True)
+
+    def _claim(self, job_id: str) -> Optional[dict]:
+        with self._lock:
+            row = self._db.execute("SELECT params FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            if row is None:
+                return None
+            self._db.execute("UPDATE jobs SET status = ? WHERE id = ?", (RUNNING, job_id))
+        return json.loads(row["params"])
+
+    def _finish(self, job_id: str, status: str, result: Optional[str] = None, error: Optional[str] = None) -> None:
+        with self._lock:
+            self._db.execute(
+                "UPDATE jobs SET status = ?, finished_at = ?, result = ?, error = ? WHERE id = ?",
+                (status, time.time(), result, error, job_id),
+            )
+
+    def _insert(
+        self, job_id: str, upload_path: str, filename: str, params: dict, priority: int, batch_id: str, created_at: float
+    ) -> None:
+        pdf_path = self.jobs_dir / f"{job_id}.pdf"
+        shutil.move(upload_path, pdf_path)
+        params = {**params, "pdf_path": str(pdf_path)}
+        with self._lock:
+            self._db.execute(
+                "INSERT INTO jobs (id, batch_id, status, priority, created_at, filename, params) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (job_id, batch_id, QUEUED, priority, created_at, filename, json.dumps(params)),
+            )
+
+    def _load(self, job_id: str) -> Optional[dict]:
+        with self._lock:
+            row = self._db.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        job = {"id": row["id"], "batch_id": row["batch_id"], "status": row["status"], "filename": row["filename"]}
+        if row["result"] is not None:
+            job["result"] = json.loads(row["result"])
+        if row["error"] is not None:
+            job["error"] = row["error"]
+        return job
+
+    def _count(self) -> dict:
+        with self._lock:
+            return dict(self._db.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall())
@@ -0,0 +1,205 @@
+"""
+Детерминированный парсер выписок Kaspi Gold.
+
+Разбирает текст, который отдает pdfplumber, построчно скомпилированными
+регулярками: дата, сумма (в любом из форматов Kaspi), тип операции, детали.
+Категория проставляется по правилам из categories.py; до LLM доходят только
+строки, которые правила не распознали.
+"""
+
+import re
+from collections import defaultdict
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+from categories import (
+    build_categories,
+    category_name,
+    is_subscription,
+    match_category,
+)
+
+# Строка транзакции начинается с даты: 01.03.24 или 01.03.2024
+DATE_START_RE = re.compile(r"^\s*\d{2}\.\d{2}\.\d{2,4}\b")
+
+# Суммы Kaspi: "- 1 500,00 ₸", "1 500.00 - T", "-1 500 ₸", "+ 10 000 ₸"
+ROW_RE = re.compile(
+    r"""^\s*(?P<date>\d{2}\.\d{2}\.\d{2,4})\s+
+    (?P<pre>[-+−])?\s*
+    (?P<num>\d+(?:[ \u00a0]\d{3})*(?:[.,]\d{1,2})?)\s*
+    (?P<post>[-+−])?\s*
+    (?:₸|〒|KZT|T)\s*
+    (?P<details>.*?)\s*$""",
+    re.VERBOSE,
+)
+
+OPERATIONS = {
+    "income": ("replenishment", "пополнение", "толықтыру"),
+    "transfer": ("transfers", "transfer", "переводы", "перевод", "аударымдар", "аударым"),
+    "withdrawal": ("withdrawals", "withdrawal", "снятие", "снятия", "ақша алу"),
+    "purchase": ("purchases", "purchase", "покупки", "покупка", "сатып алулар", "сатып алу"),
+    "other": ("others", "разное", "әртүрлі"),
+}
+OPERATION_RE = re.compile(
+    "^(?:" + "|".join(
+        f"(?P<{op}>" + "|".join(re.escape(word) for word in words) + ")"
+        for op, words in OPERATIONS.items()
+    ) + r")\b\s*",
+    re.IGNORECASE,
+)
+
+# Переводы людям и снятие наличных правила по мерчантам не покрывают
+OPERATION_CATEGORY = {"transfer": "other", "withdrawal": "other"}
+
+
+@dataclass(slots=True)
+class Transaction:
+    date: str
+    amount: float
+    description: str
+    operation: str = "purchase"
+    category: Optional[str] = None  # ключ из categories.CATEGORY_KEYS
+    subscription: bool = False  # регулярное списание (recurring.py) или подписка по справочнику мерчантов
+
+    def to_dict(self, language: str = "ru") -> dict:
+        return {
+            "date": self.date,
+            "amount": self.amount,
+            "description": self.description,
+            "category": category_name(self.category or "other", language),
+            "operation": self.operation,
+        }
+
+
+@dataclass
+class ParsedStatement:
+    transactions: List[Transaction] = field(default_factory=list)
+    unparsed: List[str] = field(default_factory=list)
+    skipped: int = 0  # пополнения и прочие приходы
+
+    @property
+    def coverage(self) -> float:
+        """Доля строк-транзакций, которые парсер разобрал сам"""
+        total = len(self.transactions) + self.skipped + len(self.unparsed)
+        return (len(self.transactions) + self.skipped) / total if total else 0.0
+
+    @property
+    def uncategorized(self) -> List[Transaction]:
+        return [txn for txn in self.transactions if txn.category is None]
+
+
+def _normalize_date(value: str) -> str:
+    day, month, year = value.split(".")
+    if len(year) == 2:
+        year = "20" + year
+    return f"{day}.{month}.{year}"
+
+
+def _parse_amount(value: str) -> float:
+    return float(value.replace(" ", "").replace("\u00a0", "").replace(",", "."))
+
+
+def parse_line(line: str):
+    """Transaction, "income" для прихода или None, если строку не разобрать"""
+    match = ROW_RE.match(line)
+    if not match:
+        return None
+    sign = match["pre"] or match["post"]
+    details = match["details"]
+
+    operation = "purchase"
+    op_match = OPERATION_RE.match(details)
+    if op_match:
+        operation = op_match.lastgroup
+        details = details[op_match.end():]
+
+    if operation == "income" or sign == "+":
+        return "income"
+    if not sign:
+        return None
+
+    description = details.strip() or operation
+    return Transaction(
+        date=_normalize_date(match["date"]),
+        amount=_parse_amount(match["num"]),
+        description=description,
+        operation=operation,
+        category=match_category(description) or OPERATION_CATEGORY.get(operation),
+    )
+
+
+def parse_statement(text: str) -> ParsedStatement:
+    statement = ParsedStatement()
+    for line in text.splitlines():
+        if not DATE_START_RE.match(line):
+            continue  # заголовки, итоги, колонтитулы
+        parsed = parse_line(line)
+        if parsed is None:
+            statement.unparsed.append(line.strip())
+        elif parsed == "income":
+            statement.skipped += 1
+        else:
+            statement.transactions.append(parsed)
+    return statement
+
+
+def split_statement(text: str, max_chars: int) -> List[str]:
+    """
+    Режет текст на чанки не длиннее max_chars, не разрывая транзакции:
+    строка с датой начинает новую запись, строки без даты - ее продолжение.
+    """
+    records: List[List[str]] = [[]]
+    for line in text.splitlines():
+        if DATE_START_RE.match(line) and records[-1]:
+            records.append([])
+        records[-1].append(line)
+
+    chunks: List[str] = []
+    current: List[str] = []
+    size = 0
+    for record in records:
+        block = "\n".join(record)
+        if current and size + len(block) + 1 > max_chars:
+            chunks.append("\n".join(current))
+            current, size = [], 0
+        current.append(block)
+        size += len(block) + 1
+    if current:
+        chunks.append("\n".join(current))
+    return [chunk for chunk in chunks if chunk.strip()]
+
+
+def build_subscriptions(transactions: List[Transaction]) -> List[dict]:
+    """Цифровые подписки: одна запись на сервис с последней суммой списания"""
+    latest: Dict[str, float] = {}
+    for txn in transactions:
+        if txn.subscription or is_subscription(txn.description):
+            latest[txn.description] = txn.amount
+    return [{"name": name, "cost": cost} for name, cost in latest.items()]
+
+
+def build_result(
+    transactions: List[Transaction],
+    language: str = "ru",
+    advice: str = "",
+    forecast: Optional[Dict[str, float]] = None,
+) -> dict:
+    """
+    Собирает ответ /analyze в том же формате, что и LLM-анализ.
+    forecast - прогноз на следующий месяц по ключам категорий (forecast.py).
+    """
+    totals: Dict[str, float] = defaultdict(float)
+    for txn in transactions:
+        totals[txn.category or "other"] += txn.amount
+    total_spent = round(sum(totals.values()), 2)
+    result = {
+        "total_spent": total_spent,
+        "forecast_next_month": round(sum(forecast.values()), 2) if forecast is not None else total_spent,
+        "categories": build_categories(totals, language),
+        "subscriptions": build_subscriptions(transactions),
+        "advice": advice,
+        "transactions": [txn.to_dict(language) for txn in transactions],
+    }
+    if forecast is not None:
+        result["forecast_categories"] = build_categories(forecast, language)
+    return result
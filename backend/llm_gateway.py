@@ -0,0 +1,350 @@
+"""
+Шлюз к DeepSeek: все вызовы LLM идут через LLMGateway.
+
+- один AsyncOpenAI на процесс с настроенным пулом keep-alive соединений;
+- ограничитель под квоту: token bucket (LLM_RATE_PER_SECOND) и семафор
+  на число одновременных запросов (LLM_MAX_CONCURRENCY);
+- типизированные ошибки вместо поиска "rate limit" / "401" в тексте исключения;
+- повторы с экспоненциальной задержкой и джиттером (или по Retry-After),
+  но не дольше дедлайна запроса - остаток дедлайна передается как таймаут;
+- hedging: если ответа нет дольше LLM_HEDGE_AFTER_SECONDS, параллельно
+  уходит второй такой же запрос, берется первый ответ (по умолчанию выключено);
+- circuit breaker: после LLM_BREAKER_FAILURES подряд отказов провайдера
+  запросы сразу падают с CircuitOpenError, пока не пройдет LLM_BREAKER_RESET_SECONDS.
+
+Проверяется на bench/stub_llm.py (--latency, --rate-limit-ratio, --tail-ratio)
+через bench/gateway_bench.py.
+"""
+
+import asyncio
+import os
+import random
+import time
+from typing import Optional
+
+import httpx
+import openai
+from openai import AsyncOpenAI, DefaultAsyncHttpxClient
+
+from metrics import LLM_ERRORS, span
+
+LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", "64"))
+LLM_TIMEOUT_SECONDS = float(os.getenv("LLM_TIMEOUT_SECONDS", "180"))
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "32"))
+LLM_RATE_PER_SECOND = float(os.getenv("LLM_RATE_PER_SECOND", "20"))  # 0 - без ограничения
+LLM_RATE_BURST = int(os.getenv("LLM_RATE_BURST", "40"))
+LLM_RETRIES = int(os.getenv("LLM_RETRIES", "3"))
+LLM_BACKOFF_BASE_SECONDS = float(os.getenv("LLM_BACKOFF_BASE_SECONDS", "0.5"))
+LLM_BACKOFF_MAX_SECONDS = float(os.getenv("LLM_BACKOFF_MAX_SECONDS", "8"))
+LLM_DEADLINE_SECONDS = float(os.getenv("LLM_DEADLINE_SECONDS", "300"))
+LLM_HEDGE_AFTER_SECONDS = float(os.getenv("LLM_HEDGE_AFTER_SECONDS", "0"))  # 0 - без hedging
+LLM_BREAKER_FAILURES = int(os.getenv("LLM_BREAKER_FAILURES", "5"))
+LLM_BREAKER_RESET_SECONDS = float(os.getenv("LLM_BREAKER_RESET_SECONDS", "30"))
+
+
+# --- Ошибки ---
+
+class LLMError(Exception):
+    retryable = False
+    # Ошибку вернул сам провайдер (значит, он отвечает), а не наш код до отправки запроса
+    from_provider = False
+    hint = ""
+
+    def __init__(self, message: str, retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class LLMRateLimitError(LLMError):
+    retryable = True
+    from_provider = True
+    hint = "Похоже, закончились лимиты API! Проверьте лимиты на https://platform.deepseek.com/"
+
+
+class LLMQuotaError(LLMError):
+    from_provider = True
+    hint = "Закончился баланс API! Проверьте баланс на https://platform.deepseek.com/"
+
+
+class LLMAuthError(LLMError):
+    from_provider = True
+    hint = "Проблема с API ключом! Проверьте DEEPSEEK_API_KEY в переменных окружения или local_secrets.py"
+
+
+class LLMBadRequestError(LLMError):
+    from_provider = True
+
+
+class LLMUnavailableError(LLMError):
+    """5xx, таймауты и обрывы соединения - провайдер недоступен"""
+    retryable = True
+
+
+class CircuitOpenError(LLMError):
+    hint = "DeepSeek недоступен, запросы временно не отправляются"
+
+
+class DeadlineExceededError(LLMError):
+    pass
+
+
+def _retry_after(exc) -> Optional[float]:
+    response = getattr(exc, "response", None)
+    value = response.headers.get("retry-after") if response is not None else None
+    try:
+        return float(value) if value is not None else None
+    except ValueError:
+        return None
+
+
+def classify_error(exc: Exception) -> LLMError:
+    """Исключение клиента openai -> типизированная ошибка шлюза"""
+    if isinstance(exc, LLMError):
+        return exc
+    message = str(exc)
+    if isinstance(exc, openai.RateLimitError):
+        return LLMRateLimitError(message, _retry_after(exc))
+    if isinstance(exc, (openai.AuthenticationError, openai.PermissionDeniedError)):
+        return LLMAuthError(message)
+    if isinstance(exc, openai.APIStatusError):
+        if exc.status_code == 402:
+            return LLMQuotaError(message)
+        if exc.status_code >= 500:
+            return LLMUnavailableError(message, _retry_after(exc))
+        return LLMBadRequestError(message)
+    if isinstance(exc, (openai.APIConnectionError, openai.APITimeoutError, httpx.TransportError, asyncio.TimeoutError)):
+        return LLMUnavailableError(message or type(exc).__name__)
+    return LLMError(message)
+
+
+def describe_error(error: LLMError) -> str:
+    """Строка для лога: тип ошибки и подсказка, что проверить"""
+    text = f"{type(error).__name__}: {error}"
+    return f"{text}\n⚠️ {error.hint}" if error.hint else text
+
+
+# --- Ограничители ---
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.capacity = max(burst, 1)
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self, deadline: float) -> None:
+        if self.rate <= 0:
+            return
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+                if now + wait > deadline:
+                    raise DeadlineExceededError("Дедлайн истек в очереди ограничителя запросов")
+                await asyncio.sleep(wait)
+
+
+class CircuitBreaker:
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+    def __init__(self, failures: int, reset_seconds: float):
+        self.threshold = failures
+        self.reset_seconds = reset_seconds
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._trial = False
+
+    def before_call(self) -> bool:
+        """Пропускает вызов или бросает CircuitOpenError; True - этот вызов пробный"""
+        if self.state == self.OPEN:
+            if time.monotonic() - self.opened_at < self.reset_seconds:
+                raise CircuitOpenError("Circuit breaker открыт")
+            self.state = self.HALF_OPEN
+            self._trial = False
+        if self.state == self.HALF_OPEN:
+            # Пока пробный запрос не вернулся, остальные сразу отказывают
+            if self._trial:
+                raise CircuitOpenError("Circuit breaker: идет пробный запрос")
+            self._trial = True
+            return True
+        return False
+
+    def record_success(self) -> None:
+        self.state = self.CLOSED
+        self.failures = 0
+        self._trial = False
+
+    def record_failure(self, error: LLMError) -> None:
+        # Отказы "по нашей вине" (400, 401, 429, дедлайн в очереди) не значат, что провайдер лежит
+        if not isinstance(error, LLMUnavailableError):
+            if self.state == self.HALF_OPEN:
+                # Закрыть breaker может только ответ провайдера; пробный запрос,
+                # не дошедший до него (дедлайн в ограничителе), ничего не проверил
+                if error.from_provider:
+                    self.record_success()
+                else:
+                    self.cancel_trial()
+            return
+        self.failures += 1
+        if self.state == self.HALF_OPEN or self.failures >= self.threshold:
+            if self.state != self.OPEN:
+                print(f"🔌 Circuit breaker открыт на {self.reset_seconds:.0f} с после {self.failures} отказов подряд")
+            self.state = self.OPEN
+            self.opened_at = time.monotonic()
+            self._trial = False
+
+    def cancel_trial(self) -> None:
+        """Пробный запрос отменен, не дождавшись ответа: снова открываем и ждем reset_seconds"""
+        if self.state == self.HALF_OPEN and self._trial:
+            self.state = self.OPEN
+            self.opened_at = time.monotonic()
+            self._trial = False
+
+
+# --- Шлюз ---
+
+class LLMGateway:
+    def __init__(
+        self,
+        api_key: str,
+        base_url: str,
+        max_connections: int = LLM_MAX_CONNECTIONS,
+        timeout: float = LLM_TIMEOUT_SECONDS,
+        max_concurrency: int = LLM_MAX_CONCURRENCY,
+        rate_per_second: float = LLM_RATE_PER_SECOND,
+        burst: int = LLM_RATE_BURST,
+        retries: int = LLM_RETRIES,
+        hedge_after: float = LLM_HEDGE_AFTER_SECONDS,
+        breaker_failures: int = LLM_BREAKER_FAILURES,
+        breaker_reset_seconds: float = LLM_BREAKER_RESET_SECONDS,
+    ):
+        # Повторы делает шлюз, а не клиент openai: max_retries=0
+        self.client = AsyncOpenAI(
+            api_key=api_key,
+            base_url=base_url,
+            timeout=timeout,
+            max_retries=0,
+            http_client=DefaultAsyncHttpxClient(
+                limits=httpx.Limits(
+                    max_connections=max_connections,
+                    max_keepalive_connections=max_connections,
+                ),
+            ),
+        )
+        self.timeout = timeout
+        self.retries = retries
+        self.hedge_after = hedge_after
+        self.breaker = CircuitBreaker(breaker_failures, breaker_reset_seconds)
+        self._bucket = TokenBucket(rate_per_second, burst)
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self.counters = {"requests": 0, "attempts": 0, "retries": 0, "hedges": 0, "hedge_wins": 0, "errors": 0}
+        self.errors = {}
+        self.in_flight = 0
+
+    async def close(self) -> None:
+        await self.client.close()
+
+    def snapshot(self) -> dict:
+        return {
+            **self.counters,
+            "errors_by_type": dict(self.errors),
+            "breaker": self.breaker.state,
+            "in_flight": self.in_flight,
+        }
+
+    async def complete(self, deadline: Optional[float] = None, hedge: bool = True, **params):
+        """chat.completions.create с повторами; deadline - time.monotonic(), до которого нужен ответ"""
+        return await self._with_retries(params, deadline, hedge and not params.get("stream"))
+
+    async def stream(self, deadline: Optional[float] = None, **params):
+        """Потоковый ответ: повторяется только установка потока, обрыв посередине - ошибка"""
+        return await self._with_retries({**params, "stream": True}, deadline, hedge=False)
+
+    async def _with_retries(self, params: dict, deadline: Optional[float], hedge: bool):
+        deadline = deadline or time.monotonic() + LLM_DEADLINE_SECONDS
+        self.counters["requests"] += 1
+        attempt = 0
+        while True:
+            probe = False
+            try:
+                probe = self.breaker.before_call()
+                if hedge and self.hedge_after > 0:
+                    response = await self._hedged(params, deadline)
+                else:
+                    response = await self._attempt(params, deadline)
+            except Exception as exc:
+                error = classify_error(exc)
+                if not isinstance(error, CircuitOpenError):
+                    self.breaker.record_failure(error)
+                self.counters["errors"] += 1
+                self.errors[type(error).__name__] = self.errors.get(type(error).__name__, 0) + 1
+                LLM_ERRORS.inc(type=type(error).__name__)
+                if not error.retryable or attempt >= self.retries:
+                    raise error from exc
+                delay = error.retry_after
+                if delay is None:
+                    backoff = min(LLM_BACKOFF_MAX_SECONDS, LLM_BACKOFF_BASE_SECONDS * 2 ** attempt)
+                    delay = backoff * random.uniform(0.5, 1.5)
+                if time.monotonic() + delay >= deadline:
+                    raise error from exc
+                attempt += 1
+                self.counters["retries"] += 1
+                print(f"🔁 {type(error).__name__}, повтор {attempt}/{self.retries} через {delay:.1f} с")
+                await asyncio.sleep(delay)
+            except BaseException:
+                # CancelledError (клиент отключился, проиграл хедж) - не Exception;
+                # без этого пробный запрос навсегда оставил бы breaker полуоткрытым
+                if probe:
+                    self.breaker.cancel_trial()
+                raise
+            else:
+                self.breaker.record_success()
+                return response
+
+    async def _attempt(self, params: dict, deadline: float):
+        await self._bucket.acquire(deadline)
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise DeadlineExceededError("Дедлайн запроса к LLM истек")
+        async with self._semaphore:
+            self.counters["attempts"] += 1
+            self.in_flight += 1
+            try:
+                # Для потока - время до заголовков ответа, а не до последнего токена
+                with span("llm_wait"):
+                    return await self.client.chat.completions.create(
+                        **params, timeout=min(self.timeout, remaining)
+                    )
+            finally:
+                self.in_flight -= 1
+
+    async def _hedged(self, params: dict, deadline: float):
+        """Второй такой же запрос, если первый не ответил за hedge_after; побеждает первый ответ"""
+        primary = asyncio.create_task(self._attempt(params, deadline))
+        done, _ = await asyncio.wait({primary}, timeout=self.hedge_after)
+        if done:
+            return primary.result()
+        self.counters["hedges"] += 1
+        backup = asyncio.create_task(self._attempt(params, deadline))
+        pending = {primary, backup}
+        error = None
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is backup:
+                            self.counters["hedge_wins"] += 1
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
@@ -0,0 +1,183 @@
+"""
+Разбор и валидация ответов LLM.
+
+Ответ на чанк выписки приходит потоком; JsonArrayStream за один проход по
+тексту выдает элементы массива "transactions" по мере того, как они
+закрываются. Если ответ обрезан (finish_reason == "length"), остаются все
+элементы до последнего целого - без повторных проходов и "починки" строки.
+Структура проверяется скомпилированными моделями Pydantic.
+"""
+
+import json
+from typing import Any, Dict, List, Optional
+
+from pydantic import BaseModel, ConfigDict, ValidationError, field_validator
+
+from categories import CATEGORY_KEYS, match_category
+from kaspi_parser import Transaction
+
+
+class JsonArrayStream:
+    """Инкрементальный парсер: элементы-объекты массива key верхнего уровня по мере поступления текста"""
+
+    def __init__(self, key: str = "transactions"):
+        self.key = key
+        self.started = False  # встретили первую "{" (markdown и текст до нее пропускаются)
+        self.found = False  # нашли массив key
+        self.complete = False  # массив закрыт - ответ не обрезан
+        self.skipped = 0  # элементы, которые не удалось разобрать
+        self._text = ""
+        self._pos = 0
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._string_start = 0
+        self._last_string: Optional[str] = None
+        self._key: Optional[str] = None
+        self._array_depth = 0
+        self._element_start = -1
+
+    def feed(self, text: str) -> List[Any]:
+        """Добавляет кусок ответа и возвращает элементы, закрывшиеся в нем"""
+        self._text += text
+        buf = self._text
+        items = []
+        i = self._pos
+        while i < len(buf):
+            ch = buf[i]
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+                    if self._depth == 1:
+                        self._last_string = buf[self._string_start + 1:i]
+            elif not self.started:
+                if ch == "{":
+                    self.started = True
+                    self._depth = 1
+            elif ch == '"':
+                self._in_string = True
+                self._string_start = i
+            elif ch == ":" and self._depth == 1:
+                self._key = self._last_string
+            elif ch == "{" or ch == "[":
+                self._depth += 1
+                if ch == "[" and self._depth == 2 and self._key == self.key and not self.found:
+                    self.found = True
+                    self._array_depth = 2
+                elif ch == "{" and self._array_depth and self._depth == self._array_depth + 1:
+                    self._element_start = i
+            elif ch == "}" or ch == "]":
+                if self._array_depth and self._depth == self._array_depth + 1 and self._element_start >= 0:
+                    try:
+                        items.append(json.loads(buf[self._element_start:i + 1]))
+                    except json.JSONDecodeError:
+                        self.skipped += 1
+                    self._element_start = -1
+                elif self._array_depth and self._depth == self._array_depth:
+                    self._array_depth = 0
+                    self.complete = True
+                self._depth -= 1
+            i += 1
+        self._pos = i
+        # Уже разобранный текст до начала незакрытого элемента больше не нужен
+        if self._element_start > 0:
+            self._text = buf[self._element_start:]
+            self._pos -= self._element_start
+            self._string_start -= self._element_start
+            self._element_start = 0
+        elif self._element_start < 0 and self._array_depth and not self._in_string:
+            self._text = ""
+            self._pos = 0
+        return items
+
+
+def parse_object(text: str) -> dict:
+    """Первый JSON-объект в тексте (markdown вокруг него игнорируется) или {}"""
+    start = text.find("{")
+    if start == -1:
+        return {}
+    try:
+        result, _ = json.JSONDecoder().raw_decode(text, start)
+    except json.JSONDecodeError as e:
+        print(f"JSON Parse Error: {e}")
+        return {}
+    return result if isinstance(result, dict) else {}
+
+
+# --- Схемы ответов ---
+
+class LlmTransaction(BaseModel):
+    date: str = ""
+    amount: float
+    description: str = ""
+    category: Optional[str] = None
+
+    @field_validator("date", "description", mode="before")
+    @classmethod
+    def _to_str(cls, value):
+        return str(value or "").strip()
+
+    @field_validator("amount")
+    @classmethod
+    def _positive(cls, value):
+        return abs(value)
+
+    @field_validator("category", mode="before")
+    @classmethod
+    def _known_category(cls, value):
+        return value if value in CATEGORY_KEYS else None
+
+    def to_transaction(self) -> Transaction:
+        # Локальные правила важнее категории от LLM
+        return Transaction(
+            date=self.date,
+            amount=self.amount,
+            description=self.description,
+            category=match_category(self.description) or self.category,
+        )
+
+
+class SummaryAnswer(BaseModel):
+    categories: Dict[str, str] = {}
+    advice: str = ""
+
+    @field_validator("categories", mode="before")
+    @classmethod
+    def _only_strings(cls, value):
+        if not isinstance(value, dict):
+            return {}
+        return {str(k): v for k, v in value.items() if isinstance(v, str)}
+
+    @field_validator("advice", mode="before")
+    @classmethod
+    def _advice_str(cls, value):
+        return str(value or "")
+
+
+class AnalysisResult(BaseModel):
+    """Минимальные требования к ответу /analyze; остальные поля проходят как есть"""
+    model_config = ConfigDict(extra="allow")
+
+    total_spent: float
+    categories: List[dict]
+    transactions: List[dict]
+
+
+def transaction_from_item(item) -> Optional[Transaction]:
+    """Транзакция из элемента ответа LLM; мусорные элементы отбрасываются"""
+    try:
+        return LlmTransaction.model_validate(item).to_transaction()
+    except ValidationError:
+        return None
+
+
+def parse_summary(text: str) -> SummaryAnswer:
+    try:
+        return SummaryAnswer.model_validate(parse_object(text))
+    except ValidationError as e:
+        print(f"⚠️ Сводный ответ LLM не прошел валидацию: {e.error_count()} ошибок")
+        return SummaryAnswer()
@@ -1,14 +1,67 @@
-import io
+import asyncio
 import json
+import math
 import os
-import re
+import time
+import uuid
+from contextlib import ExitStack, asynccontextmanager
+from collections import defaultdict
+from typing import List
 
-import pdfplumber
-from fastapi import FastAPI, File, UploadFile
+from fastapi import FastAPI, File, HTTPException, Request, UploadFile
+from fastapi.responses import PlainTextResponse, StreamingResponse
 from openai import OpenAI
-from pydantic import BaseModel
+from pydantic import BaseModel, ValidationError
 
-app = FastAPI()
+from analytics import StatementIndex, answer_question
+from categories import CATEGORY_KEYS, build_categories, normalize_language
+from classifier import load_classifier
+from context_store import ContextStore, render_context
+from encoding import CompressionMiddleware, dumps_str, encode_result
+from forecast import forecast_transactions
+from history import HISTORY_ID_RE, HistoryStore, transactions_from_result
+from jobs import JobManager, QueueFullError
+from merchant_memo import LLM_CONFIDENCE, RECURRING_CONFIDENCE, MerchantMemo
+from llm_gateway import LLM_DEADLINE_SECONDS, LLMError, LLMGateway, classify_error, describe_error
+from kaspi_parser import (
+    ParsedStatement,
+    build_result,
+    parse_statement,
+    split_statement,
+)
+from metrics import (
+    CACHE_REQUESTS,
+    CHAT_ANSWERS,
+    HTTP_SECONDS,
+    LLM_TRUNCATIONS,
+    MOCK_FALLBACKS,
+    STAGE_SECONDS,
+    UPLOADS_REJECTED,
+    render as render_metrics,
+    span,
+)
+from llm_output import (
+    AnalysisResult,
+    JsonArrayStream,
+    SummaryAnswer,
+    parse_summary,
+    transaction_from_item,
+)
+from pdf_extract import PdfExtractor, count_pages
+from prompts import (
+    CHAT_DATA_HEADERS,
+    CHAT_GOAL_TEMPLATES,
+    CHAT_SYSTEM_PROMPTS,
+    CHUNK_SYSTEM_PROMPT,
+    PROMPT_VERSIONS,
+    SUMMARY_SYSTEM_PROMPTS,
+    prompt_usage,
+    record_usage,
+)
+from recurring import mark_recurring, to_days
+from result_cache import ResultCache, digest_key, make_key
+from singleflight import SingleFlight
+from uploads import BudgetExceededError, UploadBudget, UploadTooLargeError, spool_upload
 
 # --- API КЛЮЧ (DeepSeek) ---
 DEEPSEEK_API_KEY = os.getenv("DEEPSEEK_API_KEY")
@@ -23,15 +76,81 @@ if not DEEPSEEK_API_KEY:
     else:
         DEEPSEEK_API_KEY = LOCAL_KEY
 
-BASE_URL = "https://api.deepseek.com/v1"
+BASE_URL = os.getenv("DEEPSEEK_BASE_URL", "https://api.deepseek.com/v1")
 
-client = OpenAI(api_key=DEEPSEEK_API_KEY, base_url=BASE_URL)
+# --- Шлюз к LLM ---
+# Один на процесс: пул keep-alive соединений, ограничение под квоту DeepSeek,
+# повторы с дедлайном и circuit breaker (см. llm_gateway.py).
+llm = LLMGateway(DEEPSEEK_API_KEY, BASE_URL)
+
+# --- Пул для разбора PDF ---
+# pdfplumber синхронный и нагружает CPU, поэтому страницы разбираются
+# в пуле процессов (размер задается PDF_WORKERS), а не в event loop.
+pdf_extractor = PdfExtractor()
+
+# --- Локальный классификатор расходов (models/expense_classifier.json) ---
+expense_classifier = load_classifier()
+
+# --- Справочник мерчант -> категория: известные мерчанты не доходят до классификатора и LLM ---
+merchant_memo = MerchantMemo()
+
+# --- Кэш результатов /analyze ---
+result_cache = ResultCache()
+
+# --- Контекст для /chat: /analyze отдает context_id, чат присылает только его ---
+context_store = ContextStore()
+
+# --- Загрузки: лимит размера и допуск по суммарному объему PDF в разборе (uploads.py) ---
+upload_budget = UploadBudget()
+
+# --- Одинаковые одновременные запросы (двойной тап, повтор клиента) выполняются один раз ---
+analysis_flight = SingleFlight("analyze")
+chat_flight = SingleFlight("chat")
+
+# --- История транзакций между выписками: только с HISTORY_DB и history_id от клиента (history.py) ---
+history_store = HistoryStore()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await asyncio.to_thread(result_cache.purge_expired)
+    await asyncio.to_thread(merchant_memo.purge_expired)
+    await job_manager.start()
+    yield
+    await job_manager.stop()
+    result_cache.close()
+    context_store.close()
+    merchant_memo.close()
+    history_store.close()
+    await llm.close()
+    pdf_extractor.shutdown()
+
+
+app = FastAPI(lifespan=lifespan)
+# Ответы /analyze на длинные выписки - сотни КБ JSON, мобильная сеть скажет спасибо
+app.add_middleware(CompressionMiddleware)
+
+@app.middleware("http")
+async def observe_latency(request: Request, call_next):
+    # Для SSE это время до начала потока, полная длительность видна в стадиях
+    started = time.perf_counter()
+    response = await call_next(request)
+    route = request.scope.get("route")
+    HTTP_SECONDS.observe(
+        time.perf_counter() - started,
+        method=request.method,
+        path=route.path if route is not None else "unmatched",  # не плодим метки на каждый 404
+        status=response.status_code,
+    )
+    return response
 
 # Функция для проверки API ключа
 def check_api_key():
     """Проверяет валидность API ключа, делая тестовый запрос"""
     try:
-        test_response = client.chat.completions.create(
+        # Отдельный синхронный клиент: проверка идет до старта event loop сервера
+        sync_client = OpenAI(api_key=DEEPSEEK_API_KEY, base_url=BASE_URL)
+        test_response = sync_client.chat.completions.create(
             model="deepseek-chat",  # Модель DeepSeek
             messages=[{"role": "user", "content": "test"}],
             max_tokens=5
@@ -39,15 +158,7 @@ def check_api_key():
         print("✅ DeepSeek API ключ валиден")
         return True
     except Exception as e:
-        error_msg = str(e).lower()
-        if "rate limit" in error_msg or "quota" in error_msg:
-            print("⚠️ ВНИМАНИЕ: Закончились лимиты API!")
-            print("Проверьте баланс на https://platform.deepseek.com/")
-        elif "unauthorized" in error_msg or "401" in error_msg or "403" in error_msg:
-            print("❌ ОШИБКА: Неверный API ключ!")
-            print("Проверьте DEEPSEEK_API_KEY в переменных окружения или local_secrets.py")
-        else:
-            print(f"⚠️ Не удалось проверить API ключ: {e}")
+        print(f"⚠️ Не удалось проверить API ключ: {describe_error(classify_error(e))}")
         return False
 
 MOCK_AMIR_DATA = {
@@ -76,495 +187,816 @@ MOCK_AMIR_DATA = {
   ]
 }
 
-def analyze_kaspi_statement(text, language="ru"):
-    # Определяем язык для категорий
-    lang_map = {
-        "ru": {
-            "products": "Продукты",
-            "taxi": "Такси",
-            "entertainment": "Развлечения",
-            "fastfood": "Фастфуд",
-            "credit": "Рассрочка",
-            "other": "Прочее"
-        },
-        "kz": {
-            "products": "Тауарлар",
-            "taxi": "Такси",
-            "entertainment": "Ойын-сауық",
-            "fastfood": "Жылдам тағам",
-            "credit": "Бөліп төлеу",
-            "other": "Басқа"
-        },
-        "en": {
-            "products": "Products",
-            "taxi": "Taxi",
-            "entertainment": "Entertainment",
-            "fastfood": "Fast Food",
-            "credit": "Credit",
-            "other": "Other"
-        }
-    }
-    
-    lang_names = lang_map.get(language, lang_map["ru"])
-    
-    system_prompt = f"""
-    Ты — опытный финансовый аналитик с глубоким пониманием банковских выписок. Твоя задача - ТОЧНО и ДЕТАЛЬНО распарсить выписку Kaspi Gold.
-    
-    ВНИМАНИЕ: Будь очень внимательным и точным. Проверяй каждую транзакцию дважды.
-    
-    ОСОБЕННОСТИ ФОРМАТА KASPI:
-    1. Суммы: "1 500.00 - T" (минус справа) или "- 1 500 T" - это РАСХОДЫ.
-    2. Пополнения (Replenishment, пополнение счета) - ИГНОРИРУЙ их полностью.
-    3. Все суммы расходов должны быть ПОЛОЖИТЕЛЬНЫМИ числами в JSON.
-    
-    🛑 ЖЕЛЕЗНЫЕ ПРАВИЛА (Strict Rules) - СЛЕДУЙ ИМ СТРОГО:
-    
-    1. 💳 ПОДПИСКИ (ТОЛЬКО цифровые сервисы, НЕ кредиты/рассрочки):
-       - Включай сюда ТОЛЬКО: "Yandex Plus", "Spotify", "Netflix", "Apple", "Ivi", "Kinopoisk", "Google Storage", "YouTube Premium".
-       - ⛔ СТРОГО ЗАПРЕЩЕНО включать сюда: "Kaspi Red", "Kaspi Magazin", "Credit", "Рассрочка", "Погашение кредита", "TOO Kaspi Magazin". Это НЕ подписки, это кредиты/рассрочки!
-       - Если видишь Kaspi Magazin или Kaspi Red - это НЕ подписка, это кредит/рассрочка!
-       
-    2. ⏳ РАССРОЧКА/КРЕДИТЫ (Отдельная категория в categories, НЕ в subscriptions!):
-       - Если видишь: "Kaspi Red", "Pay for Kaspi Red", "Kaspi Magazin", "TOO Kaspi Magazin", "Погашение кредита", "Credit".
-       - Создай для них отдельную категорию "{lang_names['credit']}" в списке categories.
-       - Цвет для этой категории: "FF5722" (Оранжевый/Красный).
-       - НИКОГДА не добавляй их в subscriptions!
-       
-    3. 🚕 ТРАНСПОРТ: 
-       - "Yandex Go" (именно Go!), "Uber", "Onay", "InDrive".
-       - Название категории: "{lang_names['taxi']} (Yandex)"
-       
-    4. 🛍 ПРОДУКТЫ/ЕДА:
-       - "Magnum", "Small", "Galmart", "Glovo", "Wolt", "Burger", "Bahandi".
-       - Название категории: "{lang_names['products']} (Magnum)" или "{lang_names['products']}"
-       
-    5. 🎬 РАЗВЛЕЧЕНИЯ:
-       - "Steam", "Kino", "Cinema", "Games"
-       - Название категории: "{lang_names['entertainment']} (Steam/Kino)"
-       
-    6. 🍔 ФАСТФУД:
-       - "Bahandi", "Tandyr", "Burger", "Pizza"
-       - Название категории: "{lang_names['fastfood']} (Тандыр/Bahandi)"
-
-    ЗАДАЧА:
-    Внимательно проанализируй ВСЕ транзакции в выписке. Для каждой транзакции:
-    1. Определи точную сумму (убери пробелы, конвертируй в число)
-    2. Определи правильную категорию по описанию
-    3. Извлеки дату в формате DD.MM.YYYY
-    4. Создай краткое описание транзакции
-    
-    ВАЖНО для категорий:
-    - Суммируй ВСЕ транзакции по каждой категории
-    - Вычисли проценты от общей суммы (total_spent)
-    - Используй правильные цвета для каждой категории
-    
-    В поле `categories` должна появиться категория "{lang_names['credit']}", если есть соответствующие траты.
-    В поле `subscriptions` НЕ ДОЛЖНО быть Каспи магазина, Kaspi Red, кредитов или рассрочек - ТОЛЬКО цифровые подписки!
-    
-    Структура JSON (ОБЯЗАТЕЛЬНО СЛЕДУЙ ЭТОЙ СТРУКТУРЕ):
-    {{
-      "total_spent": float,
-      "forecast_next_month": float,
-      "categories": [{{"name": "string", "name_ru": "string", "name_kz": "string", "name_en": "string", "amount": float, "percent": float, "color": "hex"}}],
-      "subscriptions": [{{"name": "string", "cost": float}}],
-      "advice": "Совет",
-      "transactions": [
-        {{
-          "date": "DD.MM.YYYY",
-          "amount": float,
-          "description": "string",
-          "category": "string"
-        }}
-      ]
-    }}
-    
-    ВАЖНО:
-    - Каждая категория должна иметь поля name, name_ru, name_kz, name_en для мультиязычности
-    - name - это название на текущем языке ({language})
-    - В поле subscriptions ТОЛЬКО цифровые подписки (Spotify, Netflix и т.д.), НЕ Kaspi Magazin!
-    - Извлекай ВСЕ транзакции из выписки (расходы, не пополнения)
-    - Формат даты: DD.MM.YYYY (например, "15.03.2024")
-    - amount должен быть положительным числом (сумма расхода)
-    - description - краткое описание транзакции (например, "Magnum", "Yandex Go", "Spotify Premium")
-    - category - категория из списка categories (используй name на текущем языке)
-    - total_spent - сумма ВСЕХ расходов (не пополнений!)
-    - forecast_next_month - примерная оценка расходов на следующий месяц на основе текущих данных
-    
-    КРИТИЧЕСКИ ВАЖНО ДЛЯ JSON:
-    - Верни ТОЛЬКО валидный JSON, без дополнительного текста до или после
-    - Все строки в JSON должны быть экранированы двойными кавычками
-    - Не используй одинарные кавычки для строк
-    - Экранируй специальные символы в строках (\\n, \\", \\\\)
-    - Не добавляй комментарии в JSON
-    - Убедись, что все скобки закрыты правильно
-    - Проверь, что все числа - это числа, а не строки
-    - Убедись, что total_spent = сумма всех amount в categories
-    
-    ПРИМЕР ПРАВИЛЬНОГО JSON:
-    {{
-      "total_spent": 100165.0,
-      "forecast_next_month": 115000.0,
-      "categories": [
-        {{"name": "Продукты (Magnum)", "name_ru": "Продукты (Magnum)", "name_kz": "Тауарлар (Magnum)", "name_en": "Products (Magnum)", "amount": 45000.0, "percent": 45.0, "color": "4CAF50"}},
-        {{"name": "Такси (Yandex)", "name_ru": "Такси (Yandex)", "name_kz": "Такси (Yandex)", "name_en": "Taxi (Yandex)", "amount": 12500.0, "percent": 12.0, "color": "FFC107"}}
-      ],
-      "subscriptions": [{{"name": "Spotify Premium", "cost": 4282.0}}],
-      "advice": "Совет по финансам",
-      "transactions": [
-        {{"date": "01.03.2024", "amount": 1500.0, "description": "Magnum", "category": "Продукты (Magnum)"}}
-      ]
-    }}
-    """
+# Если парсер разобрал меньшую долю строк-транзакций, выписка уходит в LLM целиком
+KASPI_PARSER_MIN_COVERAGE = float(os.getenv("KASPI_PARSER_MIN_COVERAGE", "0.9"))
+
+# Выписка режется на чанки по границам транзакций, чанки уходят в LLM параллельно
+LLM_CHUNK_CHARS = int(os.getenv("LLM_CHUNK_CHARS", "4000"))
+LLM_CHUNK_CONCURRENCY = int(os.getenv("LLM_CHUNK_CONCURRENCY", "8"))
 
+# Входит в ключ кэша результатов: версии промптов анализа из prompts.PROMPT_VERSIONS
+ANALYZE_PROMPT_VERSION = "/".join(PROMPT_VERSIONS[name] for name in ("analyze_chunk", "analyze_summary"))
+
+async def extract_chunk_transactions(chunk, semaphore, deadline=None):
+    """Map: извлекает транзакции из одного чанка выписки"""
     try:
-        try:
-            response = client.chat.completions.create(
-                model="deepseek-chat",  # Модель DeepSeek
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": f"Текст выписки:\n{text[:5000]}"}
-                ],
-                temperature=0.1,
-                max_tokens=4000  # Увеличиваем лимит токенов для больших выписок
-            )
-        except Exception as api_err:
-            error_msg = str(api_err)
-            print(f"API Error: {error_msg}")
-            
-            # Проверяем на ошибки лимитов
-            if "rate limit" in error_msg.lower() or "quota" in error_msg.lower() or "limit" in error_msg.lower():
-                print("⚠️ ВНИМАНИЕ: Похоже, закончились лимиты API!")
-                print("Проверьте баланс и лимиты на https://platform.deepseek.com/")
-                return None
-            
-            # Проверяем на ошибки авторизации
-            if "unauthorized" in error_msg.lower() or "401" in error_msg or "403" in error_msg:
-                print("⚠️ ОШИБКА: Проблема с API ключом!")
-                print("Проверьте DEEPSEEK_API_KEY в переменных окружения или local_secrets.py")
+        async with semaphore:
+            try:
+                response = await llm.stream(
+                    deadline=deadline,
+                    model="deepseek-chat",  # Модель DeepSeek
+                    messages=[
+                        {"role": "system", "content": CHUNK_SYSTEM_PROMPT},
+                        {"role": "user", "content": f"Текст выписки:\n{chunk}"}
+                    ],
+                    temperature=0.1,
+                    max_tokens=4000,
+                    response_format={"type": "json_object"},
+                    stream_options={"include_usage": True}
+                )
+            except LLMError as api_err:
+                print(f"API Error: {describe_error(api_err)}")
                 return None
-            
-            # Другие ошибки API
-            print(f"Неизвестная ошибка API: {api_err}")
-            import traceback
-            traceback.print_exc()
-            return None
-        
-        # Получаем ответ от AI
-        if not response or not response.choices or len(response.choices) == 0:
-            print("⚠️ API вернул пустой ответ!")
-            return None
-        
-        # Логируем информацию об использовании токенов
-        if hasattr(response, 'usage'):
-            usage = response.usage
-            print(f"📊 Использование токенов: prompt={usage.prompt_tokens}, completion={usage.completion_tokens}, total={usage.total_tokens}")
-        
-        raw_content = response.choices[0].message.content
-        
-        if not raw_content:
+
+            # Транзакции разбираются по мере прихода токенов, за один проход
+            parser = JsonArrayStream("transactions")
+            transactions = []
+            finish_reason = None
+            received = 0
+            parse_seconds = validate_seconds = 0.0
+            try:
+                async for part in response:
+                    if part.usage is not None:
+                        record_usage("analyze_chunk", part)
+                        usage = part.usage
+                        cached = getattr(usage, "prompt_cache_hit_tokens", None)
+                        print(f"📊 Использование токенов: prompt={usage.prompt_tokens} (из кэша {cached}), completion={usage.completion_tokens}, total={usage.total_tokens}")
+                    if not part.choices:
+                        continue
+                    finish_reason = part.choices[0].finish_reason or finish_reason
+                    delta = part.choices[0].delta.content
+                    if delta:
+                        received += len(delta)
+                        started = time.perf_counter()
+                        items = parser.feed(delta)
+                        parsed = time.perf_counter()
+                        for item in items:
+                            txn = transaction_from_item(item)
+                            if txn is not None:
+                                transactions.append(txn)
+                        parse_seconds += parsed - started
+                        validate_seconds += time.perf_counter() - parsed
+            finally:
+                await response.close()
+                # Разбор размазан по потоку - пишем сумму за чанк, а не каждый кусок
+                STAGE_SECONDS.observe(parse_seconds, stage="json_parse")
+                STAGE_SECONDS.observe(validate_seconds, stage="validation")
+
+        if not received:
             print("⚠️ API вернул пустое содержимое!")
             return None
-        
-        print(f"✅ Получен ответ от API (длина: {len(raw_content)} символов)")
-        
-        # Проверяем, не был ли ответ обрезан (если finish_reason == "length")
-        if hasattr(response.choices[0], 'finish_reason'):
-            finish_reason = response.choices[0].finish_reason
-            if finish_reason == "length":
-                print("⚠️ ВНИМАНИЕ: Ответ был обрезан из-за лимита токенов! Увеличьте max_tokens.")
-            elif finish_reason == "stop":
-                print("✅ Ответ завершен нормально")
-            else:
-                print(f"ℹ️ Finish reason: {finish_reason}")
-        
-        # Очищаем JSON от markdown и лишних символов
-        clean_json = raw_content.strip()
-        # Убираем markdown блоки
-        if "```json" in clean_json:
-            clean_json = clean_json.split("```json")[1].split("```")[0].strip()
-        elif "```" in clean_json:
-            clean_json = clean_json.split("```")[1].split("```")[0].strip()
-        
-        # Убираем возможные префиксы/суффиксы
-        if clean_json.startswith("json"):
-            clean_json = clean_json[4:].strip()
-        if clean_json.startswith("JSON"):
-            clean_json = clean_json[4:].strip()
-        
-        # Пытаемся найти JSON объект в тексте
-        start_idx = clean_json.find("{")
-        end_idx = clean_json.rfind("}")
-        if start_idx != -1 and end_idx != -1 and end_idx > start_idx:
-            clean_json = clean_json[start_idx:end_idx + 1]
-        
-        # Парсим JSON
-        try:
-            result = json.loads(clean_json)
-        except json.JSONDecodeError as json_err:
-            print(f"JSON Parse Error: {json_err}")
-            print(f"Error position: line {json_err.lineno}, column {json_err.colno}")
-            print(f"Cleaned JSON (first 1000 chars): {clean_json[:1000]}")
-            
-            # Пытаемся исправить распространенные ошибки
-            # 1. Убираем неэкранированные переносы строк в строках (но не в значениях)
-            # 2. Исправляем незакрытые строки
-            try:
-                # Заменяем неэкранированные переносы в строках
-                fixed_json = re.sub(r'(?<!\\)\n(?![\\"])', '\\n', clean_json)
-                # Убираем переносы строк между ключами и значениями
-                fixed_json = re.sub(r':\s*\n\s*', ': ', fixed_json)
-                # Убираем переносы строк после запятых
-                fixed_json = re.sub(r',\s*\n\s*', ', ', fixed_json)
-                
-                result = json.loads(fixed_json)
-                print("Successfully fixed JSON!")
-            except Exception as fix_err:
-                print(f"Failed to fix JSON: {fix_err}")
-                # Последняя попытка - найти JSON объект более агрессивно
-                try:
-                    # Ищем первый { и последний }
-                    start = clean_json.find('{')
-                    end = clean_json.rfind('}')
-                    if start != -1 and end != -1:
-                        json_str = clean_json[start:end+1]
-                        result = json.loads(json_str)
-                        print("Successfully extracted JSON object!")
-                    else:
-                        return None
-                except:
-                    print("All JSON parsing attempts failed, trying to fix truncated JSON...")
-                    # Попытка исправить обрезанный JSON
-                    try:
-                        fixed_json = clean_json
-                        
-                        # Исправляем незакрытые строки в color (например, "color": "FF9 -> "color": "FF9E9E9E")
-                        # Ищем паттерн "color": "XXXX где XXXX - неполный hex код
-                        def fix_color(match):
-                            color_value = match.group(1)
-                            # Если цвет неполный (меньше 6 символов), дополняем до 6 символов серым цветом
-                            if len(color_value) < 6:
-                                color_value = color_value.ljust(6, 'E')
-                            return f'"color": "{color_value}"'
-                        
-                        fixed_json = re.sub(r'"color":\s*"([^"]*?)(?:"|$)', fix_color, fixed_json)
-                        
-                        # Закрываем незакрытые строки в конце (если нечетное количество кавычек)
-                        quote_count = fixed_json.count('"')
-                        if quote_count % 2 != 0:
-                            # Находим последнюю незакрытую строку и закрываем её
-                            last_quote_idx = fixed_json.rfind('"')
-                            # Если после последней кавычки нет закрывающей, добавляем
-                            if last_quote_idx < len(fixed_json) - 1:
-                                # Проверяем, что это начало строки, а не конец
-                                after_quote = fixed_json[last_quote_idx + 1:]
-                                if not after_quote.strip().startswith((':', ',', '}', ']')):
-                                    fixed_json = fixed_json[:last_quote_idx + 1] + '"' + fixed_json[last_quote_idx + 1:]
-                        
-                        # Закрываем незакрытые объекты и массивы
-                        open_braces = fixed_json.count('{')
-                        close_braces = fixed_json.count('}')
-                        open_brackets = fixed_json.count('[')
-                        close_brackets = fixed_json.count(']')
-                        
-                        # Добавляем недостающие закрывающие скобки
-                        if open_braces > close_braces:
-                            fixed_json += '}' * (open_braces - close_braces)
-                        if open_brackets > close_brackets:
-                            fixed_json += ']' * (open_brackets - close_brackets)
-                        
-                        # Убираем лишние запятые перед закрывающими скобками
-                        fixed_json = re.sub(r',\s*([}\]])', r'\1', fixed_json)
-                        
-                        result = json.loads(fixed_json)
-                        print("Successfully fixed truncated JSON!")
-                    except Exception as trunc_fix_err:
-                        print(f"Failed to fix truncated JSON: {trunc_fix_err}")
-                        import traceback
-                        traceback.print_exc()
-                        return None
-        
-        # Фильтруем подписки - удаляем Kaspi Magazin и кредиты
-        if "subscriptions" in result and isinstance(result["subscriptions"], list):
-            result["subscriptions"] = [
-                sub for sub in result["subscriptions"]
-                if sub.get("name", "").lower() not in ["kaspi magazin", "kaspi red", "рассрочка", "credit", "погашение кредита"]
-            ]
-        
-        return result
+
+        print(f"✅ Получен ответ от API (длина: {received} символов)")
+
+        if finish_reason == "length":
+            LLM_TRUNCATIONS.inc(prompt="analyze_chunk")
+            print("⚠️ ВНИМАНИЕ: Ответ был обрезан из-за лимита токенов! Увеличьте max_tokens.")
+        elif finish_reason == "stop":
+            print("✅ Ответ завершен нормально")
+        else:
+            print(f"ℹ️ Finish reason: {finish_reason}")
+
+        if not parser.found:
+            print("⚠️ В ответе на чанк нет списка transactions")
+            return None
+        if not parser.complete:
+            print(f"⚠️ Ответ обрезан, сохранено {len(transactions)} целых транзакций")
+        if parser.skipped:
+            print(f"⚠️ Пропущено {parser.skipped} неразборчивых элементов")
+        return transactions
     except Exception as e:
-        error_msg = str(e)
-        print(f"AI Error: {error_msg}")
-        
-        # Проверяем на ошибки API в общем обработчике
-        if "rate limit" in error_msg.lower() or "quota" in error_msg.lower():
-            print("⚠️ ВНИМАНИЕ: Похоже, закончились лимиты API!")
-            print("Проверьте баланс и лимиты на https://platform.deepseek.com/")
-        elif "unauthorized" in error_msg.lower() or "401" in error_msg or "403" in error_msg:
-            print("⚠️ ОШИБКА: Проблема с API ключом!")
-            print("Проверьте DEEPSEEK_API_KEY в переменных окружения или local_secrets.py")
-        
+        # Обрыв потока посередине ответа и прочие ошибки
+        print(f"AI Error: {describe_error(classify_error(e))}")
         import traceback
         traceback.print_exc()
         return None
 
+async def iter_llm_chunks(chunks, deadline=None):
+    """
+    Извлекает транзакции из чанков через LLM параллельно (не больше
+    LLM_CHUNK_CONCURRENCY одновременно) и отдает (номер чанка, транзакции или None)
+    по мере готовности. Если потребитель бросил генератор, остальные запросы отменяются.
+    """
+    semaphore = asyncio.Semaphore(LLM_CHUNK_CONCURRENCY)
+
+    async def run(index, chunk):
+        return index, await extract_chunk_transactions(chunk, semaphore, deadline)
+
+    tasks = [asyncio.create_task(run(i, chunk)) for i, chunk in enumerate(chunks)]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            yield await next_done
+    finally:
+        for task in tasks:
+            task.cancel()
+
+async def summarize_parsed_statement(statement, language="ru", deadline=None, history=()):
+    """
+    Reduce: транзакции уже извлечены (парсером и/или по чанкам).
+    LLM получает только нераспознанные описания и сводку для совета.
+    Прогноз на следующий месяц считается локально (forecast.py), history -
+    прошлые транзакции пользователя из history_store.past.
+    """
+    language = normalize_language(language)
+    with span("forecast"):
+        # Итог прогноза от категорий не зависит - для совета хватает его
+        forecast = forecast_transactions(statement.transactions, history)
+    with span("prompt_build"):
+        unknown = sorted({txn.description for txn in statement.uncategorized})
+        draft = build_result(statement.transactions, language, forecast=forecast)
+        summary = json.dumps({
+            "total_spent": draft["total_spent"],
+            "forecast_next_month": draft["forecast_next_month"],
+            "categories": {cat["name"]: cat["amount"] for cat in draft["categories"]},
+            "subscriptions": draft["subscriptions"],
+            "transactions_count": len(statement.transactions),
+            "unknown": unknown,
+        }, ensure_ascii=False)
+
+    answer = SummaryAnswer()
+    try:
+        response = await llm.complete(
+            deadline=deadline,
+            model="deepseek-chat",  # Модель DeepSeek
+            messages=[
+                {"role": "system", "content": SUMMARY_SYSTEM_PROMPTS[language]},
+                {"role": "user", "content": summary}
+            ],
+            temperature=0.1,
+            max_tokens=300 + 20 * len(unknown),
+            response_format={"type": "json_object"}
+        )
+        record_usage("analyze_summary", response)
+        if response.choices[0].finish_reason == "length":
+            LLM_TRUNCATIONS.inc(prompt="analyze_summary")
+        with span("validation"):
+            answer = parse_summary(response.choices[0].message.content or "")
+    except Exception as e:
+        # Транзакции и суммы уже посчитаны локально - без совета, но не мок
+        print(f"⚠️ LLM не ответил на сводный запрос: {describe_error(classify_error(e))}")
+
+    learned = []
+    for txn in statement.uncategorized:
+        key = answer.categories.get(txn.description)
+        if key in CATEGORY_KEYS:
+            learned.append((txn.description, key, LLM_CONFIDENCE, None))
+        txn.category = key if key in CATEGORY_KEYS else "other"
+    await asyncio.to_thread(merchant_memo.learn, learned)
+
+    if unknown:
+        with span("forecast"):
+            forecast = forecast_transactions(statement.transactions, history)
+    return build_result(statement.transactions, language, advice=answer.advice, forecast=forecast)
+
+def running_totals(transactions, language="ru"):
+    """Промежуточные итоги по категориям; еще не категоризированное пока считается в other"""
+    totals = defaultdict(float)
+    for txn in transactions:
+        totals[txn.category or "other"] += txn.amount
+    return {
+        "total_spent": round(sum(totals.values()), 2),
+        "transactions_count": len(transactions),
+        "categories": build_categories(totals, language),
+    }
+
+async def analyze_statement_events(pages, language="ru", deadline=None, history_id=""):
+    """
+    Анализ выписки по мере поступления страниц (async-итератор текстов).
+    Отдает пары (событие, данные):
+      progress      {"stage": "extract", "page": N} после каждой страницы,
+                    {"stage": "llm", "chunks": N}, {"stage": "summary"}
+      transactions  {"transactions": [...]} - очередная пачка разобранных транзакций
+      categories    промежуточные итоги по категориям после каждой пачки
+      reset         ранее отданные транзакции недействительны (формат не распознан, выписка ушла в LLM)
+      result        итоговый ответ /analyze или None
+    deadline (time.monotonic()) общий для всех запросов к LLM в рамках анализа.
+    С history_id транзакции, уже бывшие в истории, берут категорию оттуда
+    (в LLM уходят только новые), а новые после анализа дописываются в историю.
+    """
+    statement = ParsedStatement()
+    emitted = []
+    text_parts = []
+    page_number = 0
+    async for page in pages:
+        page_number += 1
+        text_parts.append(page)
+        with span("local_parse"):
+            parsed = parse_statement(page)
+        statement.transactions.extend(parsed.transactions)
+        statement.unparsed.extend(parsed.unparsed)
+        statement.skipped += parsed.skipped
+        yield "progress", {"stage": "extract", "page": page_number}
+        # Страницы, которые парсер разобрал уверенно, показываем сразу
+        if parsed.transactions and parsed.coverage >= KASPI_PARSER_MIN_COVERAGE:
+            emitted.extend(parsed.transactions)
+            yield "transactions", {"transactions": [txn.to_dict(language) for txn in parsed.transactions]}
+            yield "categories", running_totals(emitted, language)
+
+    text = "\n".join(text_parts)
+    print(f"--- Extracted {len(text)} chars ---")
+    # FAIL-SAFE: Если PDF не прочитался (пустой текст), результата нет - будет мок
+    if len(text) < 50:
+        yield "result", None
+        return
+
+    if statement.coverage >= KASPI_PARSER_MIN_COVERAGE:
+        print(f"⚡ Парсер Kaspi: {len(statement.transactions)} транзакций, "
+              f"покрытие {statement.coverage:.0%}, без категории {len(statement.uncategorized)}")
+        leftover = "\n".join(statement.unparsed)
+    else:
+        statement = ParsedStatement()
+        leftover = text
+        if emitted:
+            emitted = []
+            yield "reset", {}
+
+    if leftover:
+        chunks = split_statement(leftover, LLM_CHUNK_CHARS)
+        print(f"🧩 Выписка разбита на {len(chunks)} чанков для LLM")
+        yield "progress", {"stage": "llm", "chunks": len(chunks)}
+        results = [None] * len(chunks)
+        async for index, transactions in iter_llm_chunks(chunks, deadline):
+            if transactions is None:
+                # Без части чанков суммы были бы неверными - лучше честно сообщить об ошибке
+                print("⚠️ Не все чанки обработаны, анализ прерван")
+                yield "result", None
+                return
+            results[index] = transactions
+            emitted.extend(transactions)
+            yield "transactions", {"transactions": [txn.to_dict(language) for txn in transactions]}
+            yield "categories", running_totals(emitted, language)
+        statement.transactions.extend(txn for result in results for txn in result)
+
+    if not statement.transactions:
+        yield "result", None
+        return
+
+    if history_id and statement.uncategorized:
+        delta = await asyncio.to_thread(history_store.apply_known, history_id, statement.transactions)
+        print(f"🗂 История: {delta['known']} транзакций уже известны, новых {delta['new']}, "
+              f"категория по прошлым описаниям у {delta['memo']}")
+
+    # Что правила не распознали: справочник мерчантов, затем локальная модель, остаток - в LLM.
+    # Справочник с MERCHANT_MEMO_DB читает и пишет SQLite, поэтому зовем его из потока
+    if statement.uncategorized:
+        resolved = await asyncio.to_thread(merchant_memo.apply, statement.transactions)
+        CACHE_REQUESTS.inc(resolved, cache="merchant", result="hit")
+        CACHE_REQUESTS.inc(len(statement.uncategorized), cache="merchant", result="miss")
+        print(f"📒 Справочник мерчантов: {resolved} транзакций категоризировано без модели")
+
+    # Подписки и рассрочки - по регулярности списаний, а не догадкой LLM
+    with span("recurring"):
+        past = await asyncio.to_thread(history_store.past, history_id, statement.transactions) if history_id else []
+        subscriptions, installments = mark_recurring(statement.transactions, past)
+    if subscriptions or installments:
+        await asyncio.to_thread(merchant_memo.learn, [
+            (txn.description, txn.category, RECURRING_CONFIDENCE, txn.subscription)
+            for txn in subscriptions + installments
+            # В справочник - только мерчанты: переводы и снятия привязаны к конкретному человеку
+            if txn.operation == "purchase"
+        ])
+        print(f"🔁 Регулярные списания: подписок {len(subscriptions)}, платежей по рассрочке {len(installments)}")
+
+    if expense_classifier is not None and statement.uncategorized:
+        observed = []
+        classified = expense_classifier.categorize(
+            statement.transactions,
+            observe=lambda txn, score: observed.append((txn.description, txn.category, score, None)),
+        )
+        await asyncio.to_thread(merchant_memo.learn, observed)
+        print(f"🧠 Классификатор: {classified} транзакций категоризировано без LLM")
+
+    yield "progress", {"stage": "summary"}
+    result = await summarize_parsed_statement(statement, language, deadline, past)
+    if history_id:
+        await asyncio.to_thread(history_store.add, history_id, statement.transactions)
+    yield "result", result
+
+async def analyze_kaspi_statement(text, language="ru"):
+    """
+    Полный анализ выписки: детерминированный парсер, LLM для строк, которые он
+    не разобрал (или для всей выписки, если формат не распознан), и сводный
+    запрос за советом. Итоги по категориям считаются в Python.
+    """
+    async def single_page():
+        yield text
+
+    async for event, data in analyze_statement_events(single_page(), language):
+        if event == "result":
+            return data
+
+@app.get("/health")
+async def health():
+    return {
+        "status": "ok",
+        "pdf": pdf_extractor.stats.snapshot(),
+        "result_cache": result_cache.stats(),
+        "merchant_memo": merchant_memo.stats(),
+        "context_store": context_store.stats(),
+        "prompts": prompt_usage.snapshot(),
+        "llm": llm.snapshot(),
+        "uploads": upload_budget.stats(),
+        "history": history_store.stats(),
+        "single_flight": {"analyze": analysis_flight.stats(), "chat": chat_flight.stats()},
+        "jobs": await job_manager.stats(),
+    }
+
+@app.get("/metrics")
+async def metrics():
+    """Счетчики и гистограммы в текстовом формате Prometheus"""
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+def analysis_cache_key(upload, language, history_id=""):
+    """
+    С history_id категории, подписки и прогноз зависят от истории пользователя:
+    такой результат кэшируется отдельно и не достается загрузке без истории
+    или с чужой историей. Этот же ключ объединяет одновременные анализы.
+    """
+    parts = (normalize_language(language), ANALYZE_PROMPT_VERSION)
+    return digest_key(upload.digest, *parts, *((history_id,) if history_id else ()))
+
+async def receive_upload(file):
+    """Загрузка -> временный PDF на диске (см. uploads.py); слишком большой файл - 413"""
+    try:
+        with span("upload_read"):
+            return await spool_upload(file)
+    except UploadTooLargeError as e:
+        UPLOADS_REJECTED.inc(reason="too_large")
+        raise HTTPException(status_code=413, detail=str(e))
+
+def busy_error(e):
+    UPLOADS_REJECTED.inc(reason="budget")
+    return HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(int(e.retry_after))})
+
+def check_history_id(history_id):
+    """history_id - непрозрачный id от клиента; без HISTORY_DB на сервере история просто не ведется"""
+    if history_id and not HISTORY_ID_RE.fullmatch(history_id):
+        raise HTTPException(status_code=400, detail="Некорректный history_id")
+    return history_id if history_store.enabled else ""
+
+async def history_summary(history_id, language):
+    """Итоги истории по месяцам; HistoryStore ходит в SQLite, поэтому читаем в потоке"""
+    if not history_id:
+        return None
+    return await asyncio.to_thread(history_store.summary, history_id, normalize_language(language))
+
 @app.post("/analyze")
-async def analyze_statement(file: UploadFile = File(...), language: str = "ru"):
-    full_text = ""
+async def analyze_statement(
+    http_request: Request, file: UploadFile = File(...), language: str = "ru", history_id: str = ""
+):
+    """Формат ответа - по Accept: JSON, колоночный JSON или MessagePack (см. encoding.py)"""
+    history_id = check_history_id(history_id)
+    upload = await receive_upload(file)
+    with upload:
+        cache_key = analysis_cache_key(upload, language, history_id)
+        try:
+            # Повтор той же выписки, пока первый анализ еще идет, ждет его результат
+            result = await analysis_flight.do(
+                cache_key,
+                lambda: analyze_upload(upload.detach(), cache_key, language, history_id),
+            )
+        except BudgetExceededError as e:
+            raise busy_error(e)
+    return encode_result(result, http_request.headers.get("accept"))
+
+async def analyze_upload(upload, cache_key, language="ru", history_id=""):
+    # Файлом владеет задача анализа: запрос, запустивший ее, может уйти раньше
+    try:
+        return await analyze_pdf(upload.path, cache_key, language, history_id=history_id)
+    finally:
+        upload.close()
+
+async def stream_upload(upload, cache_key, language, history_id, stages):
+    """analyze_upload для /analyze/stream: стадии по дороге складываются в stages, None - конец"""
     try:
-        # Читаем PDF
-        content = await file.read()
-        with pdfplumber.open(io.BytesIO(content)) as pdf:
-            for page in pdf.pages:
-                text = page.extract_text()
-                if text: full_text += text + "\n"
-    except:
-        print("Ошибка чтения PDF")
-
-    print(f"--- Extracted {len(full_text)} chars ---")
-    
-    # FAIL-SAFE: Если PDF не прочитался (пустой текст), отдаем мок Амира
-    if len(full_text) < 50:
-        return MOCK_AMIR_DATA
-
-    # Отправляем в AI с языком
-    result = analyze_kaspi_statement(full_text, language)
-    
+        result = None
+        async for event, data in analysis_events(upload.path, cache_key, language, history_id=history_id):
+            stages.put_nowait((event, data))
+            if event == "done":
+                result = data
+        return result
+    finally:
+        stages.put_nowait(None)
+        upload.close()
+
+class UploadEventStream(StreamingResponse):
+    """
+    SSE-ответ, которому принадлежит загруженный файл: он удаляется после ответа,
+    даже если клиент ушел до первого события и генератор так и не запустился.
+    Файл, переданный анализу через detach(), остается задаче.
+    """
+
+    def __init__(self, content, upload):
+        super().__init__(
+            content,
+            media_type="text/event-stream",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        )
+        self.upload = upload
+
+    async def __call__(self, scope, receive, send):
+        with self.upload:
+            await super().__call__(scope, receive, send)
+
+@app.post("/analyze/stream")
+async def analyze_statement_stream(
+    http_request: Request, file: UploadFile = File(...), language: str = "ru", history_id: str = ""
+):
+    """
+    То же, что /analyze, но по стадиям через Server-Sent Events (см. analysis_events):
+    progress, пачки transactions и промежуточные categories по мере разбора,
+    reset, если уже показанные транзакции надо сбросить, и done с полным ответом
+    (включая advice и forecast_next_month). Если сервер занят другими выписками
+    дольше UPLOAD_QUEUE_SECONDS - error {"message", "retry_after"}.
+    """
+    history_id = check_history_id(history_id)
+    upload = await receive_upload(file)
+    cache_key = analysis_cache_key(upload, language, history_id)
+
+    async def events():
+        try:
+            # Такая же выписка уже анализируется обычным /analyze - просто дожидаемся результата
+            if analysis_flight.in_flight(cache_key):
+                yield sse_event("progress", {"stage": "coalesced"})
+                result = await analysis_flight.do(
+                    cache_key, lambda: analyze_upload(upload.detach(), cache_key, language, history_id)
+                )
+                yield sse_event("done", result)
+                return
+            # Анализ идет под тем же ключом single-flight: /analyze этой же выписки присоединится к нему
+            stages = asyncio.Queue()
+            task = analysis_flight.start(
+                cache_key, lambda: stream_upload(upload.detach(), cache_key, language, history_id, stages)
+            )
+            try:
+                while (stage := await stages.get()) is not None:
+                    if await http_request.is_disconnected():
+                        print("ℹ️ Клиент отключился, анализ остановлен")
+                        return
+                    yield sse_event(*stage)
+                await asyncio.shield(task)
+            finally:
+                # Клиент ушел - бросаем разбор и запросы к LLM, если результат не ждет никто другой
+                if not task.done() and not analysis_flight.waiting(cache_key):
+                    task.cancel()
+        except BudgetExceededError as e:
+            UPLOADS_REJECTED.inc(reason="budget")
+            yield sse_event("error", {"message": str(e), "retry_after": e.retry_after})
+
+    return UploadEventStream(events(), upload)
+
+async def remember_context(context_id, result):
+    """Сохраняет результат для /chat и добавляет в ответ его context_id"""
+    await asyncio.to_thread(context_store.put, context_id, result)
+    return {**result, "context_id": context_id}
+
+async def with_history(result, history_id, language):
+    """Итоги по всей истории пользователя - поверх ответа, в кэш результатов они не попадают"""
+    summary = await history_summary(history_id, language)
+    return {**result, "history": summary} if summary is not None else result
+
+async def analysis_events(pdf_path, cache_key, language="ru", queue_seconds=None, history_id=""):
+    """
+    Весь конвейер /analyze для PDF на диске по стадиям: кэш, извлечение текста
+    постранично, анализ, валидация. Последнее событие - done с полным ответом.
+    Открытие и разбор PDF идут под upload_budget (queue_seconds - сколько ждать
+    места, см. UploadBudget.acquire); BudgetExceededError летит наружу.
+    С history_id транзакции выписки дописываются в историю, а в ответ
+    добавляется history с итогами по месяцам.
+    """
+    # Повторная загрузка той же выписки не тратит токены; SQLite-кэш читаем вне цикла событий
+    cached = await asyncio.to_thread(result_cache.get, cache_key)
+    CACHE_REQUESTS.inc(cache="analysis", result="miss" if cached is None else "hit")
+    if cached is not None:
+        print("⚡ Результат анализа взят из кэша")
+        if history_id:
+            await asyncio.to_thread(history_store.add, history_id, transactions_from_result(cached))
+        yield "done", await with_history(await remember_context(cache_key, cached), history_id, language)
+        return
+
+    try:
+        size = os.path.getsize(pdf_path)
+    except OSError:
+        size = 0
+    with span("admission"):
+        reservation = await upload_budget.acquire(size, queue_seconds)
+    try:
+        # Один дедлайн на все запросы к LLM этого анализа: повторы не растягивают его бесконечно
+        deadline = time.monotonic() + LLM_DEADLINE_SECONDS
+        try:
+            with span("pdf_open"):
+                page_count = await asyncio.get_running_loop().run_in_executor(None, count_pages, pdf_path)
+        except Exception:
+            print("Ошибка чтения PDF")
+            page_count = 0
+        yield "progress", {"stage": "extract", "page": 0, "pages": page_count}
+
+        async def pages():
+            try:
+                if not page_count:
+                    return
+                # Читаем PDF
+                async for text in pdf_extractor.aiter_pages(pdf_path, page_count):
+                    if text:
+                        yield text
+            except Exception:
+                print("Ошибка чтения PDF")
+            finally:
+                # Текст извлечен - место в бюджете нужно следующей выписке, а не ожиданию LLM
+                reservation.release()
+
+        result = None
+        async for event, data in analyze_statement_events(pages(), language, deadline, history_id):
+            if event == "result":
+                result = data
+            elif event == "progress" and data["stage"] == "extract":
+                yield event, {**data, "pages": page_count}
+            else:
+                yield event, data
+    finally:
+        reservation.release()
+
     # Если AI сломался - отдаем мок
     if not result:
         print("⚠️ AI вернул None, используем мок-данные")
-        return MOCK_AMIR_DATA
-    
-    # Проверяем, что результат валидный
-    if not isinstance(result, dict):
-        print(f"⚠️ AI вернул не dict, а {type(result)}, используем мок-данные")
-        return MOCK_AMIR_DATA
-    
-    # Проверяем обязательные поля
-    required_fields = ['total_spent', 'categories', 'transactions']
-    missing_fields = [field for field in required_fields if field not in result]
-    if missing_fields:
-        print(f"⚠️ В ответе отсутствуют обязательные поля: {missing_fields}, используем мок-данные")
-        return MOCK_AMIR_DATA
-    
-    # Валидация данных
+        MOCK_FALLBACKS.inc(reason="no_result")
+        yield "done", MOCK_AMIR_DATA
+        return
+
+    # Проверяем структуру ответа (total_spent, списки categories и transactions)
     try:
-        # Проверяем, что categories - это список
-        if not isinstance(result.get('categories'), list):
-            print(f"⚠️ categories не является списком: {type(result.get('categories'))}, используем мок-данные")
-            return MOCK_AMIR_DATA
-        
-        # Проверяем, что transactions - это список
-        if not isinstance(result.get('transactions'), list):
-            print(f"⚠️ transactions не является списком: {type(result.get('transactions'))}, используем мок-данные")
-            return MOCK_AMIR_DATA
-        
-        print(f"✅ Успешно обработан ответ AI: total_spent={result.get('total_spent')}, categories={len(result.get('categories', []))}, transactions={len(result.get('transactions', []))}")
-        return result
-    except Exception as validation_err:
-        print(f"⚠️ Ошибка валидации данных: {validation_err}, используем мок-данные")
-        import traceback
-        traceback.print_exc()
-        return MOCK_AMIR_DATA
+        with span("validation"):
+            AnalysisResult.model_validate(result)
+    except ValidationError as validation_err:
+        print(f"⚠️ Ошибка валидации данных: {validation_err.error_count()} ошибок, используем мок-данные")
+        print(validation_err)
+        MOCK_FALLBACKS.inc(reason="invalid_result")
+        yield "done", MOCK_AMIR_DATA
+        return
+
+    print(f"✅ Успешно обработан ответ AI: total_spent={result.get('total_spent')}, categories={len(result.get('categories', []))}, transactions={len(result.get('transactions', []))}")
+    # Ответ без совета (LLM не ответил на сводный запрос) не кэшируем, чтобы повторить позже
+    if result.get("advice"):
+        await asyncio.to_thread(result_cache.set, cache_key, result)
+    yield "done", await with_history(await remember_context(cache_key, result), history_id, language)
+
+async def analyze_pdf(pdf_path, cache_key, language="ru", queue_seconds=None, history_id=""):
+    """Весь конвейер /analyze одним ответом"""
+    async for event, data in analysis_events(pdf_path, cache_key, language, queue_seconds, history_id):
+        if event == "done":
+            return data
+
+# --- Пакетный анализ: задачи в очереди, результат забирается через GET /jobs/{id} ---
+async def run_analysis_job(params):
+    history_id = params.get("history_id", "")
+    return await analysis_flight.do(
+        params["cache_key"],
+        # Фоновая задача ждет места в upload_budget сколько нужно, а не получает 503
+        lambda: analyze_pdf(params["pdf_path"], params["cache_key"], params["language"], math.inf, history_id),
+    )
+
+job_manager = JobManager(run_analysis_job)
+
+@app.post("/analyze/batch")
+async def analyze_batch(
+    files: List[UploadFile] = File(...), language: str = "ru", priority: int = 0, history_id: str = ""
+):
+    """
+    Принимает несколько выписок и сразу возвращает id задач.
+    Больший priority обрабатывается раньше; при переполненной очереди - 429
+    (с уже принятыми задачами в accepted). Если хоть один файл больше лимита -
+    413, и в очередь не ставится ни один.
+    """
+    history_id = check_history_id(history_id)
+    batch_id = uuid.uuid4().hex
+    jobs = []
+    with ExitStack() as stack:
+        # Сначала все файлы на диск: 413 на третьем файле не должен оставить первые два в очереди без id
+        uploads = [stack.enter_context(await receive_upload(file)) for file in files]
+        for file, upload in zip(files, uploads):
+            params = {
+                "language": language,
+                "cache_key": analysis_cache_key(upload, language, history_id),
+                "history_id": history_id,
+            }
+            try:
+                jobs.append(await job_manager.submit(upload.path, file.filename, params, priority, batch_id))
+            except QueueFullError as e:
+                raise HTTPException(
+                    status_code=429,
+                    detail={"message": str(e), "accepted": jobs},
+                    headers={"Retry-After": "30"},
+                )
+            upload.detach()
+    return {"batch_id": batch_id, "jobs": jobs}
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str, http_request: Request):
+    job = await job_manager.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Задача не найдена")
+    return encode_result(job, http_request.headers.get("accept"), field="result")
+
+# --- История между выписками (history.py) ---
+@app.get("/history/{history_id}")
+async def get_history(history_id: str, language: str = "ru"):
+    summary = await history_summary(check_history_id(history_id), language)
+    if summary is None:
+        raise HTTPException(status_code=404, detail="История не найдена")
+    return summary
+
+@app.delete("/history/{history_id}")
+async def delete_history(history_id: str):
+    """Пользователь отключил историю или удаляет данные - стираем все, что хранилось"""
+    history_id = check_history_id(history_id)
+    return {"deleted": await asyncio.to_thread(history_store.delete, history_id) if history_id else False}
+
+# --- Прогноз по уже разобранной выписке, например для выбранного в приложении периода ---
+@app.get("/forecast/{context_id}")
+async def get_forecast(context_id: str, date_from: str = "", date_to: str = "", language: str = "ru"):
+    """date_from/date_to - DD.MM.YYYY включительно; пересчет без LLM за миллисекунды"""
+    context = await asyncio.to_thread(context_store.get, context_id)
+    if context is None:
+        raise HTTPException(status_code=404, detail="Контекст не найден, загрузите выписку заново")
+    transactions = transactions_from_result(context)
+    days = to_days([txn.date for txn in transactions])
+    low, high = (to_days([value])[0] if value else None for value in (date_from, date_to))
+    if low == -1 or high == -1:
+        raise HTTPException(status_code=400, detail="Дата должна быть в формате DD.MM.YYYY")
+    transactions = [
+        txn for txn, day in zip(transactions, days)
+        if (low is None or day >= low) and (high is None or day <= high)
+    ]
+    forecast = forecast_transactions(transactions)
+    if forecast is None:
+        raise HTTPException(status_code=404, detail="За выбранный период нет транзакций с датами")
+    return {
+        "forecast_next_month": round(sum(forecast.values()), 2),
+        "forecast_categories": build_categories(forecast, normalize_language(language)),
+    }
 
 # --- Модель для чата ---
 class ChatRequest(BaseModel):
     question: str
-    context: dict  # Сюда прилетит JSON с тратами (finance_data)
+    context_id: str = ""  # context_id из ответа /analyze, данные берутся из context_store
+    context: dict = {}  # Старые клиенты присылают JSON с тратами (finance_data) целиком
     user_goal: str = ""  # Финансовая цель пользователя
     language: str = "ru"  # Язык интерфейса (ru, kz, en)
 
-@app.post("/chat")
-async def chat_with_finance(request: ChatRequest):
+# Сообщение об ошибке на нужном языке
+CHAT_ERROR_MESSAGES = {
+    "ru": "Мозг перегрелся 🤯. Попробуй спросить позже.",
+    "kz": "Ми салқындау керек 🤯. Кейінірек сұра.",
+    "en": "Brain overheated 🤯. Try asking later."
+}
+
+def chat_error_message(language):
+    lang = language.lower() if language else "ru"
+    return CHAT_ERROR_MESSAGES.get(lang, CHAT_ERROR_MESSAGES["ru"])
+
+def chat_context(request):
     """
-    Эндпоинт для общения.
-    Принимает вопрос и ПОЛНЫЙ контекст финансов (чтобы не хранить базу).
+    Компактная сводка данных пользователя для промпта: по context_id из хранилища
+    (рендерится один раз на язык), иначе из присланного context.
+    """
+    if request.context_id:
+        prompt = context_store.prompt(request.context_id, request.language)
+        if prompt is not None:
+            return prompt
+    if request.context:
+        return render_context(request.context, request.language)
+    raise HTTPException(status_code=404, detail="Контекст не найден, загрузите выписку заново")
+
+def local_answer(request):
+    """
+    Вопросы-агрегации ("сколько на еду", "топ 3 магазина") считаем сами по
+    индексу транзакций, без LLM. None - вопрос уходит в DeepSeek.
+    """
+    index = context_store.index(request.context_id) if request.context_id else None
+    if index is None and request.context:
+        index = StatementIndex(request.context.get("transactions") or [])
+    if index is None:
+        return None
+    return answer_question(request.question, index, request.language)
+
+def build_chat_messages(request):
+    """
+    Статичный системный промпт на языке пользователя, затем его данные и цель, вопрос последним:
+    одинаковое начало запроса DeepSeek берет из кэша префиксов.
     """
-    # Превращаем JSON с тратами в строку для промпта
-    context_str = json.dumps(request.context, ensure_ascii=False, indent=2)
-    
-    # 💡 ИСПОЛЬЗОВАНИЕ ЦЕЛИ: Формируем часть промпта с целью пользователя
+    lang = normalize_language(request.language)
+    with span("prompt_build"):
+        data = f"{CHAT_DATA_HEADERS[lang]}\n{chat_context(request)}"
+
+    # 💡 ИСПОЛЬЗОВАНИЕ ЦЕЛИ: добавляем цель пользователя к его данным
     # Цель сохраняется в mobile/lib/goals_screen.dart -> SharedPreferences
     # Загружается в mobile/lib/api_service.dart -> sendChatMessage()
-    # Отправляется сюда и используется в системном промпте для персонализации советов
-    goal_prompt = ""
+    # Отправляется сюда и используется для персонализации советов
     if request.user_goal:
-        goal_prompt = f"\nЦель пользователя: {request.user_goal}. Давай советы, опираясь на эту цель."
-    
-    # Определяем язык для системного промпта
-    lang = request.language.lower() if request.language else "ru"
-    
-    # Генерируем системный промпт на нужном языке
-    if lang == "kz":
-        system_prompt = f"""
-        Сен — FinSight қолданбасының қаржы кеңесшісің.
-        Міндетің: пайдаланушыға үнемдеуге және шығындарды түсінуге көмектесу.
-        
-        МІНЕ ПАЙДАЛАНУШЫ ДЕРЕКТЕРІ (JSON):
-        {context_str}
-        {goal_prompt}
-        
-        ЕРЕЖЕЛЕР:
-        1. Қысқаша жауап бер (макс 3-4 сөйлем).
-        2. Деректердегі сандармен жұмыс істе. Егер "Тағамға қанша жұмсадым?" деп сұраса, "Тағам" немесе "Тауарлар" санатын тауып, соманы айт.
-        3. Егер Kaspi Red/Бөліп төлеу көрсең, қарыздық жүктеме туралы ескерт.
-        4. Мейірімді және мотивациялық бол.
-        5. Валюта: Теңге (₸).
-        """
-    elif lang == "en":
-        system_prompt = f"""
-        You are a financial consultant for the FinSight app.
-        Your goal: help the user save money and understand their expenses.
-        
-        HERE IS THE USER'S DATA (JSON):
-        {context_str}
-        {goal_prompt}
-        
-        RULES:
-        1. Answer briefly (max 3-4 sentences).
-        2. Operate with numbers from the data. If asked "How much did I spend on food?", find the "Food" or "Products" category and tell the amount.
-        3. If you see Kaspi Red/Installments, warn about debt burden.
-        4. Be polite and motivating.
-        5. Currency: Tenge (₸).
-        """
-    else:  # ru (default)
-        system_prompt = f"""
-        Ты — финансовый консультант приложения FinSight.
-        Твоя цель: помогать пользователю экономить и разбираться в тратах.
-        
-        ВОТ ДАННЫЕ ПОЛЬЗОВАТЕЛЯ (JSON):
-        {context_str}
-        {goal_prompt}
-        
-        ПРАВИЛА:
-        1. Отвечай кратко (макс 3-4 предложения).
-        2. Оперируй цифрами из данных. Если спрашивают "Сколько я потратил на еду?", найди категорию "Еда" или "Продукты" и скажи сумму.
-        3. Если видишь Каспи Ред/Рассрочки, предупреждай о долговой нагрузке.
-        4. Будь вежливым и мотивирующим.
-        5. Валюта: Тенге (₸).
-        """
+        data += "\n" + CHAT_GOAL_TEMPLATES[lang].format(goal=request.user_goal)
+
+    return [
+        {"role": "system", "content": CHAT_SYSTEM_PROMPTS[lang]},
+        {"role": "system", "content": data},
+        {"role": "user", "content": request.question}
+    ]
+
+async def complete_chat(messages):
+    response = await llm.complete(
+        hedge=True,
+        model="deepseek-chat",  # Модель DeepSeek
+        messages=messages,
+        temperature=0.3,
+        max_tokens=500
+    )
+    record_usage("chat", response)
+    if response.choices[0].finish_reason == "length":
+        LLM_TRUNCATIONS.inc(prompt="chat")
+    return response.choices[0].message.content
 
+@app.post("/chat")
+async def chat_with_finance(request: ChatRequest):
+    """
+    Эндпоинт для общения.
+    Принимает вопрос и context_id из /analyze (или, для старых клиентов, полный контекст финансов).
+    """
+    # Хранилище контекста может читать SQLite - индекс и сводку достаем вне цикла событий
+    reply = await asyncio.to_thread(local_answer, request)
+    if reply is not None:
+        CHAT_ANSWERS.inc(source="local")
+        return {"reply": reply}
+    CHAT_ANSWERS.inc(source="llm")
+    messages = await asyncio.to_thread(build_chat_messages, request)
+    # Тот же вопрос с теми же данными, пока ответ еще генерируется, ждет этот ответ
+    flight_key = make_key(json.dumps(messages, ensure_ascii=False).encode("utf-8"), PROMPT_VERSIONS["chat"])
     try:
-        response = client.chat.completions.create(
-            model="deepseek-chat",  # Модель DeepSeek
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": request.question}
-            ],
-            temperature=0.3,
-            max_tokens=500
-        )
-        return {"reply": response.choices[0].message.content}
+        return {"reply": await chat_flight.do(flight_key, lambda: complete_chat(messages))}
     except Exception as e:
-        print(f"Chat Error: {e}")
-        # Сообщение об ошибке на нужном языке
-        error_messages = {
-            "ru": "Мозг перегрелся 🤯. Попробуй спросить позже.",
-            "kz": "Ми салқындау керек 🤯. Кейінірек сұра.",
-            "en": "Brain overheated 🤯. Try asking later."
-        }
-        lang = request.language.lower() if request.language else "ru"
-        error_msg = error_messages.get(lang, error_messages["ru"])
-        return {"reply": error_msg}
+        print(f"Chat Error: {describe_error(classify_error(e))}")
+        return {"reply": chat_error_message(request.language)}
+
+def sse_event(event, data):
+    return f"event: {event}\ndata: {dumps_str(data)}\n\n"
+
+@app.post("/chat/stream")
+async def chat_stream(request: ChatRequest, http_request: Request):
+    """
+    То же, что /chat, но ответ идет Server-Sent Events по мере генерации:
+    event: delta {"text": ...}, затем done {"reply": полный текст}
+    или error {"reply": локализованное сообщение об ошибке}.
+    """
+    reply = await asyncio.to_thread(local_answer, request)
+    CHAT_ANSWERS.inc(source="llm" if reply is None else "local")
+    messages = await asyncio.to_thread(build_chat_messages, request) if reply is None else None
+
+    async def events():
+        if reply is not None:
+            yield sse_event("done", {"reply": reply})
+            return
+        stream = None
+        parts = []
+        try:
+            stream = await llm.stream(
+                model="deepseek-chat",  # Модель DeepSeek
+                messages=messages,
+                temperature=0.3,
+                max_tokens=500,
+                stream_options={"include_usage": True}
+            )
+            async for chunk in stream:
+                # Клиент ушел - закрываем поток, чтобы не платить за ненужные токены
+                if await http_request.is_disconnected():
+                    print("ℹ️ Клиент отключился, генерация остановлена")
+                    return
+                if chunk.usage is not None:
+                    record_usage("chat", chunk)
+                delta = chunk.choices[0].delta.content if chunk.choices else None
+                if delta:
+                    parts.append(delta)
+                    yield sse_event("delta", {"text": delta})
+            yield sse_event("done", {"reply": "".join(parts)})
+        except Exception as e:
+            print(f"Chat Error: {describe_error(classify_error(e))}")
+            yield sse_event("error", {"reply": chat_error_message(request.language)})
+        finally:
+            if stream is not None:
+                await stream.close()
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
 if __name__ == "__main__":
     import uvicorn
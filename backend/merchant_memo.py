@@ -0,0 +1,245 @@
+"""
+Справочник мерчант -> категория, общий для всех пользователей и запросов.
+
+Magnum, Yandex Go, Spotify встречаются почти в каждой выписке. Правила из
+categories.py покрывают только известные ключевые слова, остальное раньше
+каждый раз уходило в классификатор или LLM. Справочник запоминает уверенные
+ответы классификатора, LLM и детектора регулярных списаний по нормализованному названию мерчанта
+(без регистра, цифр, номеров точек, "ТОО"/"LLP" и города), и следующая
+выписка получает категорию и флаг подписки одним поиском в словаре -
+такие описания в промпт больше не попадают.
+
+Уверенность записи затухает с периодом полураспада
+MERCHANT_MEMO_HALF_LIFE_DAYS: ответ, который давно не подтверждался,
+перестает применяться (ниже MERCHANT_MEMO_MIN_CONFIDENCE) и потом
+удаляется. Совпадающие ответы повышают уверенность, расходящиеся - снижают
+или заменяют категорию. В памяти - LRU на MERCHANT_MEMO_SIZE записей,
+опционально SQLite (MERCHANT_MEMO_DB), общий для воркеров uvicorn.
+
+Хранятся только названия мерчантов и категории: без сумм, дат и id
+пользователей. Переводы и снятия категоризирует парсер по типу операции,
+в справочник они не попадают.
+"""
+
+import math
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Iterable, Optional, Tuple
+
+from categories import CATEGORY_KEYS
+
+MERCHANT_MEMO_SIZE = int(os.getenv("MERCHANT_MEMO_SIZE", "50000"))
+MERCHANT_MEMO_DB = os.getenv("MERCHANT_MEMO_DB", "")
+MERCHANT_MEMO_HALF_LIFE_DAYS = float(os.getenv("MERCHANT_MEMO_HALF_LIFE_DAYS", "60"))
+# Ниже этой (затухшей) уверенности запись не применяется
+MERCHANT_MEMO_MIN_CONFIDENCE = float(os.getenv("MERCHANT_MEMO_MIN_CONFIDENCE", "0.6"))
+# Ниже этой - удаляется
+MERCHANT_MEMO_DROP_CONFIDENCE = 0.1
+
+# Уверенность категории из сводного ответа LLM; у классификатора - его собственная
+LLM_CONFIDENCE = 0.8
+# Регулярное списание (recurring.py): подписка или рассрочка видна по самим данным
+RECURRING_CONFIDENCE = 0.9
+
+# Хвосты, не отличающие одного мерчанта от другого
+_NOISE_WORDS = frozenset((
+    "too", "тоо", "ип", "ip", "llp", "ао", "jsc", "ооо", "llc",
+    "kz", "kaz", "almaty", "алматы", "astana", "астана", "shymkent", "шымкент",
+))
+_TOKEN_RE = re.compile(r"[^\W\d_]+")
+# Короче скольких слов префикс названия не считается тем же мерчантом
+_MIN_PREFIX_WORDS = 2
+
+
+def merchant_key(description: str) -> str:
+    """'TOO MAGNUM CASH&CARRY #123 ALMATY' -> 'magnum cash carry'"""
+    words = _TOKEN_RE.findall(description.lower().replace("ё", "е"))
+    return " ".join(word for word in words if word not in _NOISE_WORDS)
+
+
+@dataclass(slots=True)
+class MerchantEntry:
+    category: str
+    subscription: bool
+    confidence: float
+    updated_at: float
+    hits: int = 0
+
+    @property
+    def credit(self) -> bool:
+        return self.category == "credit"
+
+    def decayed(self, now: float, half_life: float) -> float:
+        return self.confidence * 0.5 ** (max(0.0, now - self.updated_at) / half_life)
+
+
+class MerchantMemo:
+    def __init__(
+        self,
+        max_entries: int = MERCHANT_MEMO_SIZE,
+        db_path: str = MERCHANT_MEMO_DB,
+        half_life_days: float = MERCHANT_MEMO_HALF_LIFE_DAYS,
+        min_confidence: float = MERCHANT_MEMO_MIN_CONFIDENCE,
+    ):
+        self.max_entries = max_entries
+        self.half_life = half_life_days * 24 * 3600
+        self.min_confidence = min_confidence
+        self._memory: "OrderedDict[str, MerchantEntry]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.learned = 0
+        self.evictions = 0
+        self._db = self._open_db(db_path) if db_path else None
+
+    @staticmethod
+    def _open_db(path: str) -> sqlite3.Connection:
+        db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute(
+            "CREATE TABLE IF NOT EXISTS merchants ("
+            "merchant TEXT PRIMARY KEY, category TEXT NOT NULL, subscription INTEGER NOT NULL, "
+            "confidence REAL NOT NULL, updated_at REAL NOT NULL, hits INTEGER NOT NULL) WITHOUT ROWID"
+        )
+        return db
+
+    def _get(self, key: str, now: float) -> Optional[MerchantEntry]:
+        """Запись с учетом затухания; слишком слабые удаляются. Вызывать под self._lock"""
+        entry = self._memory.get(key)
+        if entry is None and self._db is not None:
+            row = self._db.execute(
+                "SELECT category, subscription, confidence, updated_at, hits FROM merchants WHERE merchant = ?",
+                (key,),
+            ).fetchone()
+            if row is not None:
+                entry = MerchantEntry(row[0], bool(row[1]), row[2], row[3], row[4])
+                self._remember(key, entry)
+        if entry is None:
+            return None
+        if entry.decayed(now, self.half_life) < MERCHANT_MEMO_DROP_CONFIDENCE:
+            del self._memory[key]
+            self.evictions += 1
+            if self._db is not None:
+                self._db.execute("DELETE FROM merchants WHERE merchant = ?", (key,))
+            return None
+        self._memory.move_to_end(key)
+        return entry
+
+    def _remember(self, key: str, entry: MerchantEntry) -> None:
+        self._memory[key] = entry
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+            self.evictions += 1
+
+    def _find(self, key: str, now: float) -> Optional[MerchantEntry]:
+        """Точное название, затем все более короткие префиксы ('yandex go trip' -> 'yandex go')"""
+        words = key.split(" ")
+        for size in range(len(words), min(len(words), _MIN_PREFIX_WORDS) - 1, -1):
+            entry = self._get(" ".join(words[:size]), now)
+            if entry is not None and entry.decayed(now, self.half_life) >= self.min_confidence:
+                return entry
+        return None
+
+    def lookup(self, description: str) -> Optional[MerchantEntry]:
+        key = merchant_key(description)
+        if not key:
+            return None
+        with self._lock:
+            return self._find(key, time.time())
+
+    def apply(self, transactions) -> int:
+        """
+        Проставляет категорию и флаг подписки транзакциям без категории,
+        если мерчант известен достаточно уверенно. Возвращает число таких транзакций.
+        """
+        now = time.time()
+        resolved = 0
+        with self._lock:
+            found = {}
+            for txn in transactions:
+                if txn.category is not None:
+                    continue
+                key = merchant_key(txn.description)
+                if key not in found:
+                    found[key] = self._find(key, now) if key else None
+                entry = found[key]
+                if entry is None:
+                    self.misses += 1
+                    continue
+                txn.category = entry.category
+                txn.subscription = txn.subscription or entry.subscription
+                entry.hits += 1
+                self.hits += 1
+                resolved += 1
+        return resolved
+
+    def learn(self, observations: Iterable[Tuple[str, str, float, Optional[bool]]]) -> int:
+        """
+        observations - (описание, ключ категории, уверенность, подписка);
+        подписка None - источник о ней не знает (классификатор).
+        Совпадение с записью усиливает ее, расхождение ослабляет, а более
+        уверенный ответ заменяет. Возвращает число обновленных мерчантов.
+        """
+        now = time.time()
+        updated = {}
+        with self._lock:
+            for description, category, confidence, subscription in observations:
+                key = merchant_key(description)
+                # Неуверенные ответы не запоминаем: справочник не должен закреплять догадки
+                if not key or category not in CATEGORY_KEYS or confidence < self.min_confidence:
+                    continue
+                entry = updated.get(key) or self._get(key, now)
+                current = entry.decayed(now, self.half_life) if entry is not None else 0.0
+                if entry is None or (entry.category != category and confidence >= current):
+                    entry = MerchantEntry(category, bool(subscription), confidence, now, entry.hits if entry else 0)
+                elif entry.category == category:
+                    entry.confidence = current + (1 - current) * confidence
+                    if subscription is not None:
+                        entry.subscription = subscription
+                    entry.updated_at = now
+                else:
+                    entry.confidence = current - confidence / 2
+                    entry.updated_at = now
+                self._remember(key, entry)
+                updated[key] = entry
+            if self._db is not None and updated:
+                self._db.executemany(
+                    "INSERT OR REPLACE INTO merchants (merchant, category, subscription, confidence, updated_at, hits) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    [
+                        (key, e.category, int(e.subscription), e.confidence, e.updated_at, e.hits)
+                        for key, e in updated.items()
+                    ],
+                )
+            self.learned += len(updated)
+        return len(updated)
+
+    def purge_expired(self) -> None:
+        """Удаляет с диска записи, затухшие ниже порога даже при исходной уверенности 1.0"""
+        if self._db is not None:
+            max_age = self.half_life * math.log2(1 / MERCHANT_MEMO_DROP_CONFIDENCE)
+            with self._lock:
+                self._db.execute("DELETE FROM merchants WHERE updated_at < ?", (time.time() - max_age,))
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "entries": len(self._memory),
+                "hits": self.hits,
+                "misses": self.misses,
+                "learned": self.learned,
+                "evictions": self.evictions,
+                "disk": self._db is not None,
+            }
+
+    def close(self) -> None:
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
@@ -0,0 +1,133 @@
+"""
+Метрики в формате Prometheus без внешних зависимостей.
+
+Счетчики и гистограммы с метками живут в памяти процесса, GET /metrics
+отдает их текстом (text exposition format 0.0.4). span("stage") меряет
+стадию конвейера и пишет длительность в finsight_stage_seconds{stage=...}.
+Накладные расходы - perf_counter, поиск корзины bisect'ом и сложение
+под локом, поэтому метрики включены всегда. При нескольких воркерах
+uvicorn у каждого процесса свои значения.
+"""
+
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Dict, List, Sequence, Tuple
+
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+_lock = threading.Lock()
+_registry: List["_Metric"] = []
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: Sequence[str], values: Tuple[str, ...], extra: str = "") -> str:
+    parts = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help_text: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.help = help_text
+        self.label_names = tuple(labels)
+        with _lock:
+            _registry.append(self)
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        return tuple(str(labels.get(name, "")) for name in self.label_names)
+
+    def render(self) -> List[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, help_text: str, labels: Sequence[str] = ()):
+        super().__init__(name, help_text, labels)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self._key(labels)
+        with _lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self) -> List[str]:
+        lines = super().render()
+        for key, value in sorted(self._values.items()):
+            lines.append(f"{self.name}{_labels(self.label_names, key)} {value:g}")
+        return lines
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, labels: Sequence[str] = (), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help_text, labels)
+        self.buckets = tuple(buckets)
+        self._values: Dict[Tuple[str, ...], list] = {}  # [счетчики корзин..., sum, count]
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        index = bisect_left(self.buckets, value)
+        with _lock:
+            row = self._values.get(key)
+            if row is None:
+                row = self._values[key] = [0] * (len(self.buckets) + 2)
+            if index < len(self.buckets):
+                row[index] += 1
+            row[-2] += value
+            row[-1] += 1
+
+    def render(self) -> List[str]:
+        lines = super().render()
+        for key, row in sorted(self._values.items()):
+            cumulative = 0
+            labels = _labels(self.label_names, key)
+            for bound, count in zip(self.buckets, row):
+                cumulative += count
+                le = _labels(self.label_names, key, 'le="%g"' % bound)
+                lines.append(f"{self.name}_bucket{le} {cumulative}")
+            le = _labels(self.label_names, key, 'le="+Inf"')
+            lines.append(f"{self.name}_bucket{le} {row[-1]}")
+            lines.append(f"{self.name}_sum{labels} {row[-2]:g}")
+            lines.append(f"{self.name}_count{labels} {row[-1]}")
+        return lines
+
+
+def render() -> str:
+    with _lock:
+        metrics = list(_registry)
+        return "\n".join(line for metric in metrics for line in metric.render()) + "\n"
+
+
+# --- Метрики приложения ---
+
+STAGE_SECONDS = Histogram("finsight_stage_seconds", "Длительность стадий обработки", ["stage"])
+HTTP_SECONDS = Histogram("finsight_http_request_seconds", "Время ответа HTTP", ["method", "path", "status"])
+LLM_TOKENS = Counter("finsight_llm_tokens_total", "Токены LLM", ["prompt", "kind"])
+LLM_ERRORS = Counter("finsight_llm_errors_total", "Ошибки запросов к LLM", ["type"])
+LLM_TRUNCATIONS = Counter("finsight_llm_truncations_total", "Ответы LLM, обрезанные по max_tokens", ["prompt"])
+MOCK_FALLBACKS = Counter("finsight_mock_fallbacks_total", "Ответы /analyze мок-данными", ["reason"])
+CACHE_REQUESTS = Counter("finsight_cache_requests_total", "Обращения к кэшам", ["cache", "result"])
+CHAT_ANSWERS = Counter("finsight_chat_answers_total", "Ответы чата по источнику", ["source"])
+UPLOADS_REJECTED = Counter("finsight_uploads_rejected_total", "Отклоненные загрузки", ["reason"])
+
+
+@contextmanager
+def span(stage: str):
+    """Замер стадии: with span("pdf_open"): ..."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_SECONDS.observe(time.perf_counter() - started, stage=stage)
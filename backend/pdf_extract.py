@@ -0,0 +1,140 @@
+"""
+Извлечение текста из PDF в пуле процессов.
+
+Страницы режутся на шарды по PDF_PAGES_PER_TASK штук и раздаются воркерам.
+Воркер сам открывает PDF по пути к временному файлу, поэтому байты выписки
+не гоняются через pickle. Результаты возвращаются строго в порядке страниц,
+генератором, так что следующий этап может начинать работу до конца разбора.
+"""
+
+import asyncio
+import os
+import statistics
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import AsyncIterator, Iterator, List, Optional, Tuple
+
+import pdfplumber
+
+from metrics import STAGE_SECONDS
+
+PDF_WORKERS = int(os.getenv("PDF_WORKERS", str(min(4, os.cpu_count() or 1))))
+PDF_PAGES_PER_TASK = int(os.getenv("PDF_PAGES_PER_TASK", "4"))
+
+
+def _extract_shard(path: str, start: int, stop: int) -> List[Tuple[str, float]]:
+    """Выполняется в воркере: возвращает (текст, секунды) для страниц [start, stop)"""
+    result = []
+    with pdfplumber.open(path) as pdf:
+        for page in pdf.pages[start:stop]:
+            started = time.perf_counter()
+            text = page.extract_text() or ""
+            # Объекты страницы (символы, layout) больше не нужны - не копим их до конца шарда
+            page.close()
+            result.append((text, time.perf_counter() - started))
+    return result
+
+
+def count_pages(path: str) -> int:
+    with pdfplumber.open(path) as pdf:
+        return len(pdf.pages)
+
+
+class ExtractionStats:
+    """Счетчики для подбора размера пула: страниц/сек и задержка на страницу"""
+
+    def __init__(self, window: int = 2048):
+        self._lock = threading.Lock()
+        self.documents = 0
+        self.pages = 0
+        self.wall_seconds = 0.0
+        self._page_latencies: deque = deque(maxlen=window)
+
+    def record_page(self, seconds: float) -> None:
+        with self._lock:
+            self.pages += 1
+            self._page_latencies.append(seconds)
+        STAGE_SECONDS.observe(seconds, stage="pdf_page")
+
+    def record_document(self, seconds: float) -> None:
+        with self._lock:
+            self.documents += 1
+            self.wall_seconds += seconds
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            latencies = sorted(self._page_latencies)
+            pages, wall = self.pages, self.wall_seconds
+            documents = self.documents
+        return {
+            "workers": PDF_WORKERS,
+            "documents": documents,
+            "pages": pages,
+            "pages_per_sec": pages / wall if wall else 0.0,
+            "page_latency_p50_ms": statistics.median(latencies) * 1000 if latencies else 0.0,
+            "page_latency_p95_ms": latencies[int(len(latencies) * 0.95)] * 1000 if latencies else 0.0,
+        }
+
+
+class PdfExtractor:
+    def __init__(self, workers: int = PDF_WORKERS, pages_per_task: int = PDF_PAGES_PER_TASK):
+        self.workers = workers
+        self.pages_per_task = max(1, pages_per_task)
+        self.stats = ExtractionStats()
+        self._executor = None
+
+    @property
+    def executor(self) -> ProcessPoolExecutor:
+        # Пул создается лениво: воркеры не форкаются при импорте модуля
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.workers)
+        return self._executor
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def _submit(self, path: str, page_count: int):
+        return [
+            self.executor.submit(_extract_shard, path, start, min(start + self.pages_per_task, page_count))
+            for start in range(0, page_count, self.pages_per_task)
+        ]
+
+    def iter_pages(self, path: str) -> Iterator[str]:
+        """Синхронный генератор текстов страниц по порядку"""
+        started = time.perf_counter()
+        futures = self._submit(path, count_pages(path))
+        try:
+            for future in futures:
+                for text, seconds in future.result():
+                    self.stats.record_page(seconds)
+                    yield text
+        finally:
+            for future in futures:
+                future.cancel()
+        self.stats.record_document(time.perf_counter() - started)
+
+    async def aiter_pages(self, path: str, page_count: Optional[int] = None) -> AsyncIterator[str]:
+        """То же, но без блокировки event loop; page_count можно передать, если уже посчитан"""
+        started = time.perf_counter()
+        if page_count is None:
+            loop = asyncio.get_running_loop()
+            page_count = await loop.run_in_executor(None, count_pages, path)
+        futures = self._submit(path, page_count)
+        try:
+            for future in futures:
+                for text, seconds in await asyncio.wrap_future(future):
+                    self.stats.record_page(seconds)
+                    yield text
+        finally:
+            # Если потребитель бросил генератор, не тратим воркеры на остаток
+            for future in futures:
+                future.cancel()
+        self.stats.record_document(time.perf_counter() - started)
+
+    async def extract_text(self, path: str) -> str:
+        pages = [text async for text in self.aiter_pages(path) if text]
+        return "\n".join(pages) + "\n" if pages else ""
@@ -0,0 +1,193 @@
+"""
+Поиск регулярных списаний: подписки и платежи по рассрочке.
+
+Раньше подписки определялись списком названий в промпте и фильтром
+"kaspi magazin"/"kaspi red" поверх ответа LLM. Здесь - по самим данным:
+транзакции группируются по нормализованному мерчанту (merchant_memo.merchant_key)
+и близкой сумме (в пределах RECURRING_AMOUNT_TOLERANCE), и серия считается
+регулярной, если в ней не меньше RECURRING_MIN_CHARGES списаний, а
+интервалы между ними в основном совпадают с одним из периодов
+(неделя, две недели, месяц, квартал, год) с допуском.
+
+Все делается несколькими векторными проходами NumPy по отсортированным
+массивам без циклов по группам, поэтому годы истории многих пользователей
+(ключ группы может включать пользователя) разбираются за миллисекунды.
+Суммы бьются на логарифмические корзины дважды, со сдвигом на полкорзины,
+чтобы 4990 и 5010 не разошлись по границе корзины.
+
+Регулярная серия мерчанта-кредита (Kaspi Red, Kaspi Magazin, рассрочка) -
+платеж по рассрочке: категория credit, в подписки не попадает. Остальные
+регулярные серии без категории или в "Прочее" - подписки (трата остается
+в "Прочее", как и у подписок по ключевым словам). Регулярные поездки
+или покупки продуктов подписками не считаются, переводы и снятия наличных
+в поиск не попадают вовсе.
+"""
+
+import os
+import re
+from typing import Iterable, List, Sequence, Tuple
+
+import numpy as np
+
+from categories import match_category
+from merchant_memo import merchant_key
+
+RECURRING_AMOUNT_TOLERANCE = float(os.getenv("RECURRING_AMOUNT_TOLERANCE", "0.05"))
+RECURRING_MIN_CHARGES = int(os.getenv("RECURRING_MIN_CHARGES", "3"))
+# Доля интервалов серии, которые должны совпасть с ее периодом
+RECURRING_MIN_REGULARITY = 0.75
+
+PERIODS = np.array([7, 14, 30, 91, 365], dtype=np.int64)
+# Допуск по интервалу: месяц 28-31 день, списание может сдвинуться на выходные
+PERIOD_TOLERANCE = np.maximum(2, PERIODS // 10)
+# Границы между соседними периодами: ближайший период интервала - searchsorted
+_PERIOD_BOUNDS = (PERIODS[1:] + PERIODS[:-1]) / 2
+
+_DATE_RE = re.compile(r"^(\d{2})\.(\d{2})\.(\d{2}|\d{4})$")
+
+
+def to_days(dates: Iterable[str]) -> np.ndarray:
+    """DD.MM.YYYY / DD.MM.YY / YYYY-MM-DD -> номер дня (int64); неразобранные - -1"""
+    iso = []
+    for value in dates:
+        match = _DATE_RE.match(value)
+        if match:
+            day, month, year = match.groups()
+            value = f"{'20' + year if len(year) == 2 else year}-{month}-{day}"
+        iso.append(value)
+    try:
+        parsed = np.array(iso, dtype="datetime64[D]")
+    except ValueError:
+        parsed = np.array([_safe_day(value) for value in iso], dtype="datetime64[D]")
+    days = parsed.astype(np.int64)
+    days[np.isnat(parsed)] = -1
+    return days
+
+
+def _safe_day(value: str):
+    try:
+        return np.datetime64(value, "D")
+    except ValueError:
+        return np.datetime64("NaT")
+
+
+def _sort_order(keys: np.ndarray, buckets: np.ndarray, days: np.ndarray) -> np.ndarray:
+    """
+    Порядок по (ключ, корзина, день). Все три обычно помещаются в один int64 -
+    одна сортировка по нему в несколько раз быстрее np.lexsort по трем массивам.
+    """
+    buckets = buckets - buckets.min()
+    days = days - days.min()
+    bucket_bits = int(buckets.max()).bit_length()
+    day_bits = int(days.max()).bit_length()
+    if int(keys.max()).bit_length() + bucket_bits + day_bits < 63 and keys.min() >= 0:
+        return np.argsort((keys << (bucket_bits + day_bits)) | (buckets << day_bits) | days)
+    return np.lexsort((days, buckets, keys))
+
+
+def _series_pass(keys: np.ndarray, days: np.ndarray, buckets: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Один проход по сериям (ключ, корзина суммы): номер серии для каждой
+    транзакции (-1 - не регулярная) и период серии в днях (0 - не регулярная).
+    """
+    order = _sort_order(keys, buckets, days)
+    k, b, d = keys[order], buckets[order], days[order]
+    starts = np.r_[True, (k[1:] != k[:-1]) | (b[1:] != b[:-1])]
+    group = np.cumsum(starts) - 1
+    n_groups = int(group[-1]) + 1
+    charges = np.bincount(group, minlength=n_groups)
+
+    # Интервалы внутри групп и ближайший к каждому период
+    inner = ~starts[1:]
+    gaps = np.diff(d)[inner]
+    gap_group = group[1:][inner]
+    nearest = np.searchsorted(_PERIOD_BOUNDS, gaps)
+
+    # Период группы - самый частый ближайший период ее интервалов
+    votes = np.bincount(gap_group * len(PERIODS) + nearest, minlength=n_groups * len(PERIODS))
+    period = votes.reshape(n_groups, len(PERIODS)).argmax(axis=1)
+    expected = period[gap_group]
+    in_band = np.abs(gaps - PERIODS[expected]) <= PERIOD_TOLERANCE[expected]
+    regular = np.bincount(gap_group, weights=in_band.astype(np.float64), minlength=n_groups)
+
+    recurring = (charges >= RECURRING_MIN_CHARGES) & (regular >= RECURRING_MIN_REGULARITY * (charges - 1))
+    series = np.full(len(keys), -1, dtype=np.int64)
+    periods = np.zeros(len(keys), dtype=np.int64)
+    series[order] = np.where(recurring[group], group, -1)
+    periods[order] = np.where(recurring[group], PERIODS[period][group], 0)
+    return series, periods
+
+
+def recurring_series(
+    keys: np.ndarray,
+    days: np.ndarray,
+    amounts: np.ndarray,
+    tolerance: float = RECURRING_AMOUNT_TOLERANCE,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    keys - целочисленный ключ серии (мерчант, при пакетной обработке - пара
+    пользователь/мерчант), days - номер дня, amounts - сумма списания.
+    Возвращает номер регулярной серии для каждой транзакции (-1 - не входит
+    ни в одну) и период серии в днях (0). Транзакции без даты или с нулевой
+    суммой не участвуют.
+    """
+    keys = np.asarray(keys, dtype=np.int64)
+    days = np.asarray(days, dtype=np.int64)
+    amounts = np.asarray(amounts, dtype=np.float64)
+    series = np.full(len(keys), -1, dtype=np.int64)
+    periods = np.zeros(len(keys), dtype=np.int64)
+    valid = np.flatnonzero((days >= 0) & (amounts > 0))
+    if len(valid) < RECURRING_MIN_CHARGES:
+        return series, periods
+    scaled = np.log(amounts[valid]) / np.log1p(tolerance)
+    offset = 0
+    for shift in (0.0, 0.5):
+        buckets = np.floor(scaled + shift).astype(np.int64)
+        found, found_periods = _series_pass(keys[valid], days[valid], buckets)
+        # Серия второго прохода берется только для транзакций, не попавших в серию первого
+        take = (found >= 0) & (series[valid] < 0)
+        series[valid[take]] = found[take] + offset
+        periods[valid[take]] = found_periods[take]
+        offset += len(valid)
+    return series, periods
+
+
+def find_recurring(keys: np.ndarray, days: np.ndarray, amounts: np.ndarray, **kwargs) -> np.ndarray:
+    """Маска транзакций, входящих в регулярные серии (см. recurring_series)"""
+    return recurring_series(keys, days, amounts, **kwargs)[0] >= 0
+
+
+def mark_recurring(transactions, history: Sequence[tuple] = ()) -> Tuple[List, List]:
+    """
+    Находит регулярные списания среди покупок из transactions; history - прошлые
+    транзакции пользователя (дата, сумма, описание, ...), только как доказательство
+    периодичности. Подпискам ставит флаг subscription (и "Прочее", если
+    категории еще нет), рассрочкам - категорию credit.
+    Возвращает (подписки, рассрочки) из transactions.
+    """
+    # Регулярный перевод маме или снятие наличных - не подписка
+    purchases = [txn for txn in transactions if txn.operation == "purchase"]
+    if not purchases:
+        return [], []
+    descriptions = [txn.description for txn in purchases] + [row[2] for row in history]
+    names, keys = np.unique([merchant_key(text) or text.lower() for text in descriptions], return_inverse=True)
+    days = to_days([txn.date for txn in purchases] + [row[0] for row in history])
+    amounts = np.array([txn.amount for txn in purchases] + [row[1] for row in history], dtype=np.float64)
+    mask = find_recurring(keys, days, amounts)[:len(purchases)]
+
+    subscriptions, installments = [], []
+    credit_names = {}
+    for index in np.flatnonzero(mask):
+        txn = purchases[index]
+        name = names[keys[index]]
+        if name not in credit_names:
+            credit_names[name] = match_category(txn.description) == "credit" or txn.category == "credit"
+        if credit_names[name]:
+            txn.category = "credit"
+            txn.subscription = False
+            installments.append(txn)
+        elif txn.category in (None, "other"):
+            txn.category = "other"
+            txn.subscription = True
+            subscriptions.append(txn)
+    return subscriptions, installments
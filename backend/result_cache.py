@@ -0,0 +1,130 @@
+"""
+Кэш результатов /analyze с адресацией по содержимому.
+
+Ключ - sha256 от байтов PDF плюс язык и версия промпта, поэтому повторная
+загрузка той же выписки не тратит токены. Два уровня:
+  * LRU в памяти процесса с TTL;
+  * опционально SQLite-файл (RESULT_CACHE_DB), общий для всех uvicorn-воркеров.
+"""
+
+import copy
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+RESULT_CACHE_SIZE = int(os.getenv("RESULT_CACHE_SIZE", "256"))
+RESULT_CACHE_TTL_SECONDS = float(os.getenv("RESULT_CACHE_TTL_SECONDS", str(7 * 24 * 3600)))
+RESULT_CACHE_DB = os.getenv("RESULT_CACHE_DB", "")
+
+
+def make_key(content: bytes, *parts: str) -> str:
+    return digest_key(hashlib.sha256(content), *parts)
+
+
+def digest_key(digest, *parts: str) -> str:
+    """Тот же ключ, если sha256 от содержимого уже посчитан по кускам (см. uploads.spool_upload)"""
+    digest = digest.copy()
+    for part in parts:
+        digest.update(b"\0" + part.encode("utf-8"))
+    return digest.hexdigest()
+
+
+class ResultCache:
+    def __init__(
+        self,
+        max_entries: int = RESULT_CACHE_SIZE,
+        ttl_seconds: float = RESULT_CACHE_TTL_SECONDS,
+        db_path: str = RESULT_CACHE_DB,
+    ):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._memory: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._db = self._open_db(db_path) if db_path else None
+
+    @staticmethod
+    def _open_db(path: str) -> sqlite3.Connection:
+        db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute(
+            "CREATE TABLE IF NOT EXISTS results ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)"
+        )
+        return db
+
+    def get(self, key: str) -> Optional[dict]:
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                expires_at, value = entry
+                if expires_at > now:
+                    self._memory.move_to_end(key)
+                    self.hits += 1
+                    return copy.deepcopy(value)
+                del self._memory[key]
+                self.evictions += 1
+
+            if self._db is not None:
+                row = self._db.execute(
+                    "SELECT value, expires_at FROM results WHERE key = ? AND expires_at > ?",
+                    (key, now),
+                ).fetchone()
+                if row is not None:
+                    value = json.loads(row[0])
+                    self._remember(key, value, row[1])
+                    self.hits += 1
+                    self.disk_hits += 1
+                    return copy.deepcopy(value)
+
+            self.misses += 1
+            return None
+
+    def set(self, key: str, value: dict) -> None:
+        expires_at = time.time() + self.ttl_seconds
+        value = copy.deepcopy(value)
+        with self._lock:
+            self._remember(key, value, expires_at)
+            if self._db is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO results (key, value, expires_at) VALUES (?, ?, ?)",
+                    (key, json.dumps(value, ensure_ascii=False), expires_at),
+                )
+
+    def _remember(self, key: str, value: dict, expires_at: float) -> None:
+        self._memory[key] = (expires_at, value)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+            self.evictions += 1
+
+    def purge_expired(self) -> None:
+        """Чистит просроченные записи на диске (в памяти они уходят лениво)"""
+        if self._db is not None:
+            with self._lock:
+                self._db.execute("DELETE FROM results WHERE expires_at <= ?", (time.time(),))
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "entries": len(self._memory),
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "disk": self._db is not None,
+            }
+
+    def close(self) -> None:
+        if self._db is not None:
+            self._db.close()
+            self._db = None
@@ -0,0 +1,68 @@
+"""
+Single-flight: одинаковые одновременные запросы выполняются один раз.
+
+Двойной тап по "Загрузить" или повтор Flutter-клиента после таймаута
+приходят, пока первый анализ еще идет. Первый вызов с ключом запускает
+работу в отдельной задаче, остальные ждут ту же задачу. Отмена одного
+из ожидающих (клиент ушел) не отменяет работу для остальных.
+"""
+
+import asyncio
+from typing import Awaitable, Callable, Dict, TypeVar
+
+T = TypeVar("T")
+
+
+class SingleFlight:
+    def __init__(self, name: str):
+        self.name = name
+        self._tasks: Dict[str, asyncio.Task] = {}
+        self._waiting: Dict[asyncio.Task, int] = {}
+        self.calls = 0
+        self.coalesced = 0
+
+    def in_flight(self, key: str) -> bool:
+        return key in self._tasks
+
+    def waiting(self, key: str) -> int:
+        """Сколько вызовов do сейчас ждут работу под ключом"""
+        task = self._tasks.get(key)
+        return self._waiting.get(task, 0) if task is not None else 0
+
+    def start(self, key: str, fn: Callable[[], Awaitable[T]]) -> "asyncio.Task[T]":
+        """
+        Запускает работу под ключом, не дожидаясь ее: вызывающий сам следит за
+        задачей (например, отдает ее стадии по SSE), а do с тем же ключом
+        присоединяется к ней. Ключ должен быть свободен (см. in_flight).
+        """
+        self.calls += 1
+        task = asyncio.create_task(fn())
+        self._tasks[key] = task
+        task.add_done_callback(lambda done: self._forget(key, done))
+        return task
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[T]]) -> T:
+        task = self._tasks.get(key)
+        if task is None:
+            task = self.start(key, fn)
+        else:
+            self.calls += 1
+            self.coalesced += 1
+            print(f"🔗 {self.name}: запрос присоединен к уже идущему")
+        self._waiting[task] = self._waiting.get(task, 0) + 1
+        try:
+            return await asyncio.shield(task)
+        finally:
+            self._waiting[task] -= 1
+            if not self._waiting[task]:
+                del self._waiting[task]
+
+    def _forget(self, key: str, task: asyncio.Task) -> None:
+        if self._tasks.get(key) is task:
+            del self._tasks[key]
+        # Все ждавшие могли уйти - забираем исключение, чтобы asyncio не ругался
+        if not task.cancelled():
+            task.exception()
+
+    def stats(self) -> dict:
+        return {"calls": self.calls, "coalesced": self.coalesced, "in_flight": len(self._tasks)}
@@ -0,0 +1,74 @@
+"""Какие вопросы чата answer_question считает локально, а какие отдает LLM"""
+
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from analytics import StatementIndex, answer_question  # noqa: E402
+
+TRANSACTIONS = [
+    {"date": "01.03.2024", "amount": 12000, "description": "Magnum", "category": "Продукты", "operation": "purchase"},
+    {"date": "05.03.2024", "amount": 3000, "description": "Yandex Go", "category": "Такси", "operation": "purchase"},
+    {"date": "10.03.2024", "amount": 8000, "description": "Magnum", "category": "Продукты", "operation": "purchase"},
+    {"date": "12.03.2024", "amount": 50000, "description": "Daniyar S.", "category": "Прочее", "operation": "transfer"},
+    {"date": "15.03.2024", "amount": 20000, "description": "ATM Kaspi Bank", "category": "Прочее", "operation": "withdrawal"},
+    {"date": "20.03.2024", "amount": 4500, "description": "Bahandi", "category": "Фастфуд", "operation": "purchase"},
+]
+
+
+@pytest.fixture
+def index():
+    return StatementIndex(TRANSACTIONS)
+
+
+@pytest.mark.parametrize("question", [
+    "How much will I spend next month?",
+    "Сколько я потрачу в следующем месяце?",
+    "What's my forecast total for next month?",
+    "Сколько мне нужно откладывать в месяц, чтобы накопить 100000?",
+    "Какой прогноз расходов?",
+    "Келесі айда қанша жұмсаймын?",
+    "How much should I be saving per month?",
+])
+def test_future_and_savings_questions_go_to_llm(index, question):
+    assert answer_question(question, index, "ru") is None
+
+
+@pytest.mark.parametrize("question", [
+    "Сколько я потратил за последние 30 дней?",
+    "How much did I spend last week?",
+    "Сколько ушло на продукты?",
+])
+def test_past_aggregations_are_answered_locally(index, question):
+    assert answer_question(question, index, "ru") is not None
+
+
+def test_top_merchants_skip_transfers_and_withdrawals(index):
+    answer = answer_question("топ 3 магазина", index, "ru")
+    assert answer.splitlines()[1].startswith("1. Magnum")
+    assert "Daniyar" not in answer and "ATM" not in answer
+
+
+def test_top_n_only_next_to_top_keyword(index):
+    answer = answer_question("top stores for the last 30 days", index, "en")
+    assert answer.startswith("Top 3 ")
+    assert answer_question("top-2 shops", index, "en").startswith("Top 2 ")
+
+
+def test_merchant_word_is_matched_as_a_word(index):
+    # "мест" внутри "вместе" - не вопрос про места
+    assert answer_question("топ вместе", index, "ru") is None
+
+
+def test_transfer_recipient_is_not_a_merchant(index):
+    assert answer_question("Сколько я потратил в Daniyar S.?", index, "ru") is None
+    assert "20 000" in answer_question("Сколько я потратил в Magnum?", index, "ru")
+
+
+def test_results_without_operation_count_as_purchases():
+    legacy = [{key: value for key, value in txn.items() if key != "operation"} for txn in TRANSACTIONS]
+    answer = answer_question("топ 1 магазин", StatementIndex(legacy), "ru")
+    assert "Daniyar S." in answer
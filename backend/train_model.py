@@ -1,77 +1,211 @@
 """
 Utility script that trains a simple keyword-based expense classifier.
 
-The model is saved as JSON so it can be loaded without external ML libraries.
+The model is saved as JSON so it can be loaded without external ML libraries,
+and as a memory-mappable binary (expense_classifier.bin) that the server loads.
+Alongside them the raw counts are kept in a compact binary file, so newly
+corrected transactions can be folded in with --partial instead of a full pass.
+
+    python train_model.py                                  # полное обучение
+    python train_model.py --data history.csv --workers 4   # большой CSV, по шардам
+    python train_model.py --partial corrections.csv        # дообучение
 """
 
+import argparse
 import csv
 import json
 import math
 import re
 from collections import Counter, defaultdict
+from itertools import islice
+from multiprocessing import Pool
 from pathlib import Path
-from typing import Dict, List
+from typing import Dict, Iterable, Iterator, List
 
 ROOT = Path(__file__).parent
 DATA_PATH = ROOT / "data" / "sample_transactions.csv"
 MODEL_PATH = ROOT / "models" / "expense_classifier.json"
+BINARY_MODEL_PATH = ROOT / "models" / "expense_classifier.bin"
+COUNTS_PATH = ROOT / "models" / "expense_counts.npz"
 TOKEN_PATTERN = re.compile(r"[A-Za-zА-Яа-яЁё]+")
+CHUNK_SIZE = 50_000
 
 
 def tokenize(text: str) -> List[str]:
     return TOKEN_PATTERN.findall(text.lower())
 
 
-def train() -> None:
-    category_counts: Counter[str] = Counter()
-    token_counts: Dict[str, Counter[str]] = defaultdict(Counter)
+class TrainingCounts:
+    """Достаточная статистика наивного Байеса: документы и токены по категориям"""
 
-    with DATA_PATH.open("r", encoding="utf-8") as csv_file:
-        reader = csv.DictReader(csv_file)
-        for row in reader:
+    def __init__(self) -> None:
+        self.category_counts: Counter[str] = Counter()
+        self.token_counts: Dict[str, Counter[str]] = defaultdict(Counter)
+
+    def update(self, rows: Iterable[dict]) -> "TrainingCounts":
+        for row in rows:
             amount = float(row["amount"])
             if amount >= 0:
                 continue  # skip пополнения
 
             category = row["category"]
-            category_counts[category] += 1
-
-            tokens = tokenize(row["description"])
-            token_counts[category].update(tokens)
-
-    total_docs = sum(category_counts.values())
-    vocab = set()
-    for counter in token_counts.values():
-        vocab.update(counter.keys())
-
-    model = {
-        "category_priors": {
-            category: count / total_docs for category, count in category_counts.items()
-        },
-        "token_likelihoods": {
-            category: {
-                token: (count + 1)
-                / (sum(counter.values()) + len(vocab))
-                for token, count in counter.items()
-            }
-            for category, counter in token_counts.items()
-        },
-        "default_likelihood": {
-            category: 1 / (sum(counter.values()) + len(vocab))
-            for category, counter in token_counts.items()
-        },
-        "vocabulary": list(vocab),
-    }
+            self.category_counts[category] += 1
+            self.token_counts[category].update(tokenize(row["description"]))
+        return self
+
+    def merge(self, other: "TrainingCounts") -> "TrainingCounts":
+        self.category_counts.update(other.category_counts)
+        for category, counter in other.token_counts.items():
+            self.token_counts[category].update(counter)
+        return self
+
+    @property
+    def total_docs(self) -> int:
+        return sum(self.category_counts.values())
+
+    def vocabulary(self) -> List[str]:
+        vocab = set()
+        for counter in self.token_counts.values():
+            vocab.update(counter.keys())
+        return sorted(vocab)
+
+    def to_model(self) -> dict:
+        total_docs = self.total_docs
+        vocab_size = len(self.vocabulary())
+        # Знаменатель сглаживания считается один раз на категорию, а не на каждый токен
+        denominators = {
+            category: sum(counter.values()) + vocab_size
+            for category, counter in self.token_counts.items()
+        }
+        return {
+            "category_priors": {
+                category: count / total_docs for category, count in self.category_counts.items()
+            },
+            "token_likelihoods": {
+                category: {
+                    token: (count + 1) / denominators[category]
+                    for token, count in counter.items()
+                }
+                for category, counter in self.token_counts.items()
+            },
+            "default_likelihood": {
+                category: 1 / denominator for category, denominator in denominators.items()
+            },
+            "vocabulary": self.vocabulary(),
+        }
+
+    def save(self, path: Path = COUNTS_PATH) -> None:
+        """Сырые счетчики в сжатом бинарном виде: матрица (категории x словарь)"""
+        import numpy as np
+
+        categories = sorted(self.category_counts)
+        vocab = self.vocabulary()
+        index = {token: i for i, token in enumerate(vocab)}
+        matrix = np.zeros((len(categories), len(vocab)), dtype=np.int64)
+        for row, category in enumerate(categories):
+            counter = self.token_counts.get(category, {})
+            if counter:
+                matrix[row, [index[t] for t in counter]] = list(counter.values())
+        np.savez_compressed(
+            path,
+            categories=np.array(categories),
+            documents=np.array([self.category_counts[c] for c in categories], dtype=np.int64),
+            vocabulary=np.array(vocab),
+            token_counts=matrix,
+        )
+
+    @classmethod
+    def load(cls, path: Path = COUNTS_PATH) -> "TrainingCounts":
+        import numpy as np
+
+        counts = cls()
+        # Каждое обращение data[...] заново распаковывает массив - читаем каждый ровно один раз
+        with np.load(path) as data:
+            categories = data["categories"].tolist()
+            documents = data["documents"].tolist()
+            vocab = data["vocabulary"].tolist()
+            matrix = data["token_counts"]
+        rows, cols = np.nonzero(matrix)
+        values = matrix[rows, cols].tolist()
+        for row, category in enumerate(categories):
+            counts.category_counts[category] = int(documents[row])
+            counts.token_counts[category] = Counter()
+        for row, col, value in zip(rows.tolist(), cols.tolist(), values):
+            counts.token_counts[categories[row]][vocab[col]] = value
+        return counts
+
+
+def iter_chunks(path: Path, chunk_size: int = CHUNK_SIZE) -> Iterator[List[dict]]:
+    """Потоковое чтение CSV кусками, чтобы не держать весь файл в памяти"""
+    with path.open("r", encoding="utf-8") as csv_file:
+        reader = csv.DictReader(csv_file)
+        while True:
+            chunk = list(islice(reader, chunk_size))
+            if not chunk:
+                return
+            yield chunk
+
+
+def count_chunk(rows: List[dict]) -> TrainingCounts:
+    return TrainingCounts().update(rows)
+
+
+def count_file(path: Path, chunk_size: int = CHUNK_SIZE, workers: int = 1) -> TrainingCounts:
+    """Считает статистику по CSV; с workers > 1 шарды считаются в пуле процессов и сливаются"""
+    counts = TrainingCounts()
+    if workers <= 1:
+        for chunk in iter_chunks(path, chunk_size):
+            counts.update(chunk)
+        return counts
+    with Pool(workers) as pool:
+        for shard in pool.imap_unordered(count_chunk, iter_chunks(path, chunk_size)):
+            counts.merge(shard)
+    return counts
+
 
+def save_model(counts: TrainingCounts) -> None:
+    # Бинарный формат для сервера живет в classifier.py (нужен numpy)
+    from classifier import ExpenseClassifier
+
+    model = counts.to_model()
     MODEL_PATH.parent.mkdir(parents=True, exist_ok=True)
     with MODEL_PATH.open("w", encoding="utf-8") as f:
-        json.dump(model, f, ensure_ascii=False, indent=2)
+        json.dump(model, f, ensure_ascii=False, separators=(",", ":"))
+    ExpenseClassifier.from_json(model).save_binary(BINARY_MODEL_PATH)
+    counts.save(COUNTS_PATH)
+
 
-    print(f"Model trained on {total_docs} расходных операций.")
-    print(f"Vocabulary size: {len(vocab)} токенов.")
+def train(data_path: Path = DATA_PATH, chunk_size: int = CHUNK_SIZE, workers: int = 1) -> None:
+    counts = count_file(data_path, chunk_size, workers)
+    save_model(counts)
+
+    print(f"Model trained on {counts.total_docs} расходных операций.")
+    print(f"Vocabulary size: {len(counts.vocabulary())} токенов.")
     print(f"Model saved to {MODEL_PATH}")
 
 
-if __name__ == "__main__":
-    train()
+def partial_fit(paths: Iterable[Path], chunk_size: int = CHUNK_SIZE) -> None:
+    """Добавляет новые (исправленные) транзакции к сохраненным счетчикам без полного прохода"""
+    counts = TrainingCounts.load(COUNTS_PATH)
+    before = counts.total_docs
+    for path in paths:
+        for chunk in iter_chunks(path, chunk_size):
+            counts.update(chunk)
+    save_model(counts)
 
+    print(f"Model updated with {counts.total_docs - before} новых операций (всего {counts.total_docs}).")
+    print(f"Model saved to {MODEL_PATH}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Обучение классификатора расходов")
+    parser.add_argument("--data", type=Path, default=DATA_PATH)
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE)
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--partial", type=Path, nargs="+", help="CSV с новыми транзакциями для дообучения")
+    args = parser.parse_args()
+
+    if args.partial:
+        partial_fit(args.partial, args.chunk_size)
+    else:
+        train(args.data, args.chunk_size, args.workers)
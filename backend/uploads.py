@@ -0,0 +1,187 @@
+"""
+Прием загруженных PDF без лишних копий в памяти.
+
+Starlette уже держит тело multipart в SpooledTemporaryFile (до 1 МБ в
+памяти, дальше на диске). spool_upload переписывает его кусками по
+UPLOAD_CHUNK_BYTES во временный файл с путем - воркеры pdfplumber открывают
+PDF по пути - и по дороге считает sha256 для ключа кэша. Целиком байты
+выписки в памяти процесса не лежат ни разу; файл больше UPLOAD_MAX_BYTES
+обрывается с UploadTooLargeError (413).
+
+UploadBudget - допуск по суммарному размеру PDF, которые сейчас открыты и
+разбираются: память pdfplumber растет вместе с размером файла. Пока сумма
+байт в работе больше UPLOAD_INFLIGHT_BYTES, новые выписки ждут в очереди
+(FIFO) до UPLOAD_QUEUE_SECONDS, потом получают BudgetExceededError (503).
+Бюджет держится только на время извлечения текста, не на ожидание LLM.
+"""
+
+import asyncio
+import hashlib
+import math
+import os
+import tempfile
+from collections import deque
+from typing import Optional
+
+UPLOAD_MAX_BYTES = int(os.getenv("UPLOAD_MAX_BYTES", str(25 * 1024 * 1024)))
+UPLOAD_CHUNK_BYTES = int(os.getenv("UPLOAD_CHUNK_BYTES", str(1024 * 1024)))
+UPLOAD_INFLIGHT_BYTES = int(os.getenv("UPLOAD_INFLIGHT_BYTES", str(128 * 1024 * 1024)))
+UPLOAD_QUEUE_SECONDS = float(os.getenv("UPLOAD_QUEUE_SECONDS", "10"))
+UPLOAD_TMP_DIR = os.getenv("UPLOAD_TMP_DIR") or None
+
+
+class UploadTooLargeError(Exception):
+    pass
+
+
+class BudgetExceededError(Exception):
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class SpooledUpload:
+    """
+    Загруженный PDF на диске. with-блок удаляет файл, если владение
+    не передано дальше через detach() (задаче анализа или очереди jobs).
+    """
+
+    def __init__(self, path: str, size: int, digest):
+        self.path = path
+        self.size = size
+        self.digest = digest
+        self.detached = False
+
+    def detach(self) -> "SpooledUpload":
+        self.detached = True
+        return self
+
+    def close(self) -> None:
+        try:
+            os.unlink(self.path)
+        except FileNotFoundError:
+            pass
+
+    def __enter__(self) -> "SpooledUpload":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        if not self.detached:
+            self.close()
+
+
+async def spool_upload(file, max_bytes: int = UPLOAD_MAX_BYTES) -> SpooledUpload:
+    """UploadFile -> временный .pdf кусками, с sha256 и ограничением размера"""
+    if file.size is not None and file.size > max_bytes:
+        raise UploadTooLargeError(f"Файл больше {max_bytes / (1024 * 1024):.3g} МБ")
+    digest = hashlib.sha256()
+    size = 0
+    tmp = tempfile.NamedTemporaryFile(suffix=".pdf", dir=UPLOAD_TMP_DIR, delete=False)
+    try:
+        with tmp:
+            while chunk := await file.read(UPLOAD_CHUNK_BYTES):
+                size += len(chunk)
+                if size > max_bytes:
+                    raise UploadTooLargeError(f"Файл больше {max_bytes / (1024 * 1024):.3g} МБ")
+                digest.update(chunk)
+                tmp.write(chunk)
+    except BaseException:
+        os.unlink(tmp.name)
+        raise
+    return SpooledUpload(tmp.name, size, digest)
+
+
+class Reservation:
+    def __init__(self, budget: "UploadBudget", size: int):
+        self._budget = budget
+        self.size = size
+        self._released = False
+
+    def release(self) -> None:
+        """Можно звать несколько раз: освобождает только первый вызов"""
+        if not self._released:
+            self._released = True
+            self._budget._release(self.size)
+
+
+class UploadBudget:
+    def __init__(self, max_bytes: int = UPLOAD_INFLIGHT_BYTES, wait_seconds: float = UPLOAD_QUEUE_SECONDS):
+        self.max_bytes = max_bytes
+        self.wait_seconds = wait_seconds
+        self.in_flight = 0
+        self.peak = 0
+        self.admitted = 0
+        self.queued = 0
+        self.rejected = 0
+        self._waiters: deque = deque()
+
+    def _fits(self, size: int) -> bool:
+        # Файл больше всего бюджета пускаем, когда больше никого нет - иначе он не пройдет никогда
+        return self.in_flight == 0 or self.in_flight + size <= self.max_bytes
+
+    def _grant(self, size: int) -> None:
+        self.in_flight += size
+        self.peak = max(self.peak, self.in_flight)
+        self.admitted += 1
+
+    def _release(self, size: int) -> None:
+        self.in_flight -= size
+        self._wake()
+
+    def _wake(self) -> None:
+        while self._waiters:
+            size, future = self._waiters[0]
+            if future.done():
+                self._waiters.popleft()
+                continue
+            if not self._fits(size):
+                return
+            self._waiters.popleft()
+            self._grant(size)
+            future.set_result(None)
+
+    async def acquire(self, size: int, wait_seconds: Optional[float] = None) -> Reservation:
+        """
+        Резервирует size байт. wait_seconds - сколько ждать в очереди:
+        по умолчанию self.wait_seconds, math.inf - без ограничения (фоновые задачи).
+        """
+        if wait_seconds is None:
+            wait_seconds = self.wait_seconds
+        if not self._waiters and self._fits(size):
+            self._grant(size)
+            return Reservation(self, size)
+
+        self.queued += 1
+        entry = (size, asyncio.get_running_loop().create_future())
+        self._waiters.append(entry)
+        try:
+            await asyncio.wait_for(entry[1], None if math.isinf(wait_seconds) else wait_seconds)
+        except BaseException as exc:
+            if entry[1].done() and not entry[1].cancelled():
+                # Место выдали в тот же момент, когда истекло ожидание
+                self._release(size)
+            else:
+                try:
+                    self._waiters.remove(entry)
+                except ValueError:
+                    pass
+                self._wake()
+            if isinstance(exc, asyncio.TimeoutError):
+                self.rejected += 1
+                raise BudgetExceededError(
+                    "Сервер занят разбором других выписок, повторите позже",
+                    retry_after=max(1.0, self.wait_seconds),
+                ) from None
+            raise
+        return Reservation(self, size)
+
+    def stats(self) -> dict:
+        return {
+            "in_flight_bytes": self.in_flight,
+            "max_bytes": self.max_bytes,
+            "peak_bytes": self.peak,
+            "waiting": len(self._waiters),
+            "admitted": self.admitted,
+            "queued": self.queued,
+            "rejected": self.rejected,
+        }
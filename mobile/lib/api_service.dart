@@ -1,3 +1,4 @@
+import 'dart:convert';
 import 'dart:io';
 import 'package:dio/dio.dart';
 import 'package:shared_preferences/shared_preferences.dart';
@@ -36,28 +37,111 @@ class ApiService {
     }
   }
 
+  // Потоковая загрузка: события анализа по мере разбора выписки
+  // (progress, transactions, categories, reset, done; error - сервер занят, повторить
+  // через retry_after секунд) - см. backend/main.py -> /analyze/stream
+  Stream<Map<String, dynamic>> uploadStatementStream(File file) async* {
+    String fileName = file.path.split('/').last;
+    FormData formData = FormData.fromMap({
+      "file": await MultipartFile.fromFile(file.path, filename: fileName),
+    });
+    Response<ResponseBody> response = await _dio.post<ResponseBody>(
+      '$_baseUrl/analyze/stream',
+      data: formData,
+      queryParameters: {'language': AppStrings.languageCode},
+      options: Options(responseType: ResponseType.stream),
+    );
+    yield* _sseEvents(response);
+  }
+
+  // Разбор Server-Sent Events: {"event": имя, "data": JSON из строки data}
+  Stream<Map<String, dynamic>> _sseEvents(Response<ResponseBody> response) async* {
+    String event = 'message';
+    await for (final line in response.data!.stream
+        .cast<List<int>>()
+        .transform(utf8.decoder)
+        .transform(const LineSplitter())) {
+      if (line.startsWith('event: ')) {
+        event = line.substring(7);
+      } else if (line.startsWith('data: ')) {
+        yield {"event": event, "data": jsonDecode(line.substring(6))};
+      }
+    }
+  }
+
+  // Тело запроса к /chat и /chat/stream: вопрос, язык, цель и context_id (если есть)
+  Future<Map<String, dynamic>> _chatPayload(String question, Map<String, dynamic> fullJsonContext) async {
+    // 📖 ИСПОЛЬЗОВАНИЕ: Загружаем сохраненную финансовую цель из SharedPreferences
+    // Ключ: 'user_goal'
+    // Сохранение: goals_screen.dart -> _saveData()
+    // Отправляется на бэкенд: backend/main.py -> ChatRequest.user_goal -> используется в системном промпте
+    final prefs = await SharedPreferences.getInstance();
+    final userGoal = prefs.getString('user_goal') ?? '';
+    final contextId = fullJsonContext['context_id'];
+    return {
+      "question": question,
+      "language": AppStrings.languageCode, // Передаем текущий язык приложения
+      "user_goal": userGoal, // Добавляем финансовую цель пользователя
+      if (contextId != null) "context_id": contextId,
+    };
+  }
+
   // 👇 НОВЫЙ МЕТОД ДЛЯ ЧАТА 👇
   Future<String> sendChatMessage(String question, Map<String, dynamic> fullJsonContext) async {
     try {
-      // 📖 ИСПОЛЬЗОВАНИЕ: Загружаем сохраненную финансовую цель из SharedPreferences
-      // Ключ: 'user_goal'
-      // Сохранение: goals_screen.dart -> _saveData()
-      // Отправляется на бэкенд: backend/main.py -> ChatRequest.user_goal -> используется в системном промпте
-      final prefs = await SharedPreferences.getInstance();
-      final userGoal = prefs.getString('user_goal') ?? '';
-      
-      final response = await _dio.post(
-        '$_baseUrl/chat',
-        data: {
-          "question": question,
-          "context": fullJsonContext,
-          "language": AppStrings.languageCode, // Передаем текущий язык приложения
-          "user_goal": userGoal, // Добавляем финансовую цель пользователя
-        },
-      );
+      final data = await _chatPayload(question, fullJsonContext);
+      Response response;
+      if (data.containsKey('context_id')) {
+        // Данные уже на сервере: отправляем только context_id
+        try {
+          response = await _dio.post('$_baseUrl/chat', data: data);
+          return response.data['reply'];
+        } on DioException catch (e) {
+          // Контекст истек на сервере - отправим данные целиком
+          if (e.response?.statusCode != 404) rethrow;
+        }
+      }
+      data.remove('context_id');
+      response = await _dio.post('$_baseUrl/chat', data: {...data, "context": fullJsonContext});
       return response.data['reply'];
     } catch (e) {
       return AppStrings.get('chat_error');
     }
   }
+
+  // Ответ чата по мере генерации (/chat/stream): каждый элемент - весь текст, полученный к этому моменту.
+  // Если поток не открылся (контекст истек, старый сервер, сеть) - один ответ через sendChatMessage
+  Stream<String> sendChatMessageStream(String question, Map<String, dynamic> fullJsonContext) async* {
+    final data = await _chatPayload(question, fullJsonContext);
+    if (!data.containsKey('context_id')) data['context'] = fullJsonContext;
+    String reply = '';
+    try {
+      final response = await _dio.post<ResponseBody>(
+        '$_baseUrl/chat/stream',
+        data: data,
+        options: Options(responseType: ResponseType.stream),
+      );
+      await for (final message in _sseEvents(response)) {
+        switch (message['event']) {
+          case 'delta':
+            reply += message['data']['text'];
+            yield reply;
+            break;
+          case 'done':
+          case 'error':
+            yield message['data']['reply'];
+            return;
+        }
+      }
+    } catch (e) {
+      if (reply.isEmpty) {
+        yield await sendChatMessage(question, fullJsonContext);
+        return;
+      }
+      // Поток оборвался посередине - оставляем полученное и сообщаем об ошибке
+      yield '$reply\n\n${AppStrings.get('chat_error')}';
+      return;
+    }
+    if (reply.isEmpty) yield AppStrings.get('chat_error');
+  }
 }
\ No newline at end of file
@@ -97,17 +97,27 @@ class _ChatScreenState extends State<ChatScreen> {
     });
     _scrollToBottom();
 
-    final reply = await _apiService.sendChatMessage(text, widget.rawContext);
+    // Ответ появляется по мере генерации: первый кусок заменяет "AI печатает...", следующие дописывают пузырь
+    Map<String, String>? answer;
+    await for (final reply in _apiService.sendChatMessageStream(text, widget.rawContext)) {
+      if (!mounted) continue;
+      setState(() {
+        if (answer == null) {
+          _isTyping = false;
+          answer = {"role": "ai", "text": reply};
+          widget.messages.add(answer!);
+        } else {
+          answer!["text"] = reply;
+        }
+      });
+      _scrollToBottom();
+    }
 
     // Увеличиваем счетчик использований только при успешной отправке
     await usageManager.incrementUsage();
 
-    if (mounted) {
-      setState(() {
-        _isTyping = false;
-        widget.messages.add({"role": "ai", "text": reply});
-      });
-      _scrollToBottom();
+    if (mounted && _isTyping) {
+      setState(() => _isTyping = false);
     }
   }
 
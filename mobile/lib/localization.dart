@@ -50,6 +50,16 @@ class AppStrings {
       Language.kz: 'Kaspi үзіндісін жүктеңіз (PDF)',
       Language.en: 'Upload Kaspi Statement (PDF)',
     },
+    'upload_progress_pages': {
+      Language.ru: 'Страница {page} из {pages}',
+      Language.kz: '{pages} беттің {page}-беті',
+      Language.en: 'Page {page} of {pages}',
+    },
+    'upload_progress_found': {
+      Language.ru: 'Найдено транзакций: {count}',
+      Language.kz: 'Табылған транзакциялар: {count}',
+      Language.en: 'Transactions found: {count}',
+    },
     'upload_screen_btn': {
       Language.ru: 'Выбрать файл',
       Language.kz: 'Файлды таңдау',
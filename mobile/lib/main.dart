@@ -3,6 +3,7 @@ import 'dart:io';
 import 'dart:convert';
 import 'package:fl_chart/fl_chart.dart';
 import 'package:flutter/material.dart';
+import 'package:dio/dio.dart';
 import 'package:file_picker/file_picker.dart';
 import 'package:google_fonts/google_fonts.dart';
 import 'package:intl/intl.dart';
@@ -143,6 +144,7 @@ class _FinanceScreenState extends State<FinanceScreen> {
   FinanceData? _data;
   Map<String, dynamic>? _rawJson;
   bool _isLoading = false;
+  String? _loadingProgress; // Стадия потокового анализа под лоадером
   String? _error;
   final List<Map<String, String>> _chatHistory = [];
   FilterPeriod _selectedPeriod = FilterPeriod.all;
@@ -194,7 +196,7 @@ class _FinanceScreenState extends State<FinanceScreen> {
         File file = File(result.files.single.path!);
         
         try {
-          final jsonResponse = await _apiService.uploadStatement(file);
+          final jsonResponse = await _uploadWithProgress(file);
           
           // Проверяем, что ответ не пустой
           if (jsonResponse.isEmpty) {
@@ -248,11 +250,59 @@ class _FinanceScreenState extends State<FinanceScreen> {
       });
     } finally {
       if (mounted) {
-      setState(() => _isLoading = false);
+      setState(() {
+        _isLoading = false;
+        _loadingProgress = null;
+      });
       }
     }
   }
 
+  // Анализ через /analyze/stream: лоадер показывает страницы и найденные транзакции,
+  // ответ - данные события done (тот же JSON, что у /analyze)
+  Future<Map<String, dynamic>> _uploadWithProgress(File file) async {
+    int pages = 0;
+    int found = 0;
+    try {
+      await for (final message in _apiService.uploadStatementStream(file)) {
+        final data = message['data'];
+        switch (message['event']) {
+          case 'progress':
+            if (data['stage'] == 'extract') {
+              pages = data['pages'] ?? pages;
+              if (pages > 0 && (data['page'] ?? 0) > 0) {
+                _setLoadingProgress(AppStrings.get('upload_progress_pages')
+                    .replaceAll('{page}', '${data['page']}')
+                    .replaceAll('{pages}', '$pages'));
+              }
+            }
+            break;
+          case 'transactions':
+            found += (data['transactions'] as List).length;
+            _setLoadingProgress(AppStrings.get('upload_progress_found').replaceAll('{count}', '$found'));
+            break;
+          case 'reset':
+            found = 0;
+            break;
+          case 'error':
+            // Сервер занят другими выписками - повторить через retry_after секунд
+            throw Exception(data['message']);
+          case 'done':
+            return Map<String, dynamic>.from(data);
+        }
+      }
+    } on DioException catch (e) {
+      // Старый сервер без /analyze/stream
+      if (e.response?.statusCode != 404) rethrow;
+      return _apiService.uploadStatement(file);
+    }
+    throw Exception("Поток анализа оборвался без результата");
+  }
+
+  void _setLoadingProgress(String text) {
+    if (mounted) setState(() => _loadingProgress = text);
+  }
+
   @override
   Widget build(BuildContext context) {
     final kztFormatter = NumberFormat.currency(symbol: '₸', decimalDigits: 0, locale: 'ru');
@@ -311,7 +361,7 @@ class _FinanceScreenState extends State<FinanceScreen> {
         ],
       ),
       body: _isLoading
-          ? const FunLoader()
+          ? FunLoader(progress: _loadingProgress)
           : _data == null
           ? _buildUploadButton()
               : _buildDashboard(kztFormatter, isDark),
@@ -839,7 +889,9 @@ class _FinanceScreenState extends State<FinanceScreen> {
 
 // (Код FunLoader остался таким же, можно оставить его внизу файла)
 class FunLoader extends StatefulWidget {
-  const FunLoader({super.key});
+  final String? progress;
+
+  const FunLoader({super.key, this.progress});
 
   @override
   State<FunLoader> createState() => _FunLoaderState();
@@ -890,6 +942,14 @@ class _FunLoaderState extends State<FunLoader> {
               style: GoogleFonts.inter(fontSize: 18, fontWeight: FontWeight.w500),
             ),
           ),
+          if (widget.progress != null) ...[
+            const SizedBox(height: 12),
+            Text(
+              widget.progress!,
+              textAlign: TextAlign.center,
+              style: GoogleFonts.inter(fontSize: 14, color: Colors.grey),
+            ),
+          ],
         ],
       ),
     );